@@ -0,0 +1,42 @@
+"""予算ごとの100円単位の掛け金の配分の実行時間を計測する
+
+python -m benchmarks.bench_allocation
+"""
+
+import timeit
+from typing import Dict
+
+import numpy as np
+
+from src.allocation import allocate_bets
+from tests.helpers import make_race
+
+BUDGETS = [1000, 10000, 50000]
+
+
+def run(seeds: int = 10) -> Dict[str, float]:
+    """予算ごとの1回あたりの秒数を返す
+
+    配分の比率は馬券数が多く丸めで目標回収率を下回りやすい, 全馬に配分した場合とする.
+    """
+    races = []
+    for seed in range(seeds):
+        pred, odds = make_race(12, seed)
+        fraction = np.random.default_rng(seed).dirichlet(np.ones(len(pred) + 1))
+        races.append((fraction[:-1], odds.to_numpy()))
+
+    results = {}
+    for budget in BUDGETS:
+
+        def allocate_all():
+            for fraction, odds in races:
+                allocate_bets(fraction, odds, budget, exceed_profit_rate=1.1)
+
+        seconds = min(timeit.repeat(allocate_all, number=1, repeat=3))
+        results[f"budget{budget}/seconds"] = seconds / seeds
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:35s} {value * 1e3:10.3f} ms")
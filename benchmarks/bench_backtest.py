@@ -0,0 +1,46 @@
+"""バックテストの1プロセスとプロセスプールでの処理速度を計測する
+
+python -m benchmarks.bench_backtest
+"""
+
+import time
+from typing import Dict, List
+
+from src.backtest import Backtester, BacktestRace
+from tests.helpers import make_race
+
+
+def make_races(num_races: int) -> List[BacktestRace]:
+    races = []
+    for seed in range(num_races):
+        pred, odds = make_race(8 + seed % 11, seed)
+        winner = pred.idxmax()
+        races.append(
+            BacktestRace(
+                f"race{seed:05}",
+                "230513",
+                seed,
+                f"{seed % 10 + 1:02}",
+                pred.to_dict(),
+                odds.to_dict(),
+                {winner: odds[winner] * 100},
+            )
+        )
+    return races
+
+
+def run(num_races: int = 2000) -> Dict[str, float]:
+    """1分あたりにバックテストできるレース数を返す"""
+    races = make_races(num_races)
+    results = {}
+    for name, max_workers in [("inline", 1), ("pool", None)]:
+        start = time.perf_counter()
+        Backtester(max_workers=max_workers).run(races)
+        seconds = time.perf_counter() - start
+        results[f"{name}/races_per_minute"] = num_races / seconds * 60
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:35s} {value:12.0f}")
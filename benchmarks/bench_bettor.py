@@ -0,0 +1,61 @@
+"""頭数ごとのオッズ行列の作成と単勝の最適化・ケリー基準の実行時間, 最適化のピークメモリを計測する
+
+python -m benchmarks.bench_bettor
+"""
+
+import timeit
+import tracemalloc
+from typing import Dict
+
+from src.bettor import KellyTansyoBettor, OptimizeTansyoBettor
+from tests.helpers import make_race
+
+# 出走頭数の範囲
+FIELD_SIZES = range(5, 19)
+
+
+def run(seeds: int = 10, number: int = 200) -> Dict[str, float]:
+    """頭数ごとの1回あたりの秒数と select_bet のピークメモリ (MB) を返す"""
+    bettor = OptimizeTansyoBettor()
+    kelly_bettor = KellyTansyoBettor()
+    results = {}
+    for n in FIELD_SIZES:
+        races = [make_race(n, seed) for seed in range(seeds)]
+
+        pred, odds = races[0]
+        index = list(pred.index)
+        odds_values = odds.values
+        seconds = timeit.timeit(
+            lambda: bettor._generate_odds_matrix(odds_values, index, index),
+            number=number,
+        )
+        results[f"n{n:02}/generate_odds_matrix/seconds"] = seconds / number
+
+        def select_all():
+            for pred, odds in races:
+                bettor.select_bet(pred, odds)
+
+        seconds = min(timeit.repeat(select_all, number=1, repeat=3))
+        results[f"n{n:02}/select_bet/seconds"] = seconds / seeds
+
+        tracemalloc.start()
+        bettor.select_bet(pred, odds)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[f"n{n:02}/select_bet/peak_mb"] = peak / 1e6
+
+        def select_all_kelly():
+            for pred, odds in races:
+                kelly_bettor.select_bet(pred, odds)
+
+        seconds = min(timeit.repeat(select_all_kelly, number=1, repeat=3))
+        results[f"n{n:02}/kelly_select_bet/seconds"] = seconds / seeds
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        if name.endswith("seconds"):
+            print(f"{name:35s} {value * 1e3:10.3f} ms")
+        else:
+            print(f"{name:35s} {value * 1e3:10.3f} KB")
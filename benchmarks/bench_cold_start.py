@@ -0,0 +1,30 @@
+"""新しいプロセスで main を読み込むまでの時間を計測する
+
+cron やHTTPトリガーで毎回プロセスを起動する場合の起動時間にあたる.
+
+python -m benchmarks.bench_cold_start
+"""
+
+from typing import Dict
+
+from tests.helpers import measure_import
+
+
+def run(repeat: int = 5) -> Dict[str, float]:
+    """main とオッズ取得・最適化で使うモジュールの読み込み秒数を返す"""
+    results = {}
+    for name, module in [
+        ("main", "main"),
+        ("bettor", "src.bettor"),
+        ("scraper", "src.scraper"),
+        ("driver_pool", "src.driver_pool"),
+        ("read_google_drive_json", "src.read_google_drive_json"),
+    ]:
+        seconds = min(measure_import(module)[0] for _ in range(repeat))
+        results[f"import_{name}/seconds"] = seconds
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:40s} {value * 1e3:10.1f} ms")
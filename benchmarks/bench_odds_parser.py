@@ -0,0 +1,62 @@
+"""オッズページと馬券種ごとのオッズAPIのレスポンスのパース時間を計測する
+
+python -m benchmarks.bench_odds_parser
+"""
+
+import timeit
+from pathlib import Path
+from typing import Dict
+
+from bs4 import BeautifulSoup
+
+from src.odds_parser import (
+    available_backends,
+    parse_tansyo_odds,
+    parse_ticket_odds_api,
+)
+from tests.helpers import make_ticket_odds_response
+
+DATA_DIR = Path(__file__).parent.parent / "tests" / "data"
+
+
+def parse_with_soup_find(html: str) -> Dict[str, float]:
+    """馬ごとに soup.find を呼ぶ従来の実装"""
+    soup = BeautifulSoup(html, "html.parser")
+
+    tracks = soup.find(class_="RaceOdds_HorseList Tanfuku", id="odds_fuku_block")
+    odds_dict = {}
+    for track in tracks.select("[class='W31']"):
+        uma_kumi = str(track.contents[0])
+        odds = soup.find("span", id="odds-1_{}".format(uma_kumi.zfill(2)))
+        if odds is not None:
+            odds_dict[uma_kumi] = float(odds.string)
+    return odds_dict
+
+
+def run(number: int = 50) -> Dict[str, float]:
+    """記録済みページごと・パーサーごとと, 18頭の馬券種ごとの1回あたりの秒数を返す"""
+    results = {}
+    for path in sorted(DATA_DIR.glob("odds_b1_*.html")):
+        html = path.read_text("euc_jp")
+        if path.stem == "odds_b1_202305021211":
+            # 取消馬を含むページは従来の実装では読めない
+            seconds = timeit.timeit(lambda: parse_with_soup_find(html), number=number)
+            results[f"{path.stem}/soup_find/seconds"] = seconds / number
+        for backend in available_backends():
+            seconds = timeit.timeit(
+                lambda: parse_tansyo_odds(html, backend), number=number
+            )
+            results[f"{path.stem}/{backend}/seconds"] = seconds / number
+
+    for bet_type in ["umaren", "wide", "umatan", "sanrentan"]:
+        response = make_ticket_odds_response(bet_type, 18)
+        seconds = timeit.timeit(
+            lambda: parse_ticket_odds_api(response, bet_type), number=number
+        )
+        results[f"api_n18/{bet_type}/seconds"] = seconds / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:45s} {seconds * 1e6:10.1f} us")
@@ -0,0 +1,60 @@
+"""オッズの記録にかかる時間と, 1開催日分の記録から1レースの推移を読む時間を計測する
+
+python -m benchmarks.bench_odds_recorder
+"""
+
+import tempfile
+import timeit
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_pred_loader import RACES_PER_DAY, measure
+from src.odds_recorder import OddsArchive, OddsRecorder
+
+# 1レースあたりのオッズの取得回数 (発売開始から発走まで1分ごと)
+SNAPSHOTS_PER_RACE = 60
+NUM_HORSES = 16
+
+
+def record_day(path: str, seed: int = 0):
+    """1開催日分のオッズを記録する. 30回の取得ごとに書き込む"""
+    rng = np.random.default_rng(seed)
+    index = [str(umaban + 1) for umaban in range(NUM_HORSES)]
+    with OddsRecorder(path, flush_interval=3600) as recorder:
+        for snapshot in range(SNAPSHOTS_PER_RACE):
+            for race in range(RACES_PER_DAY):
+                odds = pd.Series(rng.uniform(1.1, 300, NUM_HORSES), index=index)
+                recorder.record(f"2023050212{race:02}", odds, timestamp=snapshot * 60)
+            if snapshot % 30 == 29:
+                recorder.flush()
+
+
+def run() -> Dict[str, float]:
+    results = {}
+    index = [str(umaban + 1) for umaban in range(NUM_HORSES)]
+    odds = pd.Series(np.linspace(1.5, 200, NUM_HORSES), index=index)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with OddsRecorder(tmp_dir, flush_interval=3600) as recorder:
+            # 取得のたびに呼ばれる record() の時間. 書き込みは含まない
+            number = 1000
+            seconds = min(
+                timeit.repeat(
+                    lambda: recorder.record("202305021201", odds), number=number
+                )
+            )
+            results["record/seconds"] = seconds / number
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        record_day(tmp_dir)
+        race_id = f"2023050212{RACES_PER_DAY // 2:02}"
+        seconds, peak = measure(lambda: OddsArchive(tmp_dir).history(race_id))
+        results["history/seconds"] = seconds
+        results["history/peak_mb"] = peak / 1e6
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:35s} {value:10.6f}")
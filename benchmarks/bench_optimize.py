@@ -0,0 +1,77 @@
+"""単勝の最適化の関数評価回数と実行時間を計測する
+
+python -m benchmarks.bench_optimize
+"""
+
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+import scipy.optimize as sco
+
+from src.bettor import OptimizeTansyoBettor
+from tests.helpers import make_race
+
+
+def finite_difference_objective(weights, odds_matrix, pred):
+    """勾配を差分近似していた従来の目的関数"""
+    return -(pred * np.dot(odds_matrix, weights)).mean() / np.sqrt(
+        np.cov(pred * np.dot(odds_matrix, weights))
+    )
+
+
+def solve(n: int, seed: int, analytic: bool) -> Tuple[int, float]:
+    """1レースを最適化し、関数評価回数と秒数を返す"""
+    bettor = OptimizeTansyoBettor()
+    pred, odds = make_race(n, seed)
+    index = list(pred.index)
+    odds_matrix = bettor._generate_odds_matrix(odds.values, index, index) - 1
+    x0 = np.ones(n + 1) / (n + 1)
+    bounds = [(0, 1)] * (n + 1)
+
+    start = time.perf_counter()
+    if analytic:
+        opts = sco.minimize(
+            fun=bettor._objective,
+            x0=x0,
+            args=(pred.values[:, np.newaxis] * odds_matrix,),
+            jac=True,
+            method="SLSQP",
+            bounds=bounds,
+            constraints=[
+                {
+                    "type": "ineq",
+                    "fun": lambda x: -np.sum(x) + 1,
+                    "jac": lambda x: -np.ones_like(x),
+                }
+            ],
+        )
+    else:
+        opts = sco.minimize(
+            fun=finite_difference_objective,
+            x0=x0,
+            args=(odds_matrix, pred.values),
+            method="SLSQP",
+            bounds=bounds,
+            constraints=[{"type": "ineq", "fun": lambda x: -np.sum(x) + 1}],
+        )
+    return opts["nfev"], time.perf_counter() - start
+
+
+def run(seeds: int = 20) -> Dict[str, float]:
+    """頭数ごとの平均関数評価回数と1レースあたりの秒数を返す"""
+    results = {}
+    for n in (8, 12, 16, 18):
+        for analytic in (False, True):
+            name = "analytic" if analytic else "finite_difference"
+            nfev, seconds = np.mean(
+                [solve(n, seed, analytic) for seed in range(seeds)], axis=0
+            )
+            results[f"n{n}/{name}/nfev"] = float(nfev)
+            results[f"n{n}/{name}/seconds"] = float(seconds)
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:35s} {value:12.6f}")
@@ -0,0 +1,144 @@
+"""発走前のレースの抽出と notify_bet 全体の実行時間を計測する
+
+notify_bet はオッズの取得と通知を記録済みのレスポンスとメモリ上の記録に置き換え,
+I/Oを除いた処理時間を計測する.
+
+python -m benchmarks.bench_pipeline
+"""
+
+import datetime
+import json
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_pred_loader import DAYS_PER_SEASON, make_pred_json
+from main import get_pred_in_time_range, notify_bet
+from src.bettor import OptimizeTansyoBettor
+from src.driver_pool import ChromeDriverPool
+from src.odds_parser import parse_tansyo_odds_api
+from src.pred_store import PredStore
+from src.race_id import make_race_id
+from src.solution_cache import SolutionCache
+
+DATA_DIR = Path(__file__).parent.parent / "tests" / "data"
+
+
+class RecordedOddsFetcher:
+    """記録済みのオッズAPIのレスポンスを返す"""
+
+    def __init__(self, responses: Dict[str, Dict[str, Any]]):
+        self._responses = responses
+
+    def fetch_odds_api(self, race_id: str, odds_type: int = 1) -> Dict[str, Any]:
+        return self._responses[race_id]
+
+    def fetch_odds_page(self, race_id: str) -> str:
+        raise ValueError("ページは記録していません")
+
+
+class RecordingDispatcher:
+    """通知を送らずに記録する"""
+
+    def __init__(self):
+        self.messages: List[Any] = []
+
+    def notify(
+        self,
+        title: str,
+        bet: pd.Series,
+        expires_at: Optional[float] = None,
+        on_sent: Optional[Callable[[], None]] = None,
+    ):
+        self.messages.append((title, bet))
+
+
+def _no_driver():
+    raise RuntimeError("ベンチマークではブラウザを使わない")
+
+
+def make_pipeline_races(num_races: int, seed: int = 0):
+    """記録済みのオッズに合わせた予測を持つレースと, race_id ごとのレスポンスを作る"""
+    rng = np.random.default_rng(seed)
+    recorded = [
+        json.loads(path.read_text())
+        for path in sorted(DATA_DIR.glob("odds_api_b1_*.json"))
+    ]
+    races = []
+    responses = {}
+    for i in range(num_races):
+        response = recorded[i % len(recorded)]
+        # 取消馬を除いた馬番
+        umaban_list = list(parse_tansyo_odds_api(response).index)
+        race = {
+            "Jyo": "東京",
+            "JyoCD": "05",
+            "Kaiji": "02",
+            "Nichiji": "08",
+            "RaceNum": f"{i % 12 + 1:02}",
+            "Kyori": "1600",
+            "Syubetu": "サラ系3歳",
+            "Jyoken": "未勝利",
+            "Title": "nan",
+            "pred": dict(
+                zip(umaban_list, rng.dirichlet(np.ones(len(umaban_list))).tolist())
+            ),
+        }
+        races.append(race)
+        # notify_bet と同じく現在の年でレースIDを作る
+        race_id = make_race_id(
+            datetime.datetime.now().strftime("%y"),
+            race["JyoCD"],
+            race["Kaiji"],
+            race["Nichiji"],
+            race["RaceNum"],
+        )
+        responses[race_id] = response
+    return races, responses
+
+
+def run(number: int = 20, num_races: int = 3) -> Dict[str, float]:
+    """1回あたりの秒数を返す"""
+    results = {}
+
+    # 1シーズン分の予測JSONから発走5~10分前のレースを抽出する
+    pred = make_pred_json(DAYS_PER_SEASON)
+    year = list(pred)[-1]
+    month_day = list(pred[year])[-1]
+    store = PredStore(pred)
+    for name, source in [("json", pred), ("store", store)]:
+        seconds = min(
+            timeit.repeat(
+                lambda: list(get_pred_in_time_range(source, year, month_day, "1000")),
+                number=number,
+                repeat=3,
+            )
+        )
+        results[f"pred_in_time_range/{name}/seconds"] = seconds / number
+
+    # 発走前のレースのオッズ取得・最適化・通知
+    races, responses = make_pipeline_races(num_races)
+    fetcher = RecordedOddsFetcher(responses)
+    driver_pool = ChromeDriverPool(size=1, driver_factory=_no_driver)
+    for name, cached in [("cold", False), ("cached", True)]:
+        # cached はポーリングをまたいで最適化結果を使い回す場合
+        solution_cache = SolutionCache() if cached else None
+
+        def notify():
+            dispatcher = RecordingDispatcher()
+            bettor = OptimizeTansyoBettor(solution_cache=solution_cache)
+            notify_bet(driver_pool, fetcher, bettor, races, dispatcher)
+            assert len(dispatcher.messages) == num_races
+
+        seconds = min(timeit.repeat(notify, number=1, repeat=number))
+        results[f"notify_bet/{name}/seconds"] = seconds
+    driver_pool.close()
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:35s} {value * 1e3:10.3f} ms")
@@ -0,0 +1,38 @@
+"""3場36レースの1日の配分の再計算にかかる時間を計測する
+
+python -m benchmarks.bench_portfolio
+"""
+
+import timeit
+from typing import Dict
+
+from src.portfolio import DayPortfolio
+from tests.helpers import make_card
+
+NUM_RACES = 36
+
+
+def run(number: int = 20) -> Dict[str, float]:
+    store, odds = make_card(NUM_RACES)
+    race_ids = list(odds)
+    results = {}
+    for bankroll in [10000, 100000]:
+        portfolio = DayPortfolio(bankroll=bankroll)
+        portfolio.load_day(store, "23", "0505")
+        for race_id, race_odds in odds.items():
+            portfolio.update_odds(race_id, race_odds)
+
+        # 判断時刻ごとに1レースのオッズが届いて当日の配分を解き直す
+        def decide():
+            race_id = race_ids[NUM_RACES // 2]
+            portfolio.update_odds(race_id, odds[race_id])
+            portfolio.stakes()
+
+        seconds = min(timeit.repeat(decide, number=number, repeat=3))
+        results[f"bankroll{bankroll}/decision/seconds"] = seconds / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:35s} {value * 1e3:10.3f} ms")
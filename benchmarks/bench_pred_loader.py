@@ -0,0 +1,117 @@
+"""予測JSONの大きさに対する読み込み時間とピークメモリを計測する
+
+python -m benchmarks.bench_pred_loader
+"""
+
+import datetime
+import json
+import tempfile
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+
+from src.pred_archive import PredArchive, write_pred_archive
+from src.pred_index import build_day_index, load_day, read_day_index
+
+# 1開催日あたりのレース数と, 1年あたりの開催日数
+RACES_PER_DAY = 36
+DAYS_PER_SEASON = 104
+
+
+def make_pred_json(num_days: int, seed: int = 0) -> Dict[str, Any]:
+    """num_days 日分の予測JSONを作る. 最後の日を読み込み対象にする"""
+    rng = np.random.default_rng(seed)
+    pred: Dict[str, Any] = {}
+    day = datetime.date(2023, 1, 1)
+    for _ in range(num_days):
+        races = {}
+        for i in range(RACES_PER_DAY):
+            num_horses = int(rng.integers(8, 19))
+            race_time = 600 + i * 10
+            races[f"{race_time // 60:02}{race_time % 60:02}"] = {
+                "Jyo": "東京",
+                "JyoCD": f"{i % 3 + 1:02}",
+                "Kaiji": "02",
+                "Nichiji": "04",
+                "RaceNum": f"{i % 12 + 1:02}",
+                "Kyori": "1600",
+                "Syubetu": "サラ系3歳",
+                "Jyoken": "未勝利",
+                "Title": "nan",
+                "pred": {
+                    str(umaban + 1): float(p)
+                    for umaban, p in enumerate(rng.dirichlet(np.ones(num_horses)))
+                },
+            }
+        pred.setdefault(day.strftime("%y"), {})[day.strftime("%m%d")] = races
+        day += datetime.timedelta(days=3)
+    return pred
+
+
+def measure(func: Callable[[], Any], number: int = 3) -> Tuple[float, int]:
+    """実行時間(秒)とピークメモリ(バイト). 時間はtracemallocを止めて計測する"""
+    seconds = min(timeit.repeat(func, number=1, repeat=number))
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def run() -> Dict[str, float]:
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, num_days in [
+            ("1day", 1),
+            ("1season", DAYS_PER_SEASON),
+            ("5seasons", DAYS_PER_SEASON * 5),
+        ]:
+            pred = make_pred_json(num_days)
+            year = list(pred)[-1]
+            month_day = list(pred[year])[-1]
+            path = Path(tmp_dir) / f"pred_{name}.json"
+            path.write_text(json.dumps(pred, ensure_ascii=False), encoding="utf-8")
+            archive_path = Path(tmp_dir) / f"pred_{name}"
+            write_pred_archive(pred, archive_path)
+            del pred
+
+            def load_all():
+                with open(path, "r") as f:
+                    return json.load(f)[year][month_day]
+
+            def build_index():
+                with open(path, "rb") as f:
+                    return build_day_index(f)
+
+            # 索引は初回にファイル横へ保存され, load_day はそれを読んで該当日だけを解析する
+            read_day_index(path)
+
+            results[f"{name}/size_mb"] = path.stat().st_size / 1e6
+            for method, func in [
+                ("json_load", load_all),
+                ("build_index", build_index),
+                ("load_day", lambda: load_day(path, year, month_day)),
+                # 列形式のアーカイブを開いて全レースの予測確率を集計する (バックテスト相当)
+                (
+                    "archive_scan",
+                    lambda: float(PredArchive(archive_path).pred.sum(dtype=np.float64)),
+                ),
+                (
+                    "archive_load_day",
+                    lambda: PredArchive(archive_path).races_on(year, month_day),
+                ),
+                # 日付を指定しない PredLoader と同じく全体を予測JSONの形に戻す
+                ("archive_to_json", lambda: PredArchive(archive_path).to_json()),
+            ]:
+                seconds, peak = measure(func)
+                results[f"{name}/{method}/seconds"] = seconds
+                results[f"{name}/{method}/peak_mb"] = peak / 1e6
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:35s} {value:10.4f}")
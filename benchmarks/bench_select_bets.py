@@ -0,0 +1,37 @@
+"""複数レースをまとめて最適化した場合の処理速度を計測する
+
+python -m benchmarks.bench_select_bets
+"""
+
+import time
+from typing import Dict
+
+from src.bettor import OptimizeTansyoBettor
+from tests.helpers import make_race
+
+
+def run(num_races: int = 20000, num_single: int = 200) -> Dict[str, float]:
+    """1分あたりに最適化できるレース数を返す"""
+    bettor = OptimizeTansyoBettor()
+    races = [make_race(8 + seed % 11, seed) for seed in range(num_races)]
+    preds = [pred for pred, _ in races]
+    odds = [race_odds for _, race_odds in races]
+
+    start = time.perf_counter()
+    bettor.select_bets(preds, odds)
+    batch_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for pred, race_odds in races[:num_single]:
+        bettor.select_bet(pred, race_odds)
+    single_seconds = time.perf_counter() - start
+
+    return {
+        "select_bets/races_per_minute": num_races / batch_seconds * 60,
+        "select_bet/races_per_minute": num_single / single_seconds * 60,
+    }
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        print(f"{name:35s} {value:12.0f}")
@@ -0,0 +1,238 @@
+"""ベンチマークを実行して結果をJSONに保存し, ベースラインと比較する
+
+ベースラインより threshold の割合以上遅く (races_per_minute などは少なく) なった
+指標があれば終了コード1で終わる. 各ベンチマークは --repeat 回実行して最も良い値を使い,
+1回あたりの秒数 (races_per_minute なら1レースあたり) の差が min_seconds (既定で10ms)
+未満の指標は計測のばらつきとして比較しない. 悪化した指標があればそのベンチマークだけを
+--retries 回まで計測し直し, 良い方の値で比較し直す. 共有環境では数秒単位で速度が
+1.5倍程度変わるので, 一度の悪化では判定しない.
+
+python -m benchmarks.run                                   # 全ベンチマーク
+python -m benchmarks.run bench_bettor bench_pipeline       # 指定したものだけ
+python -m benchmarks.run --update-baseline                 # 結果をベースラインにする
+
+ベースラインは benchmarks/baseline.json としてリポジトリに置く. 実行環境で値が変わるので,
+環境を変えた場合や意図して性能が変わる変更を入れた場合は, 変更前のコミットで
+--update-baseline を付けて全ベンチマークを実行し直してから比較する.
+ベースラインが無い場合は比較できないので終了コード2で終わる.
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import platform
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+BENCHMARKS = [
+    "bench_odds_parser",
+    "bench_bettor",
+    "bench_optimize",
+    "bench_allocation",
+    "bench_select_bets",
+    "bench_pred_loader",
+    "bench_pipeline",
+    "bench_backtest",
+    "bench_portfolio",
+    "bench_odds_recorder",
+    "bench_cold_start",
+]
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+DEFAULT_OUTPUT = Path(__file__).parent / "results.json"
+
+# 指標名の末尾ごとの良い方向. 1なら大きいほど, -1なら小さいほど良い
+_DIRECTIONS = {
+    "seconds": -1,
+    "peak_mb": -1,
+    "nfev": -1,
+    "per_minute": 1,
+    "per_second": 1,
+}
+
+
+# 1回あたりの秒数でこれより小さい差は比較しない
+_MIN_SECONDS = 0.01
+
+
+class Regression(NamedTuple):
+    name: str
+    baseline: float
+    value: float
+    # 悪くなった割合. 0.3なら30%悪化
+    change: float
+
+
+def direction(name: str) -> Optional[int]:
+    """指標の良い方向. 比較しない指標 (入力の大きさなど) はNone"""
+    for suffix, sign in _DIRECTIONS.items():
+        if name.endswith(suffix):
+            return sign
+    return None
+
+
+def _unit_seconds(name: str, value: float) -> Optional[float]:
+    """時間の指標を1回あたりの秒数にする. races_per_minute なら1レースあたりの秒数"""
+    if name.endswith("seconds"):
+        return value
+    if value <= 0:
+        return None
+    if name.endswith("per_minute"):
+        return 60 / value
+    if name.endswith("per_second"):
+        return 1 / value
+    return None
+
+
+def run_benchmarks(
+    names: List[str], repeat: int = 1, previous: Optional[Dict[str, float]] = None
+) -> Dict[str, float]:
+    """ベンチマークを実行し "モジュール名/指標名" をキーとする結果を返す
+
+    Args:
+        names (List[str]): 実行するベンチマークのモジュール名
+        repeat (int, optional): 各ベンチマークの実行回数. 指標ごとに最も良い値を使う. Defaults to 1.
+        previous (Dict[str, float], optional): 計測し直す場合の前回の結果. 良い方の値を使う. Defaults to None.
+
+    Returns:
+        Dict[str, float]: 指標ごとの結果
+    """
+    results: Dict[str, float] = dict(previous or {})
+    for name in names:
+        module = importlib.import_module(f"benchmarks.{name}")
+        for i in range(repeat):
+            print(f"running {name} ({i + 1}/{repeat})", file=sys.stderr)
+            for metric, value in module.run().items():
+                key = f"{name}/{metric}"
+                sign = direction(key)
+                if key in results and sign is not None:
+                    value = max(results[key] * sign, float(value) * sign) * sign
+                results[key] = float(value)
+    return results
+
+
+def compare(
+    results: Dict[str, float],
+    baseline: Dict[str, float],
+    threshold: float,
+    min_seconds: float = _MIN_SECONDS,
+) -> List[Regression]:
+    """ベースラインから threshold の割合以上悪くなった指標を返す
+
+    Args:
+        results (Dict[str, float]): 今回の結果
+        baseline (Dict[str, float]): ベースラインの結果
+        threshold (float): 許容する悪化の割合
+        min_seconds (float, optional): 1回あたりの秒数で比較しない差の大きさ. Defaults to 0.01.
+
+    Returns:
+        List[Regression]: 悪くなった指標. 悪化の大きい順
+    """
+    regressions = []
+    for name, value in results.items():
+        sign = direction(name)
+        if sign is None or not baseline.get(name):
+            continue
+        # 数ms程度の処理はスケジューラやキャッシュの影響で割合が大きくぶれる
+        old, new = _unit_seconds(name, baseline[name]), _unit_seconds(name, value)
+        if old is not None and new is not None and abs(new - old) < min_seconds:
+            continue
+        change = (baseline[name] - value) / baseline[name] * sign
+        if change > threshold:
+            regressions.append(Regression(name, baseline[name], value, change))
+    return sorted(regressions, key=lambda regression: -regression.change)
+
+
+def load_results(path: Path) -> Dict[str, float]:
+    with open(path, "r") as f:
+        return json.load(f)["results"]
+
+
+def save_results(results: Dict[str, float], path: Path):
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            },
+            f,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", help="省略すると全て実行する")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="各ベンチマークの実行回数"
+    )
+    parser.add_argument(
+        "--retries", type=int, default=2, help="悪化した指標を計測し直す回数"
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=_MIN_SECONDS,
+        help="1回あたりの秒数で比較しない差の大きさ",
+    )
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+    unknown = sorted(set(args.benchmarks) - set(BENCHMARKS))
+    if unknown:
+        parser.error("不明なベンチマーク: {}".format(", ".join(unknown)))
+
+    results = run_benchmarks(args.benchmarks or BENCHMARKS, args.repeat)
+    save_results(results, args.output)
+    for name, value in results.items():
+        print(f"{name:60s} {value:14.6g}")
+
+    if args.update_baseline:
+        if args.baseline.exists():
+            # 一部のベンチマークだけを実行した場合も他の指標は残す
+            results = {**load_results(args.baseline), **results}
+        save_results(results, args.baseline)
+        print(f"ベースラインを更新しました: {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(
+            f"ベースラインがありません: {args.baseline}. "
+            "--update-baseline を付けて実行して作成してください"
+        )
+        return 2
+
+    baseline = load_results(args.baseline)
+    regressions = compare(results, baseline, args.threshold, args.min_seconds)
+    for _ in range(args.retries):
+        if not regressions:
+            break
+        names = sorted({regression.name.split("/")[0] for regression in regressions})
+        print("計測し直します: {}".format(", ".join(names)), file=sys.stderr)
+        results = run_benchmarks(names, args.repeat, results)
+        save_results(results, args.output)
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+    for regression in regressions:
+        print(
+            "REGRESSION {} {:.6g} -> {:.6g} ({:+.0%})".format(
+                regression.name,
+                regression.baseline,
+                regression.value,
+                regression.change,
+            )
+        )
+    if regressions:
+        return 1
+    print(f"{args.threshold:.0%} を超える性能の悪化はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,34 @@
+import argparse
 import datetime
-import time
-from typing import Any, Dict
+import logging
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
 
-import pandas as pd
-import yaml
+from src.pred_store import PredStore
+from src.race_id import make_race_id
+from src.tracing import get_tracer, span
 
-from src.bettor import OptimizeTansyoBettor
-from src.load_pred import PredLoader
-from src.notify import Notifier
-from src.read_google_drive_json import GoogleDriveJsonReader
-from src.scraper import OddsScraper
+# pandas, scipy, selenium, Google APIクライアントは読み込みに時間がかかるので
+# 使う処理の中で読み込む. 対象のレースが無い呼び出しではどれも読み込まない
+if TYPE_CHECKING:
+    from src.bettor import Bettor
+    from src.driver_pool import ChromeDriverPool
+    from src.notify import NotifyDispatcher
+    from src.odds_client import HttpOddsFetcher
+    from src.odds_recorder import OddsRecorder
+    from src.prefetch import OddsPrefetcher
+    from src.read_google_drive_json import GoogleDriveJsonReader
+    from src.scraper import OddsScraper
+
+logger = logging.getLogger(__name__)
+
+# 呼び出しをまたいで使い回す設定と実行環境
+_config: Optional[Dict[str, Any]] = None
+_runtime: Optional["Runtime"] = None
+_runtime_lock = threading.Lock()
+
+# netkeibaの単勝オッズのページ. race_id を付けてアクセスする
+ODDS_PAGE_URL = "https://race.netkeiba.com/odds/index.html?type=b1&"
 
 
 def is_time_difference_within_5_to_10_minutes(race_time: str, now_time: str) -> bool:
@@ -35,76 +54,472 @@ def is_time_difference_within_5_to_10_minutes(race_time: str, now_time: str) ->
 
 
 def get_pred_in_time_range(
-    json: Dict[str, Any], now_year: str, now_month_day: str, now_time: str
+    pred: Union[PredStore, Dict[str, Any]],
+    now_year: str,
+    now_month_day: str,
+    now_time: str,
 ):
-    if now_year in json.keys():
-        if now_month_day in json[now_year].keys():
-            for race_time in json[now_year][now_month_day]:
-                # 現時刻と比較して5~10分後に発走するレースがあれば実行
-                if not is_time_difference_within_5_to_10_minutes(race_time, now_time):
-                    continue
-                yield json[now_year][now_month_day][race_time]
+    # 予測JSONが渡された場合は索引を作る. ポーリングごとに呼ぶ場合はPredStoreを渡す
+    store = pred if isinstance(pred, PredStore) else PredStore(pred)
+
+    # 現時刻と比較して5~10分後に発走するレースがあれば実行
+    yield from store.races_starting_within(now_year, now_month_day, now_time, 5, 10)
 
-    return None
 
+def _post_times(
+    store: PredStore, now: datetime.datetime
+) -> Dict[str, datetime.datetime]:
+    """指定日のレースIDごとの発走時刻"""
+    year = now.strftime("%y")
+    midnight = datetime.datetime.combine(now.date(), datetime.time())
+    return {
+        make_race_id(
+            year, race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+        ): midnight
+        + datetime.timedelta(minutes=minutes)
+        for minutes, race in store.races_on(year, now.strftime("%m%d"))
+    }
+
+
+def load_config() -> Dict[str, Any]:
+    import yaml
 
-def notify_bet():
     with open("config.yaml", "r", encoding="utf-8") as f:
-        config = yaml.safe_load(f)
+        return yaml.safe_load(f)
+
+
+def get_config() -> Dict[str, Any]:
+    """設定ファイルを最初の呼び出しで1回だけ読み込む"""
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
+
+
+def create_pred_reader(config: Dict[str, Any]) -> "GoogleDriveJsonReader":
+    from src.read_google_drive_json import GoogleDriveJsonReader
 
     # Google Driveの予測JSONファイルから予測を取得
-    reader = GoogleDriveJsonReader(
+    # ダウンロードしたJSONは変更されるまでローカルのキャッシュを使う
+    return GoogleDriveJsonReader(
         config["google_drive_credentials_json_path"],
         config["google_drive_token_json_path"],
         config["pred_json_path"],
+        cache_dir=config.get("pred_json_cache_dir", ".cache/pred_json"),
+    )
+
+
+def create_recorder(config: Dict[str, Any]) -> Optional["OddsRecorder"]:
+    # 取得したオッズを記録する. 記録先が無ければ記録しない
+    if not config.get("odds_record_dir"):
+        return None
+    from src.odds_recorder import OddsRecorder
+
+    return OddsRecorder(config["odds_record_dir"])
+
+
+def create_bettor(config: Dict[str, Any]) -> "Bettor":
+    from src.bettor import KellyTansyoBettor, OptimizeTansyoBettor
+    from src.solution_cache import SolutionCache
+
+    # 購入馬券の決め方. optimize はSLSQPで最適化し, kelly はケリー基準の式で求める.
+    # portfolio は1日の資金を当日の全レースにケリー基準で配分する
+    engine = config.get("bettor_engine") or "optimize"
+    if engine == "optimize":
+        return OptimizeTansyoBettor(solution_cache=SolutionCache())
+    if engine == "kelly":
+        return KellyTansyoBettor(kelly_fraction=config.get("kelly_fraction", 1.0))
+    if engine == "portfolio":
+        from src.portfolio import DayPortfolio
+
+        # 固定した掛け金は予測JSONのキャッシュと同じく実行をまたいで残す
+        return DayPortfolio(
+            bankroll=config.get("day_bankroll", 10000),
+            kelly_fraction=config.get("kelly_fraction", 0.5),
+            state_dir=config.get("portfolio_state_dir", ".cache/portfolio"),
+        )
+    raise ValueError(f"不明な bettor_engine です: {engine}")
+
+
+def create_prefetcher(
+    config: Dict[str, Any],
+    scraper: "OddsScraper",
+    decision_lead_time: datetime.timedelta = datetime.timedelta(minutes=7),
+) -> Optional["OddsPrefetcher"]:
+    # 発走の odds_prefetch_minutes 分前からオッズを先読みする. null なら先読みしない
+    if config.get("odds_prefetch_minutes") is None:
+        return None
+    from src.prefetch import OddsPrefetcher
+
+    return OddsPrefetcher(
+        scraper,
+        lead_time=datetime.timedelta(minutes=config["odds_prefetch_minutes"]),
+        decision_lead_time=decision_lead_time,
+        interval=config.get("odds_prefetch_interval", 60),
+        max_staleness=datetime.timedelta(seconds=config.get("odds_max_staleness", 120)),
+        refresh_timeout=config.get("odds_refresh_timeout", 15),
+    )
+
+
+def create_dispatcher(config: Dict[str, Any]) -> "NotifyDispatcher":
+    from src.notify import LineNotifyDestination, NotifyDispatcher
+
+    return NotifyDispatcher(
+        [LineNotifyDestination.from_token_file(config["line_notify_credential_path"])]
     )
 
+
+class Runtime:
+    """呼び出しをまたいで使い回す予測の読み込み・オッズ取得・最適化・通知のオブジェクト
+
+    どれも最初に使う時に作る. 予測JSONのリーダーはDrive APIの認証情報とダウンロード済みの
+    JSONを, 通知はアクセストークンと接続を, 最適化は前回の結果を保持する.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self._config = config
+        self._lock = threading.Lock()
+        self._reader: Optional["GoogleDriveJsonReader"] = None
+        self._http_fetcher: Optional["HttpOddsFetcher"] = None
+        self._bettor: Optional["Bettor"] = None
+        self._dispatcher: Optional["NotifyDispatcher"] = None
+        self._recorder: Optional["OddsRecorder"] = None
+        self._recorder_created = False
+
+    def pred_reader(self) -> "GoogleDriveJsonReader":
+        """Drive上の予測JSONが変わっていれば読み直したリーダー"""
+        with self._lock:
+            if self._reader is None:
+                # 作成時に読み込む
+                self._reader = create_pred_reader(self._config)
+                return self._reader
+        self._reader.refresh()
+        return self._reader
+
+    @property
+    def http_fetcher(self) -> "HttpOddsFetcher":
+        with self._lock:
+            if self._http_fetcher is None:
+                from src.odds_client import HttpOddsFetcher
+
+                self._http_fetcher = HttpOddsFetcher()
+            return self._http_fetcher
+
+    @property
+    def bettor(self) -> "Bettor":
+        with self._lock:
+            if self._bettor is None:
+                self._bettor = create_bettor(self._config)
+            return self._bettor
+
+    @property
+    def dispatcher(self) -> "NotifyDispatcher":
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = create_dispatcher(self._config)
+            return self._dispatcher
+
+    @property
+    def recorder(self) -> Optional["OddsRecorder"]:
+        with self._lock:
+            if not self._recorder_created:
+                self._recorder = create_recorder(self._config)
+                self._recorder_created = True
+            return self._recorder
+
+    def close(self):
+        with self._lock:
+            if self._recorder is not None:
+                self._recorder.close()
+                self._recorder = None
+                self._recorder_created = False
+            if self._dispatcher is not None:
+                self._dispatcher.close()
+                self._dispatcher = None
+            if self._http_fetcher is not None:
+                self._http_fetcher.close()
+                self._http_fetcher = None
+
+
+def get_runtime() -> Runtime:
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = Runtime(get_config())
+        return _runtime
+
+
+def notify_bet(
+    driver_pool: Optional["ChromeDriverPool"] = None,
+    http_fetcher: Optional["HttpOddsFetcher"] = None,
+    bettor: Optional["Bettor"] = None,
+    races: Optional[List[Dict[str, Any]]] = None,
+    dispatcher: Optional["NotifyDispatcher"] = None,
+    post_time: Optional[Callable[[str], Optional[datetime.datetime]]] = None,
+    recorder: Optional["OddsRecorder"] = None,
+    prefetcher: Optional["OddsPrefetcher"] = None,
+):
+    config = get_config()
+
     # 現在の日時を取得
     now = datetime.datetime.now()
     now_year = now.strftime("%y")
     now_month_day = now.strftime("%m%d")
     now_time = now.strftime("%H%M")
 
-    # 現在時刻と予測ファイルの時間の開催時間が近いレースがあれば
-    for race in get_pred_in_time_range(reader.json, now_year, now_month_day, now_time):
-        jyo_cd = race["JyoCD"]
-        jyo = race["Jyo"]
-        kaiji = race["Kaiji"]
-        nichiji = race["Nichiji"]
-        race_num = race["RaceNum"]
-        kyori = race["Kyori"]
-        syubetu = race["Syubetu"]
-        jyoken = race["Jyoken"]
-        title = race["Title"]
-        pred = pd.Series(race["pred"])
-
-        # 該当レースのオッズをスクレイピング
-        scraper = OddsScraper("https://race.netkeiba.com/odds/index.html?type=b1&")
-        odds = scraper.get_odds_by_race(now_year, jyo_cd, kaiji, nichiji, race_num)
-
-        # オッズと予測から馬券を最適化
-        bettor = OptimizeTansyoBettor()
-        bet = bettor.select_bet(pred, odds)
-
-        # 購入馬券を通知する
-        race_title = "{} {}R {} {} {} {}".format(
-            jyo, int(race_num), syubetu, jyoken, kyori, title if title != "nan" else ""
+    # レースが渡されていなければ, 現在時刻と予測ファイルの時間の開催時間が近いレース
+    store = None
+    if races is None:
+        with span("pred_load"):
+            store = get_runtime().pred_reader().day_store(now_year, now_month_day)
+        races = list(get_pred_in_time_range(store, now_year, now_month_day, now_time))
+        post_time = _post_times(store, now).get
+    if not races:
+        return
+
+    import pandas as pd
+
+    from src.bettor import OptimizeTansyoBettor
+    from src.concurrent_scraper import ConcurrentOddsScraper
+    from src.portfolio import DayPortfolio
+    from src.scraper import OddsScraper
+
+    # 日単位の配分には当日の全レースの予測を渡す
+    if store is not None and isinstance(bettor, DayPortfolio):
+        bettor.load_day(store, now_year, now_month_day)
+
+    # プールが渡されていなければ、このサイクル限りのドライバーを使う
+    # オッズはHTTPで取得し、失敗した時だけブラウザを使う
+    scraper = OddsScraper(ODDS_PAGE_URL, driver_pool, http_fetcher, recorder)
+
+    # 通知はバックグラウンドで送り, 次のレースの処理を待たせない
+    own_dispatcher = dispatcher is None
+    if own_dispatcher:
+        dispatcher = create_dispatcher(config)
+
+    try:
+        with span("notify_bet", races=len(races)):
+            # 該当レースのオッズを並行してスクレイピングし、取得できたレースから通知する
+            # 先読みしている場合は最後の1回だけ取得し, 間に合わなければ先読みしたオッズを使う
+            concurrent_scraper = ConcurrentOddsScraper(
+                prefetcher if prefetcher is not None else scraper
+            )
+            for race, odds, error in concurrent_scraper.fetch_all(now_year, races):
+                if error is not None:
+                    logger.error(
+                        "オッズを取得できませんでした: %s %sR %s",
+                        race["Jyo"],
+                        race["RaceNum"],
+                        error,
+                    )
+                    continue
+
+                jyo = race["Jyo"]
+                race_num = race["RaceNum"]
+                kyori = race["Kyori"]
+                syubetu = race["Syubetu"]
+                jyoken = race["Jyoken"]
+                title = race["Title"]
+                pred = pd.Series(race["pred"])
+
+                # オッズと予測から馬券を最適化
+                # 前回のポーリングと同じレースなら前回の最適化結果を再利用する
+                if bettor is None:
+                    bettor = OptimizeTansyoBettor()
+                race_id = make_race_id(
+                    now_year, race["JyoCD"], race["Kaiji"], race["Nichiji"], race_num
+                )
+                bet = bettor.select_bet(pred, odds, race_id)
+
+                # 購入馬券を通知する
+                race_title = "{} {}R {} {} {} {}".format(
+                    jyo,
+                    int(race_num),
+                    syubetu,
+                    jyoken,
+                    kyori,
+                    title if title != "nan" else "",
+                )
+                # 発走までに送れなかった通知は捨てる
+                post = post_time(race_id) if post_time is not None else None
+                on_sent = None
+                if post is not None:
+                    # 通知を送れた時点で発走まで何秒残っているか
+                    def on_sent(post: datetime.datetime = post):
+                        get_tracer().before_post(
+                            (post - datetime.datetime.now()).total_seconds()
+                        )
+
+                dispatcher.notify(
+                    race_title,
+                    bet[bet > 0],
+                    expires_at=post.timestamp() if post is not None else None,
+                    on_sent=on_sent,
+                )
+    finally:
+        scraper.close()
+        if own_dispatcher:
+            dispatcher.close()
+
+
+def run_once() -> Dict[str, Any]:
+    """notify_bet を1回だけ実行する. cron やHTTPトリガーから呼ぶ
+
+    設定, 予測JSONのリーダー, 通知先, 最適化のキャッシュはモジュールに保持し,
+    同じプロセスでの2回目以降の呼び出しで使い回す.
+
+    Returns:
+        Dict[str, Any]: 対象のレース数
+    """
+    runtime = get_runtime()
+    now = datetime.datetime.now()
+    now_year = now.strftime("%y")
+    now_month_day = now.strftime("%m%d")
+
+    with span("pred_load"):
+        store = runtime.pred_reader().day_store(now_year, now_month_day)
+    races = list(
+        get_pred_in_time_range(store, now_year, now_month_day, now.strftime("%H%M"))
+    )
+    if races:
+        from src.portfolio import DayPortfolio
+
+        # 日単位の配分には当日の全レースの予測を渡す
+        bettor = runtime.bettor
+        if isinstance(bettor, DayPortfolio):
+            bettor.load_day(store, now_year, now_month_day)
+
+        notify_bet(
+            None,
+            runtime.http_fetcher,
+            bettor,
+            races,
+            runtime.dispatcher,
+            _post_times(store, now).get,
+            runtime.recorder,
         )
-        Notifier(
-            config["line_notify_credential_path"],
-        ).notify(race_title, bet[bet > 0])
+        # 応答を返した後は処理が止まる場合があるので, 通知とオッズの記録を終えてから戻る.
+        # 通知先が送信を制限している場合も notify_flush_timeout 秒で応答を返す
+        if not runtime.dispatcher.flush(get_config().get("notify_flush_timeout", 30)):
+            logger.warning("送り終えていない通知があります")
+        if runtime.recorder is not None:
+            runtime.recorder.flush()
+
+    metrics_path = get_config().get("metrics_textfile_path")
+    if metrics_path:
+        get_tracer().registry.write(metrics_path)
+    return {"races": len(races)}
+
+
+def http_handler(request) -> Any:
+    """HTTPトリガーの入口
+
+    functions-framework --target=http_handler で起動する. リクエストの内容は使わない.
+    """
+    try:
+        result = run_once()
+    except Exception:
+        logger.exception("notify_bet の実行に失敗しました")
+        return {"status": "error"}, 500
+    return {"status": "ok", **result}, 200
 
 
 def main():
-    with open("config.yaml", "r", encoding="utf-8") as f:
-        config = yaml.safe_load(f)
+    from src.driver_pool import ChromeDriverPool
+    from src.odds_client import HttpOddsFetcher
+    from src.portfolio import DayPortfolio
+    from src.scheduler import RaceScheduler
+    from src.scraper import OddsScraper
 
-    while True:
-        # 300秒(=5分)ごとに実行
-        notify_bet()
+    config = get_config()
 
-        time.sleep(300)
+    # ブラウザはポーリングをまたいで使い回す
+    driver_pool = ChromeDriverPool(size=2)
+    http_fetcher = HttpOddsFetcher()
+    bettor = create_bettor(config)
+    dispatcher = create_dispatcher(config)
+    recorder = create_recorder(config)
+
+    # 各レースの発走7分前に起きて処理する. 予測JSONは定期的に読み直して追加のレースを拾う
+    scheduler = RaceScheduler()
+    # 判断時刻までオッズを先読みする
+    prefetcher = create_prefetcher(
+        config,
+        OddsScraper(ODDS_PAGE_URL, driver_pool, http_fetcher, recorder),
+        scheduler.lead_time,
+    )
+    if prefetcher is not None:
+        prefetcher.start()
+    reader = create_pred_reader(config)
+    reload_interval = datetime.timedelta(minutes=30)
+    next_reload = datetime.datetime.now()
+
+    # 処理段階ごとの所要時間などをPrometheusのテキスト形式で出力する
+    registry = get_tracer().registry
+    metrics_path = config.get("metrics_textfile_path")
+    metrics_server = None
+    if config.get("metrics_port") is not None:
+        metrics_server = registry.serve(config["metrics_port"])
+    try:
+        while True:
+            if datetime.datetime.now() >= next_reload:
+                # 当日分の予測だけを読み込む
+                reader.refresh()
+                today = datetime.date.today()
+                store = reader.day_store(today.strftime("%y"), today.strftime("%m%d"))
+                added = scheduler.load(store, today)
+                if prefetcher is not None:
+                    prefetcher.load(store, today)
+                if isinstance(bettor, DayPortfolio):
+                    bettor.load_day(store, today.strftime("%y"), today.strftime("%m%d"))
+                next_reload = datetime.datetime.now() + reload_interval
+                logger.info(
+                    "%d レースを追加. 次の判断時刻: %s",
+                    added,
+                    scheduler.next_decision_at,
+                )
+
+            races = scheduler.wait_next(next_reload - datetime.datetime.now())
+            if races:
+                notify_bet(
+                    driver_pool,
+                    http_fetcher,
+                    bettor,
+                    races,
+                    dispatcher,
+                    scheduler.post_time,
+                    recorder,
+                    prefetcher,
+                )
+                if bettor.solution_cache is not None:
+                    logger.info("最適化キャッシュ: %s", bettor.solution_cache.stats)
+            if metrics_path:
+                registry.write(metrics_path)
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+        if prefetcher is not None:
+            prefetcher.close()
+        dispatcher.close()
+        if recorder is not None:
+            recorder.close()
+        http_fetcher.close()
+        driver_pool.close()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="発走前のレースの購入馬券を通知する")
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="常駐せずに発走5~10分前のレースを1回だけ処理する (cron用)",
+    )
+    args = parser.parse_args()
+    if args.once:
+        try:
+            run_once()
+        finally:
+            get_runtime().close()
+    else:
+        main()
@@ -0,0 +1,215 @@
+import math
+from typing import Tuple
+
+import numpy as np
+
+# 馬券の購入単位 (円)
+BET_UNIT = 100
+
+
+def _nearest_units(target: np.ndarray, min_units: int) -> np.ndarray:
+    """馬券ごとに目標に最も近い単位数 (0 か最低単位以上)"""
+    units = np.round(target)
+    below = units < min_units
+    units[below] = np.where(
+        target[below] ** 2 <= (min_units - target[below]) ** 2, 0, min_units
+    )
+    return units
+
+
+def _is_feasible(
+    units: np.ndarray, odds: np.ndarray, rate: float, max_units: int
+) -> bool:
+    total = units.sum()
+    return total <= max_units and not np.any(
+        (units > 0) & (units * odds < rate * total)
+    )
+
+
+def _round_feasible(
+    target: np.ndarray, odds: np.ndarray, rate: float, min_units: int, max_units: int
+) -> np.ndarray:
+    """丸めてから条件を満たさない馬券を見送る. 最適とは限らないが条件は満たす"""
+    units = _nearest_units(target, min_units)
+    # 予算を超える場合は切り上げ幅の大きい馬券から減らす
+    excess = int(units.sum()) - max_units
+    if excess > 0:
+        over = np.argsort(-(units - target), kind="stable")[:excess]
+        units[over] = np.maximum(units[over] - 1, 0)
+        units[units < min_units] = 0
+    while True:
+        total = units.sum()
+        violated = (units > 0) & (units * odds < rate * total)
+        if not violated.any():
+            return units
+        # 払戻の最も少ない馬券から見送る
+        worst = np.flatnonzero(violated)[np.argmin((units * odds)[violated])]
+        units[worst] = 0
+
+
+def _cost(units: np.ndarray, target: np.ndarray) -> float:
+    return float(np.sum((units - target) ** 2))
+
+
+def _solve_total(
+    total: int,
+    target: np.ndarray,
+    odds: np.ndarray,
+    rate: float,
+    min_units: int,
+    radius: float,
+) -> Tuple[float, np.ndarray]:
+    """合計 total 単位を配る場合の最適な配分を動的計画法で求める
+
+    馬券ごとに 0 か, 最低単位と払戻の条件を満たす下限以上の単位数を選ぶ.
+    既知の解より悪くなる単位数 (目標から radius を超えて離れる) は調べない.
+
+    Returns:
+        Tuple[float, np.ndarray]: 目標との二乗誤差と単位数. 配れない場合は (inf, None)
+    """
+    num_tickets = len(target)
+    # 二乗誤差の合計が radius^2 以下なら, i 枚目までの誤差の合計は sqrt(i) * radius 以下.
+    # ここまでに配る単位数をその範囲に限る
+    done = np.cumsum(target)
+    rest = target.sum() - done
+    # cost[c]: ここまでの馬券に c 単位を配った場合の二乗誤差の最小値
+    cost = np.full(total + 1, np.inf)
+    cost[0] = 0.0
+    choices = np.zeros((num_tickets, total + 1), dtype=np.int64)
+    for i in range(num_tickets):
+        low = max(
+            math.floor(done[i] - math.sqrt(i + 1) * radius),
+            math.floor(total - rest[i] - math.sqrt(num_tickets - i - 1) * radius),
+            0,
+        )
+        high = min(
+            math.ceil(done[i] + math.sqrt(i + 1) * radius),
+            math.ceil(total - rest[i] + math.sqrt(num_tickets - i - 1) * radius),
+            total,
+        )
+        next_cost = np.full(total + 1, np.inf)
+        if low > high:
+            cost = next_cost
+            break
+        capacity = np.arange(low, high + 1)
+        off = cost[capacity] + target[i] ** 2
+        lower = max(min_units, math.ceil(rate * total / odds[i] - 1e-9))
+        lower = max(lower, math.ceil(target[i] - radius))
+        upper = min(high, math.floor(target[i] + radius))
+        if lower > upper:
+            next_cost[capacity] = off
+            cost = next_cost
+            continue
+
+        k = np.arange(lower, upper + 1)
+        previous = capacity[:, np.newaxis] - k[np.newaxis, :]
+        on = (
+            np.where(previous >= 0, cost[np.clip(previous, 0, None)], np.inf)
+            + (k - target[i]) ** 2
+        )
+        best = np.argmin(on, axis=1)
+        on_cost = on[np.arange(len(capacity)), best]
+
+        use = on_cost < off
+        choices[i, capacity] = np.where(use, k[best], 0)
+        next_cost[capacity] = np.where(use, on_cost, off)
+        cost = next_cost
+
+    if not np.isfinite(cost[total]):
+        return np.inf, None
+    units = np.zeros(num_tickets)
+    remaining = total
+    for i in reversed(range(num_tickets)):
+        units[i] = choices[i, remaining]
+        remaining -= int(units[i])
+    return float(cost[total]), units
+
+
+def _lower_bounds(
+    target: np.ndarray, odds: np.ndarray, rate: float, min_units: int, max_units: int
+) -> np.ndarray:
+    """合計単位数ごとの二乗誤差の下限
+
+    合計 T の制約をラグランジュ緩和した下限. 任意の λ について
+    Σ_i min(見送りの誤差, 買う場合の min_k ((k - t_i)^2 - λk)) + λT は下限になるので,
+    単位数の整数条件も外して λ の格子の中で最大の値を使う.
+    """
+    totals = np.arange(max_units + 1, dtype=float)[:, np.newaxis, np.newaxis]
+    # 合計 x 馬券 の払戻の条件を満たす最小の単位数
+    lower = np.maximum(
+        np.ceil(rate * totals / odds[np.newaxis, :, np.newaxis] - 1e-9), min_units
+    )
+    shift = np.linspace(-1, 1, 65) * max(target.max(), 1.0)
+    t = target[np.newaxis, :, np.newaxis]
+    # λ = 2 * shift のとき買う場合の最適な単位数は max(下限, t + shift)
+    k = np.maximum(lower, t + shift)
+    on = (k - t) ** 2 - 2 * shift * k
+    relaxed = np.minimum(on, t**2).sum(axis=1) + 2 * shift * totals[:, 0]
+    return relaxed.max(axis=1)
+
+
+def allocate_bets(
+    fraction: np.ndarray,
+    odds: np.ndarray,
+    budget: int,
+    exceed_profit_rate: float = 1.0,
+    min_bet: int = BET_UNIT,
+) -> np.ndarray:
+    """配分の比率を100円単位の掛け金にする
+
+    予算, 最低掛け金, 的中時の払戻が合計掛け金の exceed_profit_rate 倍以上という条件を
+    すべて満たす掛け金のうち, 配分の比率 x 予算 との二乗誤差が最小のものを返す.
+    合計の単位数ごとに動的計画法で解き, 二乗誤差の下限が既知の解以上の合計は調べない
+    (分枝限定法).
+
+    Args:
+        fraction (np.ndarray): 予算に対する馬券ごとの配分の比率
+        odds (np.ndarray): 馬券ごとのオッズ
+        budget (int): 投資予算
+        exceed_profit_rate (float, optional): 的中時の払戻の合計掛け金に対する下限. Defaults to 1.0.
+        min_bet (int, optional): 買う馬券の最低掛け金. Defaults to 100.
+
+    Returns:
+        np.ndarray: 馬券ごとの掛け金 (円). 合計は予算以下
+    """
+    fraction = np.asarray(fraction, dtype=float)
+    odds = np.asarray(odds, dtype=float)
+    max_units = int(budget // BET_UNIT)
+    min_units = max(1, math.ceil(min_bet / BET_UNIT))
+    bets = np.zeros(len(fraction))
+
+    # 目標が0.5単位以下の馬券は, 買うと誤差が増え (k^2 - 2kt >= 0),
+    # 合計が増えて他の馬券の払戻の条件も厳しくなるだけなので除く
+    target = fraction * budget / BET_UNIT
+    candidates = np.flatnonzero((target > 0.5) & (odds > 0))
+    if len(candidates) == 0 or max_units == 0:
+        return bets
+    target = target[candidates]
+    odds = odds[candidates]
+
+    # 馬券ごとに最も近い単位数が条件を満たせば, 各項が最小なのでそれが最適
+    nearest = _nearest_units(target, min_units)
+    if _is_feasible(nearest, odds, exceed_profit_rate, max_units):
+        bets[candidates] = nearest * BET_UNIT
+        return bets
+
+    best_units = _round_feasible(target, odds, exceed_profit_rate, min_units, max_units)
+    best_cost = _cost(best_units, target)
+    bounds = _lower_bounds(target, odds, exceed_profit_rate, min_units, max_units)
+    # 下限の小さい合計から調べ, 下限が既知の解以上になったら打ち切る
+    for total in np.argsort(bounds, kind="stable"):
+        if bounds[total] >= best_cost:
+            break
+        cost, units = _solve_total(
+            int(total),
+            target,
+            odds,
+            exceed_profit_rate,
+            min_units,
+            math.sqrt(best_cost),
+        )
+        if cost < best_cost:
+            best_cost, best_units = cost, units
+
+    bets[candidates] = best_units * BET_UNIT
+    return bets
@@ -0,0 +1,367 @@
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+import pandas as pd
+
+from src.bettor import Bettor, OptimizeTansyoBettor
+from src.pred_archive import PredArchive
+from src.pred_store import to_minutes
+from src.race_id import make_race_id
+
+logger = logging.getLogger(__name__)
+
+# race_id -> 馬券 -> 値
+RaceTable = Dict[str, Dict[str, float]]
+
+# 引数なしでBettorを作る関数. プロセスをまたぐのでpickleできること (クラスやpartialなど)
+BettorFactory = Callable[[], Bettor]
+
+
+class BacktestRace(NamedTuple):
+    """バックテストに使う1レース分のデータ"""
+
+    race_id: str
+    date: str
+    minutes: int
+    track: str
+    pred: Dict[str, float]
+    odds: Dict[str, float]
+    # 的中した馬券ごとの100円あたりの払戻金
+    payouts: Dict[str, float]
+
+
+class RaceResult(NamedTuple):
+    race_id: str
+    date: str
+    minutes: int
+    track: str
+    stake: int
+    payout: float
+    hit: bool
+
+
+def load_odds_csv(path: str) -> RaceTable:
+    """race_id, umaban, odds 列のCSVから判断時点のオッズを読み込む"""
+    df = pd.read_csv(path, dtype={"race_id": str, "umaban": str})
+    return _to_race_table(df, "umaban", "odds")
+
+
+def load_results_csv(path: str) -> RaceTable:
+    """race_id, ticket, payout 列のCSVから的中馬券と100円あたりの払戻金を読み込む
+
+    単勝の ticket は馬番. 同着の場合は1レースに複数行ある.
+    """
+    df = pd.read_csv(path, dtype={"race_id": str, "ticket": str})
+    return _to_race_table(df, "ticket", "payout")
+
+
+def _to_race_table(df: pd.DataFrame, key: str, value: str) -> RaceTable:
+    table: RaceTable = {}
+    for race_id, ticket, amount in zip(df["race_id"], df[key], df[value]):
+        table.setdefault(race_id, {})[ticket] = float(amount)
+    return table
+
+
+# レースIDを作るのに使うメタデータ
+_RACE_ID_KEYS = ("JyoCD", "Kaiji", "Nichiji", "RaceNum")
+
+
+def _iter_pred_races(
+    pred: Union[Dict[str, Any], PredArchive],
+) -> Iterator[Tuple[str, str, str, Dict[str, Any], Sequence[Any], Sequence[Any]]]:
+    """予測のレースを (年, 月日, 発走時刻, メタデータ, 馬番, 予測確率) の順に返す
+
+    予測アーカイブではレースの辞書を作らず, 馬番と予測確率はアーカイブの配列を参照したまま返す.
+    """
+    if isinstance(pred, PredArchive):
+        races = pred.races
+        years = races["year"].tolist()
+        month_days = races["month_day"].tolist()
+        race_times = races["race_time"].tolist()
+        columns = [pred.meta_column(key) for key in _RACE_ID_KEYS]
+        for i, meta in enumerate(zip(*columns)):
+            umaban, probabilities = pred.race_pred(i)
+            yield (
+                years[i],
+                month_days[i],
+                race_times[i],
+                dict(zip(_RACE_ID_KEYS, meta)),
+                umaban,
+                probabilities,
+            )
+        return
+
+    for year, days in pred.items():
+        for month_day, races in days.items():
+            for race_time, race in races.items():
+                race_pred = race["pred"]
+                yield (
+                    year,
+                    month_day,
+                    race_time,
+                    race,
+                    race_pred.keys(),
+                    race_pred.values(),
+                )
+
+
+def _to_pred_dict(
+    umaban: Sequence[Any], probabilities: Sequence[Any]
+) -> Dict[str, float]:
+    if isinstance(probabilities, np.ndarray):
+        # NumPyのスカラーを1つずつ変換しない
+        umaban, probabilities = umaban.tolist(), probabilities.tolist()
+    return {str(u): float(p) for u, p in zip(umaban, probabilities)}
+
+
+def build_backtest_races(
+    pred: Union[Dict[str, Any], PredArchive],
+    odds: RaceTable,
+    results: RaceTable,
+) -> List[BacktestRace]:
+    """予測とオッズ, 結果のそろったレースを日付・発走時刻の順に並べる
+
+    Args:
+        pred (Union[Dict[str, Any], PredArchive]): 予測JSONまたは予測アーカイブ
+        odds (RaceTable): レースごとの判断時点のオッズ
+        results (RaceTable): レースごとの的中馬券の払戻金
+
+    Returns:
+        List[BacktestRace]: バックテストに使うレース
+    """
+    races = []
+    skipped = 0
+    for year, month_day, race_time, race, umaban, probabilities in _iter_pred_races(
+        pred
+    ):
+        race_id = make_race_id(
+            year, race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+        )
+        if race_id not in odds or race_id not in results:
+            skipped += 1
+            continue
+        races.append(
+            BacktestRace(
+                race_id,
+                f"{year}{month_day}",
+                to_minutes(race_time),
+                str(race["JyoCD"]),
+                _to_pred_dict(umaban, probabilities),
+                odds[race_id],
+                results[race_id],
+            )
+        )
+    if skipped:
+        logger.info("オッズか結果の無い %d レースを除きました", skipped)
+    races.sort(key=lambda race: (race.date, race.minutes))
+    return races
+
+
+def settle(race: BacktestRace, bet: pd.Series) -> RaceResult:
+    """掛け金と結果から1レースの収支を計算する"""
+    bet = bet.drop("not_bet", errors="ignore")
+    stake = int(bet.sum())
+    payout = sum(
+        bet.get(ticket, 0) * amount / 100 for ticket, amount in race.payouts.items()
+    )
+    return RaceResult(
+        race.race_id,
+        race.date,
+        race.minutes,
+        race.track,
+        stake,
+        float(payout),
+        payout > 0,
+    )
+
+
+def run_races(
+    bettor_factory: BettorFactory, races: List[BacktestRace]
+) -> List[RaceResult]:
+    """1プロセス分のレースを順に賭けて精算する
+
+    DayPortfolio のように1日の資金を管理する Bettor があるので, 日ごとに作り直す.
+    """
+    results = []
+    for _, day_races in itertools.groupby(races, key=lambda race: race.date):
+        bettor = bettor_factory()
+        for race in day_races:
+            # 予測とオッズの両方がある馬だけを対象にする
+            umaban_list = [umaban for umaban in race.pred if umaban in race.odds]
+            pred = pd.Series({umaban: race.pred[umaban] for umaban in umaban_list})
+            odds = pd.Series({umaban: race.odds[umaban] for umaban in umaban_list})
+            bet = bettor.select_bet(pred, odds, race.race_id)
+            results.append(settle(race, bet))
+    return results
+
+
+class BacktestReport:
+    """バックテストの集計結果"""
+
+    def __init__(self, results: List[RaceResult]):
+        self._results = pd.DataFrame(results, columns=RaceResult._fields)
+        self._results = self._results.sort_values(["date", "minutes"], kind="stable")
+        self._results = self._results.reset_index(drop=True)
+
+    @staticmethod
+    def _summarize(results: pd.DataFrame) -> Dict[str, float]:
+        stake = float(results["stake"].sum())
+        payout = float(results["payout"].sum())
+        bet_races = int((results["stake"] > 0).sum())
+
+        # 最大ドローダウンは累積収支の直前の最高値からの最大の下落幅. 開始時点の0も最高値に含める
+        profit = (results["payout"] - results["stake"]).cumsum().to_numpy()
+        peak = np.maximum.accumulate(np.concatenate(([0.0], profit)))[1:]
+        max_drawdown = float(np.max(peak - profit, initial=0.0))
+
+        return {
+            "races": len(results),
+            "bet_races": bet_races,
+            "stake": stake,
+            "payout": payout,
+            "profit": payout - stake,
+            "roi": payout / stake if stake > 0 else np.nan,
+            "hit_rate": (
+                float(results["hit"].sum()) / bet_races if bet_races > 0 else np.nan
+            ),
+            "max_drawdown": max_drawdown,
+        }
+
+    def summary(self) -> Dict[str, float]:
+        """全レースの回収率, 的中率, 最大ドローダウンなど"""
+        return self._summarize(self._results)
+
+    def by_track(self) -> pd.DataFrame:
+        """競馬場ごとの集計"""
+        return pd.DataFrame(
+            {
+                track: self._summarize(results)
+                for track, results in self._results.groupby("track", sort=True)
+            }
+        ).T
+
+    @property
+    def results(self) -> pd.DataFrame:
+        """レースごとの掛け金と払戻金. 日付・発走時刻の順"""
+        return self._results
+
+
+def _chunks(races: List[BacktestRace], chunk_size: int) -> List[List[BacktestRace]]:
+    """chunk_size 以下ずつに分ける. 1日のレースは chunk_size を超えても分けない"""
+    chunks: List[List[BacktestRace]] = []
+    for _, day_races in itertools.groupby(races, key=lambda race: race.date):
+        day_races = list(day_races)
+        if chunks and len(chunks[-1]) + len(day_races) <= chunk_size:
+            chunks[-1].extend(day_races)
+        else:
+            chunks.append(day_races)
+    return chunks
+
+
+def _run_parallel(
+    tasks: List[Tuple[BettorFactory, List[BacktestRace]]],
+    max_workers: Optional[int],
+) -> List[List[RaceResult]]:
+    """(Bettorを作る関数, レース) のタスクをプロセスプールで実行する. 結果はタスクの順"""
+    if max_workers == 1 or len(tasks) <= 1:
+        return [run_races(factory, races) for factory, races in tasks]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(run_races, factory, races) for factory, races in tasks
+        ]
+        return [future.result() for future in futures]
+
+
+class Backtester:
+    """過去の予測・オッズ・結果で Bettor の成績を調べる
+
+    レースを日ごとにまとめて chunk_size 前後ずつに分け, プロセスプールで並列に賭ける.
+    各プロセスでは日ごとに bettor_factory() で作った Bettor を使い回す.
+    """
+
+    def __init__(
+        self,
+        bettor_factory: BettorFactory = OptimizeTansyoBettor,
+        max_workers: Optional[int] = None,
+        chunk_size: int = 100,
+    ):
+        """コンストラクタ
+
+        Args:
+            bettor_factory (BettorFactory, optional): 引数なしでBettorを作る関数. Defaults to OptimizeTansyoBettor.
+            max_workers (int, optional): プロセス数. 1ならプロセスを作らずに実行する. Defaults to CPU数.
+            chunk_size (int, optional): 1タスクあたりのレース数. 1日のレースは分けない. Defaults to 100.
+        """
+        self._bettor_factory = bettor_factory
+        self._max_workers = max_workers
+        self._chunk_size = chunk_size
+
+    def run(self, races: List[BacktestRace]) -> BacktestReport:
+        """レースを賭けて集計する
+
+        Args:
+            races (List[BacktestRace]): バックテストに使うレース
+
+        Returns:
+            BacktestReport: 集計結果
+        """
+        tasks = [
+            (self._bettor_factory, chunk) for chunk in _chunks(races, self._chunk_size)
+        ]
+        results = _run_parallel(tasks, self._max_workers)
+        return BacktestReport(list(itertools.chain.from_iterable(results)))
+
+    def sweep(
+        self,
+        races: List[BacktestRace],
+        param_grid: Dict[str, List[Any]],
+        bettor_class: Callable[..., Bettor] = OptimizeTansyoBettor,
+        **base_params,
+    ) -> pd.DataFrame:
+        """パラメータの組み合わせごとにバックテストする
+
+        全ての組み合わせとレースのチャンクを1つのプロセスプールに投入する.
+
+        Args:
+            races (List[BacktestRace]): バックテストに使うレース
+            param_grid (Dict[str, List[Any]]): パラメータ名と試す値. 例えば {"pred_threshold": [0, 0.05]}
+            bettor_class (Callable[..., Bettor], optional): Bettorのクラス. Defaults to OptimizeTansyoBettor.
+            **base_params: 全ての組み合わせで共通のパラメータ
+
+        Returns:
+            pd.DataFrame: 組み合わせごとのパラメータと集計結果
+        """
+        names = list(param_grid)
+        combinations = list(itertools.product(*(param_grid[name] for name in names)))
+        chunks = _chunks(races, self._chunk_size)
+
+        tasks = []
+        for values in combinations:
+            factory = partial(bettor_class, **base_params, **dict(zip(names, values)))
+            tasks.extend((factory, chunk) for chunk in chunks)
+        results = _run_parallel(tasks, self._max_workers)
+
+        rows = []
+        for i, values in enumerate(combinations):
+            combination_results = results[i * len(chunks) : (i + 1) * len(chunks)]
+            report = BacktestReport(
+                list(itertools.chain.from_iterable(combination_results))
+            )
+            rows.append({**dict(zip(names, values)), **report.summary()})
+        return pd.DataFrame(rows)
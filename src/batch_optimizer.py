@@ -0,0 +1,187 @@
+from typing import Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+
+def _project_simplex(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """各行を {w >= 0, sum(w) = 1} へ射影する. maskがFalseの要素は0にする
+
+    Args:
+        values (np.ndarray): (レース数, 馬券数) の配列
+        mask (np.ndarray): 有効な馬券
+
+    Returns:
+        np.ndarray: 射影後の配列
+    """
+    values = np.where(mask, values, -np.inf)
+    sorted_values = -np.sort(-values, axis=1)
+    cumsum = np.cumsum(np.where(np.isfinite(sorted_values), sorted_values, 0), axis=1)
+    rank = np.arange(1, values.shape[1] + 1)
+    condition = sorted_values - (cumsum - 1) / rank > 0
+    rho = values.shape[1] - 1 - np.argmax(condition[:, ::-1], axis=1)
+    theta = (cumsum[np.arange(len(values)), rho] - 1) / (rho + 1)
+    return np.where(mask, np.maximum(values - theta[:, np.newaxis], 0), 0)
+
+
+def sharpe_objective_batch(
+    weights: np.ndarray, pred_odds: np.ndarray, outcome_mask: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """レースごとの目的関数と勾配をまとめて計算する
+
+    OptimizeTansyoBettor._objective をレース方向にベクトル化したもの.
+
+    Args:
+        weights (np.ndarray): (レース数, 馬券数) の最適化変数
+        pred_odds (np.ndarray): (レース数, 結果数, 馬券数) の予測確率で重み付けしたオッズ行列
+        outcome_mask (np.ndarray): (レース数, 結果数) の有効な結果
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: レースごとの損失と勾配
+    """
+    n = outcome_mask.sum(axis=1)
+    returns = np.einsum("rot,rt->ro", pred_odds, weights)
+    mean = (returns * outcome_mask).sum(axis=1) / n
+    deviation = (returns - mean[:, np.newaxis]) * outcome_mask
+    std = np.sqrt((deviation**2).sum(axis=1) / (n - 1))
+
+    grad_mean = pred_odds.sum(axis=1) / n[:, np.newaxis]
+    grad_std = (
+        np.einsum("rot,ro->rt", pred_odds, deviation) / ((n - 1) * std)[:, np.newaxis]
+    )
+    grad = (-grad_mean + (mean / std)[:, np.newaxis] * grad_std) / std[:, np.newaxis]
+
+    return -mean / std, grad
+
+
+def solve_sharpe_batch(
+    pred_odds: np.ndarray,
+    outcome_mask: np.ndarray,
+    ticket_mask: np.ndarray,
+    max_iter: int = 1000,
+    tol: float = 1e-9,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """複数レースの目的関数を射影勾配法でまとめて最小化する
+
+    目的関数は賭け金の定数倍に対して不変なので, 馬券の配分を単体 {w >= 0, sum(w) = 1} 上で求める.
+    ステップ幅はレースごとにArmijo条件で調整する.
+
+    Args:
+        pred_odds (np.ndarray): (レース数, 結果数, 馬券数) の予測確率で重み付けしたオッズ行列
+        outcome_mask (np.ndarray): (レース数, 結果数) の有効な結果
+        ticket_mask (np.ndarray): (レース数, 馬券数) の有効な馬券
+        max_iter (int, optional): 最大反復回数. Defaults to 1000.
+        tol (float, optional): 収束判定に使う配分の変化量. Defaults to 1e-9.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: 配分, 収束したか, 損失
+    """
+    num_races = pred_odds.shape[0]
+    num_tickets = ticket_mask.sum(axis=1)
+
+    weights = np.where(ticket_mask, 1 / np.maximum(num_tickets, 1)[:, np.newaxis], 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loss, grad = sharpe_objective_batch(weights, pred_odds, outcome_mask)
+    step = np.ones(num_races)
+    converged = np.zeros(num_races, dtype=bool)
+
+    # 1頭だけのレースは分散が定義できないので最適化しない
+    active = num_tickets >= 2
+    for _ in range(max_iter):
+        if not active.any():
+            break
+
+        rows = np.flatnonzero(active)
+        candidate = _project_simplex(
+            weights[rows] - step[rows, np.newaxis] * grad[rows], ticket_mask[rows]
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            candidate_loss, candidate_grad = sharpe_objective_batch(
+                candidate, pred_odds[rows], outcome_mask[rows]
+            )
+
+        change = candidate - weights[rows]
+        accept = candidate_loss <= loss[rows] + 1e-4 * (grad[rows] * change).sum(axis=1)
+        accept &= np.isfinite(candidate_loss)
+
+        accepted = rows[accept]
+        weights[accepted] = candidate[accept]
+        loss[accepted] = candidate_loss[accept]
+        grad[accepted] = candidate_grad[accept]
+        step[accepted] *= 1.5
+        step[rows[~accept]] *= 0.5
+
+        done = (np.abs(change).max(axis=1) < tol) | (step[rows] < 1e-12)
+        converged[rows[done]] = True
+        active[rows[done]] = False
+
+    converged &= num_tickets >= 2
+    return weights, converged, loss
+
+
+def solve_sharpe_sparse(
+    hit_matrix: sp.spmatrix,
+    odds: np.ndarray,
+    outcome_prob: np.ndarray,
+    max_iter: int = 2000,
+    tol: float = 1e-9,
+) -> Tuple[np.ndarray, bool, float]:
+    """的中行列を疎行列のまま使って1レースの目的関数を射影勾配法で最小化する
+
+    目的関数は solve_sharpe_batch と同じ. 予測確率で重み付けした収支行列
+    B = diag(p) (H diag(o) - 1) は密になるので作らず, H のみで B w と B^T v を計算する.
+
+    Args:
+        hit_matrix (sp.spmatrix): 着順の結果 x 馬券 の的中行列 H
+        odds (np.ndarray): 馬券ごとのオッズ o
+        outcome_prob (np.ndarray): 着順の結果ごとの予測確率 p
+        max_iter (int, optional): 最大反復回数. Defaults to 2000.
+        tol (float, optional): 収束判定に使う配分の変化量. Defaults to 1e-9.
+
+    Returns:
+        Tuple[np.ndarray, bool, float]: 配分, 収束したか, 損失
+    """
+    num_outcomes, num_tickets = hit_matrix.shape
+    hit_matrix = sp.csr_matrix(hit_matrix)
+    hit_matrix_t = hit_matrix.T.tocsr()
+    prob_sum = outcome_prob.sum()
+    grad_mean = (odds * (hit_matrix_t @ outcome_prob) - prob_sum) / num_outcomes
+
+    def objective(weights):
+        returns = outcome_prob * (hit_matrix @ (odds * weights) - weights.sum())
+        mean = returns.mean()
+        deviation = returns - mean
+        std = np.sqrt(deviation @ deviation / (num_outcomes - 1))
+
+        weighted = outcome_prob * deviation
+        grad_std = (odds * (hit_matrix_t @ weighted) - weighted.sum()) / (
+            (num_outcomes - 1) * std
+        )
+        return -mean / std, (-grad_mean + mean / std * grad_std) / std
+
+    if num_tickets < 2 or num_outcomes < 2:
+        return np.ones(num_tickets) / max(num_tickets, 1), False, np.nan
+
+    mask = np.ones((1, num_tickets), dtype=bool)
+    weights = np.ones(num_tickets) / num_tickets
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loss, grad = objective(weights)
+    step = 1.0
+    for _ in range(max_iter):
+        candidate = _project_simplex((weights - step * grad)[np.newaxis], mask)[0]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            candidate_loss, candidate_grad = objective(candidate)
+
+        change = candidate - weights
+        if np.isfinite(candidate_loss) and (
+            candidate_loss <= loss + 1e-4 * (grad @ change)
+        ):
+            weights, loss, grad = candidate, candidate_loss, candidate_grad
+            step *= 1.5
+        else:
+            step *= 0.5
+
+        if np.abs(change).max() < tol or step < 1e-12:
+            return weights, True, loss
+
+    return weights, False, loss
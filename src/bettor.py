@@ -1,10 +1,23 @@
+import logging
 from abc import ABCMeta, abstractmethod
-from typing import List
+from typing import List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
 import scipy.optimize as sco
 
+from src.allocation import allocate_bets
+from src.batch_optimizer import solve_sharpe_batch, solve_sharpe_sparse
+from src.solution_cache import SolutionCache
+from src.ticket_matrix import (
+    hit_matrix,
+    outcome_probabilities,
+    ticket_labels,
+)
+from src.tracing import count, span
+
+logger = logging.getLogger(__name__)
+
 
 class Bettor(metaclass=ABCMeta):
     @abstractmethod
@@ -12,19 +25,35 @@ class Bettor(metaclass=ABCMeta):
         return NotImplementedError()
 
     @abstractmethod
-    def select_bet(self, pred, odds):
+    def select_bet(
+        self, pred: pd.Series, odds: pd.Series, race_id: Optional[str] = None
+    ) -> pd.Series:
+        """購入する馬券を選ぶ
+
+        Args:
+            pred (pd.Series): 馬番をindexとする単勝予測確率
+            odds (pd.Series): 馬番をindexとする単勝オッズ
+            race_id (str, optional): レースID. レースをまたいで状態を持つ Bettor が使う. Defaults to None.
+
+        Returns:
+            pd.Series: 馬券ごとの掛け金
+        """
         return NotImplementedError()
 
 
 class OptimizeTansyoBettor(Bettor):
     """単勝予測確率と単勝オッズから購入馬券の最適化を行う。"""
 
+    _bet_type = "tansyo"
+
     def __init__(
         self,
         budget: int = 1000,
         pred_threshold: float = 0,
         odds_threshold: float = 1.0,
         exceed_profit_rate: float = 1.1,
+        solution_cache: Optional[SolutionCache] = None,
+        min_bet: int = 100,
     ):
         """コンストラクタ
 
@@ -32,12 +61,20 @@ class OptimizeTansyoBettor(Bettor):
             budget (int, optional): レースごとの投資予算. Defaults to 1000.
             pred_threshold (float, optional): 予測確率閾値. Defaults to 0.
             odds_threshold (float, optional): オッズ閾値. Defaults to 1.0.
-            exceed_profit_rate (float, optional): 目標回収率. Defaults to 1.1.
+            exceed_profit_rate (float, optional): 目標回収率. 買う馬券はどれも的中時の払戻が合計掛け金のこの倍率以上になる. Defaults to 1.1.
+            solution_cache (SolutionCache, optional): レースごとの最適化結果のキャッシュ. Defaults to None.
+            min_bet (int, optional): 買う馬券の最低掛け金. Defaults to 100.
         """
         self._budget = budget
         self._pred_threshold = pred_threshold
         self._odds_threshold = odds_threshold
         self._exceed_profit_rate = exceed_profit_rate
+        self._solution_cache = solution_cache
+        self._min_bet = min_bet
+
+    @property
+    def solution_cache(self) -> Optional[SolutionCache]:
+        return self._solution_cache
 
     def _generate_all_ticket(self, umaban: int) -> List[int]:
         """馬券種を返す
@@ -64,31 +101,84 @@ class OptimizeTansyoBettor(Bettor):
         Returns:
             np.array: オッズ行列
         """
-        odds_series = pd.Series(odds, index=index)
+        labels = ticket_labels(self._bet_type, umaban_list)
+        odds = np.asarray(odds, dtype=float)
+        if list(index) != labels:
+            # オッズの並びを的中行列の馬券の並びに合わせる
+            position = {f"{ticket}": i for i, ticket in enumerate(index)}
+            odds = np.array(
+                [odds[position[label]] if label in position else 0 for label in labels]
+            )
+
+        # 的中馬券のみoddsが入り、それ以外は0の行列を作成. 最後の列は見送り
+        num_horses = len(umaban_list)
+        if self._bet_type == "tansyo":
+            # 単勝の的中行列は単位行列なので疎行列を介さずに作る
+            odds_matrix = np.zeros((num_horses, num_horses + 1))
+            odds_matrix[np.arange(num_horses), np.arange(num_horses)] = odds
+            odds_matrix[:, -1] = 1
+            return odds_matrix
 
-        odds_dict = {}
-        odds_vectors = []
-        for umaban in umaban_list:
-            hit_ticket = self._generate_all_ticket(umaban)
+        hit = hit_matrix(self._bet_type, num_horses)
+        odds_matrix = hit.multiply(odds[np.newaxis, :]).toarray()
+        return np.hstack([odds_matrix, np.ones((odds_matrix.shape[0], 1))])
 
-            # 的中馬券のみoddsが入り、それ以外は0のベクトルを作成
-            hit_odds = pd.Series(np.zeros_like(odds), index)
-            hit_odds[hit_ticket] = 1
-            tmp_odds = odds_series * hit_odds
-            odds_vectors.append(tmp_odds)
+    def _allocate_bets(
+        self, fraction: np.ndarray, odds: np.ndarray, budget: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """レースごとの配分を100円単位の掛け金にする
 
-        odds_matrix = pd.concat(odds_vectors, axis=1).T
-        odds_matrix["not_bet"] = 1
+        allocate_bets を (レース数, 馬券数) の配列の行ごとに行う.
+
+        Args:
+            fraction (np.ndarray): 馬券ごとの配分
+            odds (np.ndarray): 馬券ごとのオッズ
+            budget (int): レースごとの投資予算
 
-        return odds_matrix.values
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: 馬券ごとの掛け金と見送る金額
+        """
+        bet = np.array(
+            [
+                allocate_bets(
+                    race_fraction,
+                    race_odds,
+                    budget,
+                    self._exceed_profit_rate,
+                    self._min_bet,
+                )
+                for race_fraction, race_odds in zip(fraction, odds)
+            ]
+        ).reshape(fraction.shape)
+        return bet, budget - bet.sum(axis=1)
+
+    @staticmethod
+    def _correct_not_exceed_bet_array(
+        bet: np.ndarray, odds: np.ndarray, budget: int
+    ) -> np.ndarray:
+        """払戻が予算を超えない馬券の掛け金を見送りに回す
+
+        Args:
+            bet (np.ndarray): 馬券ごとの掛け金. 最後の要素が見送る金額 (not_bet)
+            odds (np.ndarray): bet と同じ並びのオッズ
+            budget (int): 賭けに利用可能な合計予算
+
+        Returns:
+            np.ndarray: 調整した掛け金. 元の配列は変更しない
+        """
+        bet = bet.copy()
+        # 見送りを除いた利用可能な予算
+        available_budget = budget - bet[-1]
+        not_exceed = (bet[:-1] * odds[:-1] < available_budget) & (bet[:-1] != 0)
+        bet[-1] += bet[:-1][not_exceed].sum()
+        bet[:-1][not_exceed] = 0
+        return bet
 
     def _correct_not_exceed_bet(self, df: pd.DataFrame, budget: int) -> pd.DataFrame:
         """
         データフレーム内の賭け金額を調整し、合計リターンが予算を超えないようにします。
 
-        この関数は各賭けエントリについてのデータフレーム内の賭け金額とリターン値を変更します。
-        賭けの合計額が指定された予算を超えないようにします。また、オッズに基づいてリターンを再計算し、
-        'not_bet' エントリをそれに応じて更新します。
+        _correct_not_exceed_bet_array をデータフレームで行う. 'return' の列があればオッズから計算し直す.
 
         引数:
             df (pandas.DataFrame): 賭けのデータを含むデータフレーム。'bet' と 'odds' の列があり、
@@ -99,32 +189,50 @@ class OptimizeTansyoBettor(Bettor):
             pd.DataFrame: 賭け金額とリターンが調整されたデータフレーム。
 
         """
-        # 元のデータを変更しないようにデータフレームのコピーを作成
+        # 'not_bet' を最後に並べて配列版で調整する
+        is_not_bet = np.asarray(df.index == "not_bet")
+        order = np.concatenate(
+            [np.flatnonzero(~is_not_bet), np.flatnonzero(is_not_bet)]
+        )
+        bet = df["bet"].to_numpy(dtype=float)[order]
+        odds = df["odds"].to_numpy(dtype=float)[order]
+        corrected = np.empty_like(bet)
+        corrected[order] = self._correct_not_exceed_bet_array(bet, odds, budget)
+
         df_copy = df.copy()
+        df_copy["bet"] = corrected
+        if "return" in df_copy.columns:
+            df_copy["return"] = np.where(is_not_bet, corrected, corrected * df["odds"])
+        return df_copy
 
-        # 'not_bet' エントリを除いた利用可能な予算を計算
-        available_budget = budget - df.loc["not_bet", "bet"]
+    @staticmethod
+    def _objective(
+        weights: np.ndarray, pred_odds_matrix: np.ndarray
+    ) -> Tuple[float, np.ndarray]:
+        """目的関数とその勾配
 
-        # 各賭けのリターンを計算
-        df_copy["return"] = df["bet"] * df["odds"]
+        予測確率で重み付けした収支 r = B w の平均を標準偏差で割った値の符号を反転したもの.
+        m = mean(r), s^2 = var(r) (不偏分散) として
+        d(-m/s)/dw = -B^T 1 / (n s) + m B^T (r - m) / ((n - 1) s^3)
 
-        # 払戻が予算を超えない場合にTrue
-        df_copy["not_exceed"] = (
-            (df_copy["return"] < available_budget)
-            & (df_copy["bet"] != 0)
-            & (df_copy.index != "not_bet")
-        )
+        Args:
+            weights (np.ndarray): 最適化変数
+            pred_odds_matrix (np.ndarray): 予測確率で重み付けしたオッズ行列 B. 2行 (結果) 以上
 
-        # 'not_bet' エントリを自身の賭け金と予算を超えない賭けの合計金額で更新
-        df_copy.loc["not_bet", ["bet", "return"]] = (
-            df.loc["not_bet", "bet"] + df_copy.loc[df_copy["not_exceed"], "bet"].sum()
-        )
+        Returns:
+            Tuple[float, np.ndarray]: 損失と勾配
+        """
+        n = pred_odds_matrix.shape[0]
+        returns = pred_odds_matrix @ weights
+        mean = returns.mean()
+        deviation = returns - mean
+        std = np.sqrt(deviation @ deviation / (n - 1))
 
-        # 予算を超えない賭けの賭け金とリターンを0に設定
-        df_copy.loc[df_copy["not_exceed"], ["bet", "return"]] = 0
+        grad_mean = pred_odds_matrix.sum(axis=0) / n
+        grad_std = (pred_odds_matrix.T @ deviation) / ((n - 1) * std)
+        grad = -grad_mean / std + mean * grad_std / std**2
 
-        # 変更されたデータフレームを返す
-        return df_copy[df.columns]
+        return -mean / std, grad
 
     def _optimize(
         self,
@@ -133,126 +241,437 @@ class OptimizeTansyoBettor(Bettor):
         index: List[str],
         umaban_list: List[int],
         budget: int = 1000,
-    ) -> pd.DataFrame:
-        def problem_func(
-            weights: np.ndarray,
-            odds_matrix: np.ndarray,
-            pred: np.ndarray,
-        ):
-            """目的関数
-
-            Args:
-                weights (np.ndarray): 最適化変数
-                odds_matrix (np.ndarray): オッズ行列
-                pred (np.ndarray): 予測確率
-
-            Returns:
-                float: 損失
-            """
-            return -(pred * np.dot(odds_matrix, weights)).mean() / np.sqrt(
-                np.cov(pred * np.dot(odds_matrix, weights))
-            )
+        race_id: Optional[str] = None,
+    ) -> pd.Series:
+        odds = np.asarray(odds, dtype=float)
+        pred = np.asarray(pred, dtype=float)
+
+        # 前回のポーリングと同じ入力なら前回の結果を返す
+        cache = self._solution_cache if race_id is not None else None
+        warm_x0 = None
+        if cache is not None:
+            cached_bet, warm_x0 = cache.lookup(race_id, index, pred, odds, budget)
+            if cached_bet is not None:
+                count("optimize_cache_hit")
+                return cached_bet
+            if warm_x0 is not None:
+                count("optimize_warm_start")
 
         def sum_x_equal_1(x):
             return -np.sum(x) + 1
 
-        def all_bet_return_exceed_budget(x: np.ndarray, budget: int):
-            loss_return = 0
-            # not_betを除く全種で確認
-            for i in range(len(x) - 1):
-                # 100円以上賭ける馬券である場合
-                if np.round(x[i] * budget / 100) > 0:
-                    # 馬券的中の際に得られる利益が目標以上か確認する
-                    exceed_profit = np.round(x[i] * budget / 100) * 100 * odds[
-                        i
-                    ] - self._exceed_profit_rate * budget * (
-                        1 - np.round(x[-1] * budget / 100)
-                    )
-                    if exceed_profit < 0:
-                        loss_return += exceed_profit
-
-            return loss_return
-
-        def all_bet_upper_minimum_bet(x: np.ndarray, budget: int):
-            loss = 0
-            for i in range(len(x) - 1):
-                # 少額でもかける馬券に対して
-                if x[i] > 0:
-                    # 100円単位の掛け金に補正
-                    bet = np.round(x[i] * budget / 100) * 100
-                    # 少額だが100円未満の掛け金は損失とする
-                    if bet == 0:
-                        loss += x[i]
-                return loss
+        def sum_x_equal_1_jac(x):
+            return -np.ones_like(x)
 
         odds_matrix = self._generate_odds_matrix(odds, index, umaban_list) - 1
-        odds = np.concatenate((odds, np.ones(1)), axis=0)
+        # 最後の要素が見送り (not_bet)
+        odds = np.append(odds, 1.0)
+
+        # 予測確率で重み付けした収支行列
+        pred_odds_matrix = pred[:, np.newaxis] * odds_matrix
+
+        # 結果が1つだけだと分散が定義できないので最適化せずに見送る
+        if pred_odds_matrix.shape[0] < 2:
+            return pd.Series(
+                [0] * len(index) + [budget],
+                index=list(index) + ["not_bet"],
+                name="bet",
+            )
 
-        # 制約条件
-        constraints = []
-        constraints.append({"type": "ineq", "fun": sum_x_equal_1})
-        """
-        constraints.append(
-            {"type": "ineq", "fun": all_bet_return_exceed_budget, "args": (budget,)}
-        )
-        
-        constraints.append(
-            {"type": "ineq", "fun": all_bet_upper_minimum_bet, "args": (budget,)}
-        )
-        """
-        # 初期解
-        x0 = np.ones(len(odds)) / len(odds)
+        # 制約条件. 最低掛け金と目標回収率は掛け金を決める時に満たす
+        constraints = [{"type": "ineq", "fun": sum_x_equal_1, "jac": sum_x_equal_1_jac}]
+        # 初期解. 前回からの変化が小さければ前回の最適解から始める
+        if warm_x0 is not None:
+            x0 = warm_x0
+        else:
+            x0 = np.ones(len(odds)) / len(odds)
 
         # 上下制約
         bounds = [(0, 1)] * len(odds)
 
         # 最適化実行
         opts = sco.minimize(
-            fun=problem_func,
+            fun=self._objective,
             x0=x0,
-            args=(odds_matrix, pred),
+            args=(pred_odds_matrix,),
+            jac=True,
             method="SLSQP",
             bounds=bounds,
             constraints=constraints,
         )
 
-        df = pd.DataFrame([], index=list(index) + ["not_bet"])
-        df["pred"] = pred + [1]
-        df["odds"] = odds
-        df["fraction"] = opts["x"]
-        df["bet"] = np.round(opts["x"] * budget / 100) * 100
-        df["return"] = df["bet"] * odds
+        # 予算, 最低掛け金, 目標回収率を満たす100円単位の掛け金にする
+        bet = allocate_bets(
+            opts["x"][:-1], odds[:-1], budget, self._exceed_profit_rate, self._min_bet
+        )
+        bet = np.append(bet, budget - bet.sum())
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "最適化結果: success=%s\n%s",
+                opts["success"],
+                pd.DataFrame(
+                    {
+                        "pred": np.append(pred, 1.0),
+                        "odds": odds,
+                        "fraction": opts["x"],
+                        "bet": bet,
+                        "return": bet * odds,
+                    },
+                    index=list(index) + ["not_bet"],
+                ),
+            )
+        if not opts["success"]:
+            logger.info("最適化に失敗しました: %s", opts["message"])
+            count("optimize_failed")
+            bet = np.zeros_like(bet)
+            bet[-1] = budget
+
+        # Seriesにするのは結果を返す時だけ
+        bet = pd.Series(
+            bet.astype(int), index=list(index) + ["not_bet"], name="bet", copy=False
+        )
+        if cache is not None:
+            cache.store(
+                race_id,
+                index,
+                pred,
+                odds[:-1],
+                budget,
+                opts["x"],
+                bet,
+                opts["nit"],
+                warm_start=warm_x0 is not None,
+            )
+        return bet
 
-        # 合計掛け金が予算を超えないように調整
-        df = self._correct_not_exceed_bet(df, budget)
+    def select_bet(
+        self, pred: pd.Series, odds: pd.Series, race_id: Optional[str] = None
+    ) -> pd.DataFrame:
+        """購入する馬券を選ぶ
 
-        print(opts["success"])
-        print(df)
-        if opts["success"]:
-            return df["bet"].astype(int)
-        else:
-            tmp = pd.Series(np.zeros_like(df["fraction"]), index=df.index)
-            tmp["not_bet"] = budget
-            return tmp
-
-    def select_bet(self, pred: pd.Series, odds: pd.Series) -> pd.DataFrame:
-        index = pred.index
-        umaban_list = pred.index
-        pred_list = []
-        odds_list = []
-        index_list = []
-        for umaban in umaban_list:
-            if (pred[umaban] >= self._pred_threshold) and (
-                odds[umaban] >= self._odds_threshold
-            ):
-                pred_list.append(pred[umaban])
-                odds_list.append(odds[umaban])
-                index_list.append(f"{umaban}")
+        Args:
+            pred (pd.Series): 馬番をindexとする単勝予測確率
+            odds (pd.Series): 馬番をindexとする単勝オッズ
+            race_id (str, optional): レースID. 指定するとsolution_cacheで前回の結果を再利用する. Defaults to None.
+
+        Returns:
+            pd.Series: 馬券ごとの掛け金
+        """
+        # 予測とオッズを馬番で揃えた配列にする. オッズが無い馬 (取消など) は対象にしない
+        pred_values = pred.to_numpy(dtype=float)
+        odds_values = odds.reindex(pred.index).to_numpy(dtype=float)
+        selected = (pred_values >= self._pred_threshold) & (
+            odds_values >= self._odds_threshold
+        )
+        index_list = [f"{umaban}" for umaban in pred.index[selected]]
 
         if len(index_list) > 0:
-            bet = self._optimize(
-                odds_list, pred_list, index_list, index_list, self._budget
-            )
+            with span("optimize", race_id=race_id, horses=len(index_list)):
+                bet = self._optimize(
+                    odds_values[selected],
+                    pred_values[selected],
+                    index_list,
+                    index_list,
+                    self._budget,
+                    race_id,
+                )
         else:
             bet = pd.Series([self._budget], name="bet", index=["not_bet"])
         return bet
+
+    def select_bets(
+        self, preds: List[pd.Series], odds: List[pd.Series]
+    ) -> List[pd.Series]:
+        """複数レースの購入馬券をまとめて最適化する
+
+        レースを (レース, 結果, 馬券) の3次元配列に詰めて射影勾配法で一度に解く.
+        目的関数は賭け金の定数倍に対して不変なので, 配分は予算全体に対する比率として求める.
+        select_bet (SLSQP) と比べて目的関数の値は1e-6以上悪くならず,
+        同じ最適解に収束した場合の配分比率の差は0.02以内になる.
+
+        Args:
+            preds (List[pd.Series]): レースごとの単勝予測確率
+            odds (List[pd.Series]): レースごとの単勝オッズ
+
+        Returns:
+            List[pd.Series]: レースごとの掛け金. select_bet と同じく "not_bet" を含む
+        """
+        budget = self._budget
+        races = []
+        for pred, race_odds in zip(preds, odds):
+            race_odds = race_odds.reindex(pred.index)
+            selected = (pred >= self._pred_threshold) & (
+                race_odds >= self._odds_threshold
+            )
+            races.append(
+                (
+                    [f"{umaban}" for umaban in pred.index[selected]],
+                    pred[selected].to_numpy(dtype=float),
+                    race_odds[selected].to_numpy(dtype=float),
+                )
+            )
+
+        num_races = len(races)
+        num_horses = max([len(index) for index, _, _ in races] + [1])
+
+        # レースごとの頭数の違いはマスクで扱う
+        mask = np.zeros((num_races, num_horses), dtype=bool)
+        pred_array = np.zeros((num_races, num_horses))
+        odds_array = np.ones((num_races, num_horses))
+        for i, (index, race_pred, race_odds) in enumerate(races):
+            mask[i, : len(index)] = True
+            pred_array[i, : len(index)] = race_pred
+            odds_array[i, : len(index)] = race_odds
+
+        # 単勝の収支行列 (的中した馬券のみオッズ, 全馬券で賭け金1を払う)
+        odds_matrix = np.eye(num_horses) * odds_array[:, np.newaxis, :] - 1
+        pred_odds = (
+            pred_array[:, :, np.newaxis]
+            * odds_matrix
+            * (mask[:, :, np.newaxis] & mask[:, np.newaxis, :])
+        )
+
+        fraction, success, _ = solve_sharpe_batch(pred_odds, mask, mask)
+
+        bet, not_bet = self._allocate_bets(fraction, odds_array, budget)
+
+        bets = []
+        for i, (index, _, _) in enumerate(races):
+            if len(index) == 1:
+                # 1頭だけの場合は select_bet と同じく最適化に失敗する
+                success[i] = False
+            if success[i]:
+                values = np.append(bet[i, : len(index)], not_bet[i])
+            else:
+                values = np.append(np.zeros(len(index)), budget)
+            bets.append(
+                pd.Series(values, index=index + ["not_bet"], name="bet").astype(int)
+            )
+        return bets
+
+
+class OptimizeTicketBettor(OptimizeTansyoBettor):
+    """単勝予測確率と各馬券種のオッズから購入馬券の最適化を行う。
+
+    着順の結果ごとの確率は単勝予測確率からHarvilleの式で計算し,
+    着順の結果 x 馬券 の的中行列を疎行列のまま使って最適化する.
+    """
+
+    _bet_type = None
+
+    def select_bet(
+        self, pred: pd.Series, odds: pd.Series, race_id: Optional[str] = None
+    ) -> pd.Series:
+        """購入馬券を最適化する
+
+        Args:
+            pred (pd.Series): 馬番をindexとする単勝予測確率
+            odds (pd.Series): 馬券のラベル ("1-2", "1>2>3" など) をindexとするオッズ
+            race_id (str, optional): レースID. 指定するとsolution_cacheで前回の結果を再利用する. Defaults to None.
+
+        Returns:
+            pd.Series: 馬券ごとの掛け金. 見送る金額は "not_bet"
+        """
+        umaban_list = [f"{umaban}" for umaban in pred.index]
+        labels = np.asarray(ticket_labels(self._bet_type, umaban_list), dtype=object)
+        hit = hit_matrix(self._bet_type, len(umaban_list))
+        pred_values = pred.to_numpy(dtype=float)
+        outcome_prob = outcome_probabilities(self._bet_type, pred_values)
+
+        # 的中確率とオッズが閾値以上の馬券が対象. オッズが無い馬券は除く
+        ticket_odds = odds.reindex(labels).to_numpy(dtype=float)
+        ticket_prob = hit.T @ outcome_prob
+        selected = (ticket_prob >= self._pred_threshold) & (
+            ticket_odds >= self._odds_threshold
+        )
+        if not selected.any():
+            return pd.Series([self._budget], name="bet", index=["not_bet"])
+        index = list(labels[selected])
+
+        # 前回のポーリングと同じ入力なら前回の結果を返す.
+        # 射影勾配法は初期解を受け取らないので, 前回の最適解からは始めない
+        cache = self._solution_cache if race_id is not None else None
+        if cache is not None:
+            cached_bet, _ = cache.lookup(
+                race_id, index, pred_values, ticket_odds[selected], self._budget
+            )
+            if cached_bet is not None:
+                count("optimize_cache_hit")
+                return cached_bet
+
+        with span(
+            "optimize",
+            race_id=race_id,
+            horses=len(umaban_list),
+            bet_type=self._bet_type,
+        ):
+            fraction, success, _ = solve_sharpe_sparse(
+                hit[:, selected], ticket_odds[selected], outcome_prob
+            )
+        if success:
+            bet, not_bet = self._allocate_bets(
+                fraction[np.newaxis], ticket_odds[selected][np.newaxis], self._budget
+            )
+            values = np.append(bet[0], not_bet)
+        else:
+            count("optimize_failed")
+            values = np.append(np.zeros(selected.sum()), self._budget)
+
+        bet = pd.Series(values, index=index + ["not_bet"], name="bet").astype(int)
+        if cache is not None:
+            cache.store(
+                race_id,
+                index,
+                pred_values,
+                ticket_odds[selected],
+                self._budget,
+                fraction,
+                bet,
+                0,
+            )
+        return bet
+
+
+class OptimizeUmarenBettor(OptimizeTicketBettor):
+    """単勝予測確率と馬連オッズから購入馬券の最適化を行う。"""
+
+    _bet_type = "umaren"
+
+
+class OptimizeWideBettor(OptimizeTicketBettor):
+    """単勝予測確率とワイドオッズから購入馬券の最適化を行う。"""
+
+    _bet_type = "wide"
+
+
+class OptimizeUmatanBettor(OptimizeTicketBettor):
+    """単勝予測確率と馬単オッズから購入馬券の最適化を行う。"""
+
+    _bet_type = "umatan"
+
+
+class OptimizeSanrentanBettor(OptimizeTicketBettor):
+    """単勝予測確率と三連単オッズから購入馬券の最適化を行う。"""
+
+    _bet_type = "sanrentan"
+
+
+class KellyTansyoBettor(Bettor):
+    """単勝予測確率と単勝オッズからケリー基準で掛け金を決める。
+
+    単勝は結果が互いに排他なので, 期待対数収益を最大にする配分は反復なしに求まる.
+    期待値 p * o の大きい順に並べ, 期待値が見送る割合の基準値 R を上回る馬までを買う.
+    買う馬の集合を S として R = (1 - Σ_S p) / (1 - Σ_S 1/o), 配分は f = p - R / o.
+    並べ替えだけなので O(n log n) で, 最適化が収束しないことはない.
+    """
+
+    def __init__(
+        self,
+        budget: int = 1000,
+        pred_threshold: float = 0,
+        odds_threshold: float = 1.0,
+        kelly_fraction: float = 1.0,
+    ):
+        """コンストラクタ
+
+        Args:
+            budget (int, optional): レースごとの投資予算. Defaults to 1000.
+            pred_threshold (float, optional): 予測確率閾値. Defaults to 0.
+            odds_threshold (float, optional): オッズ閾値. Defaults to 1.0.
+            kelly_fraction (float, optional): ケリー基準の配分に掛ける割合. 0.5ならハーフケリー. Defaults to 1.0.
+        """
+        if not 0 < kelly_fraction <= 1:
+            raise ValueError(f"kelly_fraction は0より大きく1以下: {kelly_fraction}")
+        self._budget = budget
+        self._pred_threshold = pred_threshold
+        self._odds_threshold = odds_threshold
+        self._kelly_fraction = kelly_fraction
+
+    @property
+    def solution_cache(self) -> None:
+        # 反復しないので前回の結果は使わない
+        return None
+
+    @staticmethod
+    def kelly_fractions(
+        pred: np.ndarray, odds: np.ndarray, candidates: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """ケリー基準の配分
+
+        Args:
+            pred (np.ndarray): 全出走馬の単勝予測確率
+            odds (np.ndarray): 単勝オッズ
+            candidates (np.ndarray, optional): 買う候補の馬のマスク. Defaults to 全て.
+
+        Returns:
+            np.ndarray: 予算に対する馬ごとの配分. 買わない馬は0
+        """
+        pred = np.asarray(pred, dtype=float)
+        odds = np.asarray(odds, dtype=float)
+        if candidates is None:
+            candidates = np.ones(len(pred), dtype=bool)
+        fraction = np.zeros(len(pred))
+
+        index = np.flatnonzero(candidates)
+        order = index[np.argsort(-(pred[index] * odds[index]), kind="stable")]
+        expected = pred[order] * odds[order]
+        # 期待値の大きい順に k 頭を買う場合の基準値
+        denominator = 1 - np.cumsum(1 / odds[order])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            reserve = (1 - np.cumsum(pred[order])) / denominator
+        previous = np.concatenate(([1.0], reserve[:-1]))
+        # 期待値が基準値以下になるか, 買い占めになる馬の手前まで買う
+        enter = (expected > previous) & (denominator > 0)
+        num_bets = len(order) if enter.all() else int(np.argmin(enter))
+        if num_bets == 0:
+            return fraction
+
+        selected = order[:num_bets]
+        fraction[selected] = pred[selected] - reserve[num_bets - 1] / odds[selected]
+        return fraction
+
+    @staticmethod
+    def _round_to_units(amount: np.ndarray, budget: int) -> np.ndarray:
+        """掛け金を100円単位に丸める. 合計が予算を超える場合は切り上げ幅の大きい馬券から減らす"""
+        units = np.round(amount / 100)
+        excess = int(units.sum() - budget // 100)
+        if excess > 0:
+            over = np.argsort(-(units - amount / 100), kind="stable")[:excess]
+            units[over] -= 1
+        return units * 100
+
+    def select_bet(
+        self, pred: pd.Series, odds: pd.Series, race_id: Optional[str] = None
+    ) -> pd.Series:
+        """購入する馬券を選ぶ
+
+        Args:
+            pred (pd.Series): 馬番をindexとする単勝予測確率
+            odds (pd.Series): 馬番をindexとする単勝オッズ
+            race_id (str, optional): レースID. ログにだけ使う. Defaults to None.
+
+        Returns:
+            pd.Series: 馬券ごとの掛け金. OptimizeTansyoBettor と同じく閾値を満たす馬と "not_bet"
+        """
+        race_odds = odds.reindex(pred.index).to_numpy(dtype=float)
+        pred_values = pred.to_numpy(dtype=float)
+        # オッズが無い馬 (取消など) は買わない
+        selected = (
+            (pred_values >= self._pred_threshold)
+            & (race_odds >= self._odds_threshold)
+            & ~np.isnan(race_odds)
+        )
+        if not selected.any():
+            return pd.Series([self._budget], name="bet", index=["not_bet"])
+
+        with span(
+            "optimize", race_id=race_id, horses=int(selected.sum()), engine="kelly"
+        ):
+            fraction = self.kelly_fractions(pred_values, race_odds, selected)
+        bet = self._round_to_units(
+            fraction[selected] * self._kelly_fraction * self._budget, self._budget
+        )
+        values = np.append(bet, self._budget - bet.sum())
+        index = [f"{umaban}" for umaban in pred.index[selected]] + ["not_bet"]
+        return pd.Series(values, index=index, name="bet").astype(int)
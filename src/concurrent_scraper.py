@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, NamedTuple, Optional, Union
+from urllib.parse import urlparse
+
+import pandas as pd
+
+from src.scraper import OddsScraper
+
+if TYPE_CHECKING:
+    from src.prefetch import OddsPrefetcher
+
+
+class OddsResult(NamedTuple):
+    """1レース分のオッズ取得結果"""
+
+    race: Dict[str, Any]
+    odds: Optional[pd.Series]
+    error: Optional[BaseException]
+
+
+class HostLimiter:
+    """ホストごとの同時アクセス数を制限する"""
+
+    def __init__(self, per_host_limit: int):
+        self._per_host_limit = per_host_limit
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def limit(self, host: str, timeout: Optional[float] = None):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self._per_host_limit)
+                self._semaphores[host] = semaphore
+
+        if not semaphore.acquire(timeout=timeout):
+            raise TimeoutError(f"{host} への接続待ちがタイムアウトしました")
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+class ConcurrentOddsScraper:
+    """同じ時間帯に発走する複数レースのオッズを並行して取得する"""
+
+    def __init__(
+        self,
+        scraper: Union[OddsScraper, "OddsPrefetcher"],
+        max_workers: int = 4,
+        per_host_limit: int = 2,
+        timeout: float = 60.0,
+    ):
+        """コンストラクタ
+
+        Args:
+            scraper (Union[OddsScraper, OddsPrefetcher]): 1レース分のオッズを取得するスクレイパー.
+                先読みしたオッズを使う場合は OddsPrefetcher
+            max_workers (int, optional): 同時に取得するレース数の上限. Defaults to 4.
+            per_host_limit (int, optional): ホストごとの同時アクセス数. Defaults to 2.
+            timeout (float, optional): 全レースの取得にかける最大秒数. Defaults to 60.0.
+        """
+        self._scraper = scraper
+        self._max_workers = max_workers
+        self._limiter = HostLimiter(per_host_limit)
+        self._host = urlparse(scraper.base_url).netloc
+        self._timeout = timeout
+
+    def _get_odds(self, year: str, race: Dict[str, Any]) -> pd.Series:
+        with self._limiter.limit(self._host, self._timeout):
+            return self._scraper.get_odds_by_race(
+                year, race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+            )
+
+    def fetch_all(self, year: str, races: List[Dict[str, Any]]) -> Iterator[OddsResult]:
+        """全レースのオッズを並行して取得し、取得できた順に返す
+
+        Args:
+            year (str): 年
+            races (List[Dict[str, Any]]): 予測JSONのレース情報
+
+        Yields:
+            OddsResult: 取得結果. 失敗・タイムアウトした場合は error に例外が入る
+        """
+        if not races:
+            return
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(self._max_workers, len(races)),
+            thread_name_prefix="odds",
+        )
+        try:
+            futures = {
+                executor.submit(self._get_odds, year, race): race for race in races
+            }
+            deadline = time.monotonic() + self._timeout
+            pending = set(futures)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = wait(
+                    pending, timeout=remaining, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    error = future.exception()
+                    odds = None if error is not None else future.result()
+                    yield OddsResult(futures[future], odds, error)
+
+            # 時間内に取得できなかったレース
+            for future in pending:
+                future.cancel()
+                yield OddsResult(
+                    futures[future],
+                    None,
+                    TimeoutError("オッズ取得がタイムアウトしました"),
+                )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,248 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome import service as fs
+from webdriver_manager.chrome import ChromeDriverManager
+
+from src.tracing import span
+
+_driver_path: Optional[str] = None
+_driver_path_lock = threading.Lock()
+
+
+def get_chrome_driver_path() -> str:
+    """ChromeDriverのバイナリパスを返す
+
+    ChromeDriverManager().install() は初回のみ実行し、以降はプロセス内でキャッシュしたパスを返す。
+
+    Returns:
+        str: ChromeDriverのパス
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None or not os.path.exists(_driver_path):
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
+
+def create_chrome_driver(page_load_timeout: float = 30.0) -> webdriver.Chrome:
+    """ヘッドレスChromeを起動する
+
+    Args:
+        page_load_timeout (float, optional): ページ読み込みのタイムアウト秒数. Defaults to 30.0.
+
+    Returns:
+        webdriver.Chrome: 起動したドライバー
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")  # or use pyvirtualdiplay
+    options.add_argument("--no-sandbox")  # needed, because colab runs as root
+    options.add_argument("enable-automation")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--disable-extensions")
+    options.add_argument('--proxy-server="direct://"')
+    options.add_argument("--proxy-bypass-list=*")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_argument("--lang=ja")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--dns-prefetch-disable")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--log-level=3")
+    options.add_argument(
+        "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36"
+    )
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option("useAutomationExtension", False)
+
+    # ドライバー指定でChromeブラウザを開く
+    chrome_service = fs.Service(get_chrome_driver_path())
+
+    driver = webdriver.Chrome(service=chrome_service, options=options)
+    driver.set_page_load_timeout(page_load_timeout)
+
+    return driver
+
+
+class _PooledDriver:
+    """プール内のドライバーと利用状況"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.created_at = time.monotonic()
+        self.uses = 0
+
+
+class ChromeDriverPool:
+    """起動済みのChromeドライバーを使い回すプール
+
+    ポーリングをまたいで一定数のドライバーを保持し、貸し出し・返却を行う。
+    クラッシュしたドライバーや長時間・多数回使われたドライバーは破棄して作り直す。
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_age: float = 1800.0,
+        max_uses: int = 200,
+        checkout_timeout: float = 60.0,
+        driver_factory: Optional[Callable[[], object]] = None,
+    ):
+        """コンストラクタ
+
+        Args:
+            size (int, optional): 保持するドライバー数. Defaults to 2.
+            max_age (float, optional): ドライバーを作り直すまでの秒数. Defaults to 1800.0.
+            max_uses (int, optional): ドライバーを作り直すまでの貸し出し回数. Defaults to 200.
+            checkout_timeout (float, optional): 貸し出し待ちの最大秒数. Defaults to 60.0.
+            driver_factory (Callable, optional): ドライバーの生成関数. Defaults to create_chrome_driver.
+        """
+        if size < 1:
+            raise ValueError(f"size は1以上である必要があります: {size}")
+
+        self._size = size
+        self._max_age = max_age
+        self._max_uses = max_uses
+        self._checkout_timeout = checkout_timeout
+        self._driver_factory = driver_factory or create_chrome_driver
+
+        self._idle: "queue.LifoQueue[_PooledDriver]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._num_drivers = 0
+        self._closed = False
+
+    def warm_up(self):
+        """上限数までドライバーを起動しておく"""
+        while True:
+            with self._lock:
+                if self._closed or self._num_drivers >= self._size:
+                    break
+                self._num_drivers += 1
+            self._idle.put(self._create_entry())
+
+    def checkout(self, timeout: Optional[float] = None) -> _PooledDriver:
+        """ドライバーを借りる
+
+        Args:
+            timeout (float, optional): 空きを待つ最大秒数. Defaults to checkout_timeout.
+
+        Returns:
+            _PooledDriver: 貸し出したドライバー
+        """
+        if timeout is None:
+            timeout = self._checkout_timeout
+
+        while True:
+            if self._closed:
+                raise RuntimeError("ドライバープールは終了しています")
+
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                entry = None
+
+            if entry is None:
+                with self._lock:
+                    can_create = self._num_drivers < self._size
+                    if can_create:
+                        self._num_drivers += 1
+                if can_create:
+                    entry = self._create_entry()
+                else:
+                    try:
+                        entry = self._idle.get(timeout=timeout)
+                    except queue.Empty:
+                        raise TimeoutError("空きドライバーがありません")
+
+            if self._is_healthy(entry):
+                entry.uses += 1
+                return entry
+
+            # 不調なドライバーは破棄して次を探す
+            self._discard(entry)
+
+    def checkin(self, entry: _PooledDriver, healthy: bool = True):
+        """ドライバーを返す
+
+        Args:
+            entry (_PooledDriver): 借りていたドライバー
+            healthy (bool, optional): Falseなら破棄する. Defaults to True.
+        """
+        if self._closed or not healthy:
+            self._discard(entry)
+        else:
+            self._idle.put(entry)
+
+    @contextmanager
+    def driver(self, timeout: Optional[float] = None) -> Iterator[object]:
+        """with文でドライバーを借りて返す
+
+        ブロック内でWebDriverExceptionが発生した場合、そのドライバーは破棄する。
+        """
+        entry = self.checkout(timeout)
+        healthy = True
+        try:
+            yield entry.driver
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            self.checkin(entry, healthy)
+
+    def close(self):
+        """待機中のドライバーをすべて終了する。貸し出し中のものは返却時に終了する。"""
+        self._closed = True
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(entry)
+
+    def _create_entry(self) -> _PooledDriver:
+        try:
+            with span("browser_start"):
+                return _PooledDriver(self._driver_factory())
+        except Exception:
+            with self._lock:
+                self._num_drivers -= 1
+            raise
+
+    def _is_healthy(self, entry: _PooledDriver) -> bool:
+        if time.monotonic() - entry.created_at > self._max_age:
+            return False
+        if entry.uses >= self._max_uses:
+            return False
+        try:
+            # ブラウザが応答するか確認
+            entry.driver.current_url
+        except Exception:
+            return False
+        return True
+
+    def _discard(self, entry: _PooledDriver):
+        with self._lock:
+            self._num_drivers -= 1
+        try:
+            entry.driver.quit()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def num_drivers(self):
+        return self._num_drivers
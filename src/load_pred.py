@@ -1,9 +1,37 @@
 import json
+from typing import Optional
+
+from src.pred_archive import PredArchive, is_pred_archive
+from src.pred_index import load_day
+from src.pred_store import PredStore
 
 
 class PredLoader:
-    def __init__(self, pred_json_path):
-        self._data = self._load_pred_json(pred_json_path)
+    def __init__(
+        self,
+        pred_json_path,
+        year: Optional[str] = None,
+        month_day: Optional[str] = None,
+    ):
+        """コンストラクタ
+
+        Args:
+            pred_json_path (str): 予測JSONのパス. 列形式の予測アーカイブのディレクトリも指定できる
+            year (str, optional): 指定すると month_day の日の予測だけを読み込む. Defaults to None.
+            month_day (str, optional): 月日 ("mmdd"). Defaults to None.
+        """
+        if is_pred_archive(pred_json_path):
+            self._archive = PredArchive(pred_json_path)
+        else:
+            self._archive = None
+
+        if year is not None and month_day is not None:
+            self._data = self._load_pred_day(pred_json_path, year, month_day)
+        elif self._archive is not None:
+            self._data = self._archive.to_json()
+        else:
+            self._data = self._load_pred_json(pred_json_path)
+        self._store = None
 
     def _load_pred_json(self, pred_json_path):
         try:
@@ -15,6 +43,28 @@ class PredLoader:
         except json.JSONDecodeError:
             raise json.JSONDecodeError(f"ファイルが見つかりません: {pred_json_path}")
 
+    def _load_pred_day(self, pred_json_path, year: str, month_day: str):
+        if self._archive is not None:
+            return {year: {month_day: self._archive.races_on(year, month_day)}}
+
+        # ファイル横の索引から該当日の部分だけを読み込む
+        try:
+            return {year: {month_day: load_day(pred_json_path, year, month_day)}}
+        except FileNotFoundError:
+            raise FileNotFoundError(f"ファイルが見つかりません: {pred_json_path}")
+
     @property
     def data(self):
         return self._data
+
+    @property
+    def archive(self) -> Optional[PredArchive]:
+        """列形式の予測アーカイブを読み込んだ場合はそのアーカイブ"""
+        return self._archive
+
+    @property
+    def store(self) -> PredStore:
+        # 発走時刻の索引は最初に使う時に1回だけ作る
+        if self._store is None:
+            self._store = PredStore(self._data)
+        return self._store
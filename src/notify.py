@@ -1,36 +1,409 @@
+import email.utils
+import logging
+import queue
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+
+from src.tracing import count, span
+
+logger = logging.getLogger(__name__)
+
+
+def format_bet_message(title: str, bet: pd.Series) -> str:
+    """レース名と馬券ごとの掛け金から通知するメッセージを作る"""
+    bet_umaban = bet.index.values
+    bet_money = bet.values
+
+    race = "\n{}".format(title)
+    bet = ""
+    for umaban, money in zip(bet_umaban, bet_money):
+        bet += "\n{} {}円".format(umaban, money)
+
+    return "{}{}".format(race, bet)
 
 
 class Notifier:
+    """LINE Notifyへ1件ずつ送り, 送り終えるまで待つ. NotifyDispatcher の同期版"""
+
+    def __init__(self, access_token_path: str, **kwargs):
+        """コンストラクタ
+
+        Args:
+            access_token_path (str): アクセストークンのファイルのパス
+            **kwargs: LineNotifyDestination に渡す引数 (url など)
+        """
+        self._dispatcher = NotifyDispatcher(
+            [LineNotifyDestination.from_token_file(access_token_path, **kwargs)],
+            coalesce_window=0.0,
+        )
+        self._message: Optional[str] = None
+
+    def notify(self, title: str, bet: pd.Series):
+        self._message = format_bet_message(title, bet)
+        self._dispatcher.notify_message(self._message)
+        self._dispatcher.flush()
+
+    def close(self):
+        self._dispatcher.close()
+
+    @property
+    def message(self) -> Optional[str]:
+        """最後に送ったメッセージ"""
+        return self._message
+
+
+def parse_retry_after(response: requests.Response, now: float) -> Optional[float]:
+    """Retry-Afterヘッダ (秒数またはHTTP日付) から待つ秒数を返す"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - now, 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class NotifyDestination(metaclass=ABCMeta):
+    """通知先. 送信するHTTPリクエストと, レスポンスから次に送れるまでの待ち時間を決める"""
+
+    # 1通のメッセージの最大文字数
+    max_message_length = 1000
+
+    @abstractmethod
+    def build_request(self, message: str) -> Dict[str, Any]:
+        """requests.Session.request に渡す引数 (method, url, headers など)"""
+        return NotImplementedError()
+
+    def retry_after(self, response: requests.Response, now: float) -> Optional[float]:
+        """次に送れるまでの秒数. 制限されていなければNone"""
+        return parse_retry_after(response, now)
+
+
+class LineNotifyDestination(NotifyDestination):
+    """LINE Notify"""
+
     def __init__(
-        self,
-        access_token_path: str,
+        self, access_token: str, url: str = "https://notify-api.line.me/api/notify"
     ):
+        self._access_token = access_token.strip()
+        self._url = url
+
+    @classmethod
+    def from_token_file(
+        cls, access_token_path: str, **kwargs
+    ) -> "LineNotifyDestination":
         with open(access_token_path, "r") as f:
-            self._access_token = f.read()
+            return cls(f.read(), **kwargs)
+
+    def build_request(self, message: str) -> Dict[str, Any]:
+        return {
+            "method": "POST",
+            "url": self._url,
+            "headers": {"Authorization": "Bearer " + self._access_token},
+            "params": {"message": message},
+        }
+
+    def retry_after(self, response: requests.Response, now: float) -> Optional[float]:
+        retry_after = parse_retry_after(response, now)
+        if retry_after is not None:
+            return retry_after
+
+        # 1時間あたりの送信数を使い切った場合はリセット時刻 (UNIX時間) まで待つ
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                reset = float(response.headers["X-RateLimit-Reset"])
+            except (KeyError, ValueError):
+                return None
+            return max(reset - now, 0.0)
+        return None
+
+
+class _Message(NamedTuple):
+    text: str
+    created_at: float
+    # この時刻 (UNIX時間) を過ぎたら送らない. レースの発走時刻など
+    expires_at: Optional[float]
+    # 最初の通知先へ送れたときに呼ぶ関数. まとめた通知の分も含む
+    on_sent: Tuple[Callable[[], None], ...] = ()
 
-    def notify(self, title: str, bet: pd.Series):
-        url = "https://notify-api.line.me/api/notify"
-        headers = {"Authorization": "Bearer " + self._access_token}
 
-        bet_umaban = bet.index.values
-        bet_money = bet.values
+_STOP = object()
 
-        race = "\n{}".format(title)
-        bet = ""
-        for umaban, money in zip(bet_umaban, bet_money):
-            bet += "\n{} {}円".format(umaban, money)
 
-        message = "{}{}".format(race, bet)
+class NotifyDispatcher:
+    """通知をバックグラウンドで送る
 
-        payload = {"message": message}
-        r = requests.post(
-            url,
-            headers=headers,
-            params=payload,
+    notify() はキューに積むだけですぐに戻る. 送信用のスレッドは coalesce_window 秒以内に
+    積まれた通知を1通にまとめ, 接続をプールしたSessionで各通知先へ送る.
+    失敗した場合は指数的に待ち時間を延ばして再送し, Retry-After やレート制限のヘッダがあれば
+    その時刻まで待つ. 待つと期限を過ぎる通知は待たずに捨てるので, 後の通知を待たせない.
+    期限の違う通知は1通にまとめない.
+    """
+
+    def __init__(
+        self,
+        destinations: List[NotifyDestination],
+        timeout: float = 5.0,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        coalesce_window: float = 1.0,
+        pool_maxsize: int = 4,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """コンストラクタ
+
+        Args:
+            destinations (List[NotifyDestination]): 通知先
+            timeout (float, optional): リクエストごとのタイムアウト秒数. Defaults to 5.0.
+            max_retries (int, optional): 再送の最大回数. Defaults to 5.
+            backoff (float, optional): 最初の再送までの秒数. 再送ごとに2倍にする. Defaults to 1.0.
+            max_backoff (float, optional): 指数的に延ばす再送までの秒数の上限. Retry-After や
+                レート制限のリセット時刻には適用しない. Defaults to 60.0.
+            coalesce_window (float, optional): 1通にまとめる通知の間隔の秒数. Defaults to 1.0.
+            pool_maxsize (int, optional): ホストごとに保持する接続数. Defaults to 4.
+            clock (Callable[[], float], optional): 現在のUNIX時間を返す関数. Defaults to time.time.
+            sleep (Callable[[float], None], optional): 指定秒数待つ関数. Defaults to time.sleep.
+        """
+        self._destinations = destinations
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._coalesce_window = coalesce_window
+        self._clock = clock
+        self._sleep = sleep
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=len(destinations), pool_maxsize=pool_maxsize
         )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        # 通知先ごとの次に送れるUNIX時間
+        self._not_before = [0.0] * len(destinations)
+        self._stats = {
+            "messages": 0,
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "expired": 0,
+        }
+        self._stats_lock = threading.Lock()
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def notify(
+        self,
+        title: str,
+        bet: pd.Series,
+        expires_at: Optional[float] = None,
+        on_sent: Optional[Callable[[], None]] = None,
+    ):
+        """レースの購入馬券の通知をキューに積む
+
+        Args:
+            title (str): レース名
+            bet (pd.Series): 馬券ごとの掛け金
+            expires_at (float, optional): この時刻 (UNIX時間) までに送れなければ捨てる.
+                レースの発走時刻を渡す. Defaults to None.
+            on_sent (Callable[[], None], optional): 通知を送れたときに送信用のスレッドで呼ぶ関数.
+                通知先が複数あっても1回だけ呼ぶ. Defaults to None.
+        """
+        self.notify_message(format_bet_message(title, bet), expires_at, on_sent)
+
+    def notify_message(
+        self,
+        message: str,
+        expires_at: Optional[float] = None,
+        on_sent: Optional[Callable[[], None]] = None,
+    ):
+        if self._closed:
+            raise RuntimeError("NotifyDispatcherは終了しています")
+        callbacks = (on_sent,) if on_sent is not None else ()
+        self._queue.put(_Message(message, time.monotonic(), expires_at, callbacks))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """キューに積んだ通知を送り終えるまで待つ
+
+        Args:
+            timeout (float, optional): 待つ最大秒数. Defaults to 送り終えるまで.
+
+        Returns:
+            bool: 送り終えたか. timeout 秒を過ぎた場合はFalse
+        """
+        with self._queue.all_tasks_done:
+            return self._queue.all_tasks_done.wait_for(
+                lambda: self._queue.unfinished_tasks == 0, timeout
+            )
+
+    def close(self):
+        """残りの通知を送ってから終了する"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            # 最初の通知から coalesce_window 秒以内に積まれた通知をまとめる
+            batch = [item]
+            deadline = item.created_at + self._coalesce_window
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            try:
+                self._send_batch(batch)
+            except Exception:
+                logger.exception("通知の送信中にエラーが発生しました")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+                if stop:
+                    self._queue.task_done()
+
+    def _send_batch(self, messages: List[_Message]):
+        called = set()
+        for i, destination in enumerate(self._destinations):
+            for message in self._pack(messages, destination.max_message_length):
+                if not self._send(i, destination, message):
+                    continue
+                for on_sent in message.on_sent:
+                    if on_sent in called:
+                        continue
+                    called.add(on_sent)
+                    try:
+                        on_sent()
+                    except Exception:
+                        logger.exception("通知の送信後の処理に失敗しました")
+
+    @staticmethod
+    def _pack(messages: List[_Message], max_length: int) -> List[_Message]:
+        """最大文字数を超えないように, 期限が同じメッセージを連結する
+
+        期限の違う通知をまとめると, 期限を過ぎた通知と一緒にまだ送れる通知も捨てることになる.
+        """
+        packed: List[_Message] = []
+        # 期限ごとの連結中のメッセージの位置
+        last: Dict[Optional[float], int] = {}
+        for message in messages:
+            i = last.get(message.expires_at)
+            if i is not None and len(packed[i].text) + len(message.text) <= max_length:
+                packed[i] = _Message(
+                    packed[i].text + message.text,
+                    packed[i].created_at,
+                    message.expires_at,
+                    packed[i].on_sent + message.on_sent,
+                )
+            else:
+                last[message.expires_at] = len(packed)
+                packed.append(message)
+        return packed
+
+    def _send(
+        self, index: int, destination: NotifyDestination, message: _Message
+    ) -> bool:
+        with span("notify_send", destination=type(destination).__name__) as fields:
+            fields["sent"] = self._send_with_retry(index, destination, message)
+            return fields["sent"]
+
+    def _send_with_retry(
+        self, index: int, destination: NotifyDestination, message: _Message
+    ) -> bool:
+        self._count("messages")
+        for attempt in range(self._max_retries + 1):
+            # レート制限中に送っても429で再送を使い切るだけなので, 解除まで待つ
+            wait = self._not_before[index] - self._clock()
+            if (
+                message.expires_at is not None
+                and self._clock() + max(wait, 0.0) >= message.expires_at
+            ):
+                # 発走後に届く通知は使えないので, 後の通知を待たせずに捨てる
+                logger.warning("期限までに送れないため通知を捨てます: %s", message.text)
+                self._count("expired")
+                return False
+            if wait > 0:
+                self._sleep(wait)
+
+            delay = min(self._backoff * 2**attempt, self._max_backoff)
+            try:
+                response = self._session.request(
+                    timeout=self._timeout, **destination.build_request(message.text)
+                )
+            except requests.RequestException as e:
+                logger.warning("通知の送信に失敗しました: %s", e)
+            else:
+                retry_after = destination.retry_after(response, self._clock())
+                if retry_after is not None:
+                    self._not_before[index] = self._clock() + retry_after
+                if response.ok:
+                    self._count("sent")
+                    return True
+                if response.status_code != 429 and response.status_code < 500:
+                    logger.error(
+                        "通知を送信できませんでした: %d %s",
+                        response.status_code,
+                        response.text,
+                    )
+                    break
+                logger.warning("通知の送信に失敗しました: %d", response.status_code)
+                if retry_after is not None:
+                    # 待ち時間は次の送信前に _not_before で待つ
+                    delay = 0.0
+
+            if attempt < self._max_retries:
+                self._count("retries")
+                if delay > 0:
+                    self._sleep(delay)
+
+        self._count("failed")
+        return False
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self._stats[name] += 1
+        count(f"notify_{name}")
 
     @property
-    def message(self):
-        return self._message
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self._stats)
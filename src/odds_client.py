@@ -0,0 +1,103 @@
+import re
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_META_CHARSET = re.compile(rb"<meta[^>]+charset=[\"']?([A-Za-z0-9_\-]+)", re.IGNORECASE)
+
+
+class HttpOddsFetcher:
+    """ブラウザを使わず、HTTPでnetkeibaのオッズを取得する
+
+    接続はSessionでプールし、keep-aliveとgzipで使い回す。
+    """
+
+    _USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36"
+
+    def __init__(
+        self,
+        page_url: str = "https://race.netkeiba.com/odds/index.html?type=b1&",
+        api_url: str = "https://race.netkeiba.com/api/api_get_jra_odds.html?",
+        timeout: float = 5.0,
+        pool_maxsize: int = 10,
+    ):
+        """コンストラクタ
+
+        Args:
+            page_url (str, optional): オッズページのURL. race_id を付けてアクセスする
+            api_url (str, optional): オッズページが内部で呼ぶオッズAPIのURL
+            timeout (float, optional): リクエストごとのタイムアウト秒数. Defaults to 5.0.
+            pool_maxsize (int, optional): ホストごとに保持する接続数. Defaults to 10.
+        """
+        self._page_url = page_url
+        self._api_url = api_url
+        self._timeout = timeout
+        self._session = self._build_session(pool_maxsize)
+
+    def _build_session(self, pool_maxsize: int) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(
+            {
+                "User-Agent": self._USER_AGENT,
+                "Accept-Encoding": "gzip, deflate",
+                "Accept-Language": "ja",
+                "Connection": "keep-alive",
+            }
+        )
+        return session
+
+    def fetch_odds_api(self, race_id: str, odds_type: int = 1) -> Dict[str, Any]:
+        """オッズAPIのJSONを取得する
+
+        Args:
+            race_id (str): レースID
+            odds_type (int, optional): 券種. 1は単勝. Defaults to 1.
+
+        Returns:
+            Dict[str, Any]: APIのレスポンス
+        """
+        url = "{}race_id={}&type={}&action=update".format(
+            self._api_url, race_id, odds_type
+        )
+        response = self._session.get(url, timeout=self._timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch_odds_page(self, race_id: str) -> str:
+        """オッズページのHTMLを取得する
+
+        Args:
+            race_id (str): レースID
+
+        Returns:
+            str: デコード済みのHTML
+        """
+        url = "{}race_id={}".format(self._page_url, race_id)
+        response = self._session.get(url, timeout=self._timeout)
+        response.raise_for_status()
+        return self._decode(response)
+
+    def _decode(self, response: requests.Response) -> str:
+        # netkeibaはEUC-JP. ヘッダに無ければmetaタグから文字コードを決める
+        encoding = None
+        if "charset" in response.headers.get("Content-Type", "").lower():
+            encoding = response.encoding
+        else:
+            match = _META_CHARSET.search(response.content[:2048])
+            if match:
+                encoding = match.group(1).decode("ascii")
+        try:
+            return response.content.decode(encoding or "utf-8", errors="replace")
+        except LookupError:
+            return response.content.decode("utf-8", errors="replace")
+
+    def close(self):
+        self._session.close()
+
+    @property
+    def session(self):
+        return self._session
@@ -0,0 +1,268 @@
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser as SelectolaxParser
+    except ImportError:
+        SelectolaxParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+_ODDS_BLOCK_ID = "odds_fuku_block"
+_ODDS_SPAN_PREFIX = "odds-1_"
+
+# 馬券種ごとのオッズAPIの type と馬券に含む頭数
+API_ODDS_TYPES = {
+    "tansyo": 1,
+    "umaren": 4,
+    "wide": 5,
+    "umatan": 6,
+    "sanrentan": 8,
+}
+_TICKET_SIZES = {"tansyo": 1, "umaren": 2, "wide": 2, "umatan": 2, "sanrentan": 3}
+# 順番を区別しない馬券種. オッズ配列の対称な位置にも同じオッズを入れる
+_UNORDERED = {"umaren", "wide"}
+
+
+def available_backends() -> List[str]:
+    """利用できるHTMLパーサーを速い順に返す"""
+    backends = []
+    if SelectolaxParser is not None:
+        backends.append("selectolax")
+    if lxml is not None:
+        backends.append("lxml")
+    backends.append("html.parser")
+    return backends
+
+
+def _to_odds(text: Optional[str]) -> Optional[float]:
+    """オッズの文字列を数値にする. 発売前の "---.-" や取消などはNoneを返す"""
+    if text is None:
+        return None
+    try:
+        odds = float(text.strip().replace(",", ""))
+    except ValueError:
+        return None
+    # 取消・除外馬は0.0になる
+    return odds if odds > 0 else None
+
+
+def _build_series(umaban_list: List[str], odds_text: Dict[str, str]) -> pd.Series:
+    odds_dict = {}
+    for umaban in umaban_list:
+        odds = _to_odds(odds_text.get(umaban.zfill(2)))
+        if odds is not None:
+            odds_dict[umaban] = odds
+    return pd.Series(odds_dict, dtype="float64")
+
+
+class _TansyoOddsHTMLParser(HTMLParser):
+    """馬番と単勝オッズを1回の走査で集める"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.found_block = False
+        self.umaban_list: List[str] = []
+        self.odds_text: Dict[str, str] = {}
+        self._block_tag: Optional[str] = None
+        self._block_depth = 0
+        self._in_umaban = False
+        self._odds_key: Optional[str] = None
+        self._text: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        attrs = dict(attrs)
+        if self._block_depth:
+            if tag == self._block_tag:
+                self._block_depth += 1
+            if tag == "td" and attrs.get("class") == "W31":
+                self._in_umaban = True
+                self._text = []
+        elif attrs.get("id") == _ODDS_BLOCK_ID:
+            self.found_block = True
+            self._block_tag = tag
+            self._block_depth = 1
+
+        if tag == "span":
+            id_ = attrs.get("id") or ""
+            if id_.startswith(_ODDS_SPAN_PREFIX):
+                self._odds_key = id_[len(_ODDS_SPAN_PREFIX) :]
+                self._text = []
+
+    def handle_endtag(self, tag: str):
+        if tag == "td" and self._in_umaban:
+            self.umaban_list.append("".join(self._text).strip())
+            self._in_umaban = False
+        elif tag == "span" and self._odds_key is not None:
+            self.odds_text[self._odds_key] = "".join(self._text)
+            self._odds_key = None
+
+        if self._block_depth and tag == self._block_tag:
+            self._block_depth -= 1
+
+    def handle_data(self, data: str):
+        if self._in_umaban or self._odds_key is not None:
+            self._text.append(data)
+
+
+def _parse_with_html_parser(html: str) -> Tuple[bool, List[str], Dict[str, str]]:
+    parser = _TansyoOddsHTMLParser()
+    parser.feed(html)
+    parser.close()
+    return parser.found_block, parser.umaban_list, parser.odds_text
+
+
+def _parse_with_selectolax(html: str) -> Tuple[bool, List[str], Dict[str, str]]:
+    tree = SelectolaxParser(html)
+    block = tree.css_first(f"#{_ODDS_BLOCK_ID}")
+    if block is None:
+        return False, [], {}
+
+    umaban_list = [
+        node.text(strip=True)
+        for node in block.css("td")
+        if node.attributes.get("class") == "W31"
+    ]
+    odds_text = {
+        node.attributes["id"][len(_ODDS_SPAN_PREFIX) :]: node.text()
+        for node in tree.css(f'span[id^="{_ODDS_SPAN_PREFIX}"]')
+    }
+    return True, umaban_list, odds_text
+
+
+def _parse_with_lxml(html: str) -> Tuple[bool, List[str], Dict[str, str]]:
+    root = lxml.html.fromstring(html)
+    blocks = root.xpath(f'//*[@id="{_ODDS_BLOCK_ID}"]')
+    if not blocks:
+        return False, [], {}
+
+    umaban_list = [
+        node.text_content().strip() for node in blocks[0].xpath('.//td[@class="W31"]')
+    ]
+    odds_text = {
+        node.get("id")[len(_ODDS_SPAN_PREFIX) :]: node.text_content()
+        for node in root.xpath(f'//span[starts-with(@id, "{_ODDS_SPAN_PREFIX}")]')
+    }
+    return True, umaban_list, odds_text
+
+
+_BACKENDS = {
+    "selectolax": _parse_with_selectolax,
+    "lxml": _parse_with_lxml,
+    "html.parser": _parse_with_html_parser,
+}
+
+
+def parse_tansyo_odds(
+    html: Union[str, bytes], backend: Optional[str] = None
+) -> pd.Series:
+    """オッズページのHTMLから単勝オッズを取り出す
+
+    selectolax, lxmlがインストールされていればそれを使い、無ければ標準ライブラリの
+    html.parserで1回だけ走査する。発売前("---.-")や取消・除外の馬は含めない。
+
+    Args:
+        html (Union[str, bytes]): オッズページのHTML. bytesの場合はUTF-8とみなす
+        backend (str, optional): 使うHTMLパーサー. Defaults to 利用できる最速のもの.
+
+    Returns:
+        pd.Series: 馬番をindexとする単勝オッズ
+    """
+    if isinstance(html, bytes):
+        html = html.decode("utf-8", errors="replace")
+    if backend is None:
+        backend = available_backends()[0]
+    elif backend not in available_backends():
+        raise ValueError(f"利用できないパーサーです: {backend}")
+
+    found_block, umaban_list, odds_text = _BACKENDS[backend](html)
+    if not found_block:
+        raise ValueError("オッズ表が見つかりません")
+
+    return _build_series(umaban_list, odds_text)
+
+
+def parse_tansyo_odds_api(response: Dict[str, Any]) -> pd.Series:
+    """オッズAPIのレスポンスから単勝オッズを取り出す
+
+    Args:
+        response (Dict[str, Any]): オッズAPIのレスポンス
+
+    Returns:
+        pd.Series: 馬番をindexとする単勝オッズ
+    """
+    _check_api_response(response)
+
+    odds_dict = {}
+    for umaban, values in sorted(response["data"]["odds"]["1"].items()):
+        odds = _to_odds(values[0])
+        if odds is not None:
+            odds_dict[str(int(umaban))] = odds
+
+    if not odds_dict:
+        raise ValueError("単勝オッズがありません")
+
+    return pd.Series(odds_dict, dtype="float64")
+
+
+def _check_api_response(response: Dict[str, Any]):
+    if response.get("status") not in ("result", "middle"):
+        raise ValueError(
+            "オッズが発表されていません: {}".format(response.get("status"))
+        )
+
+
+def parse_ticket_odds_api(
+    response: Dict[str, Any], bet_type: str, num_horses: Optional[int] = None
+) -> np.ndarray:
+    """オッズAPIのレスポンスから馬番を添字とする密なオッズの配列を作る
+
+    馬番 i, j, k の馬券のオッズを [i - 1, j - 1, k - 1] に置く. 単勝は (n,), 馬連・ワイド・
+    馬単は (n, n), 三連単は (n, n, n) の配列になる. 馬連・ワイドは [i, j] と [j, i] の
+    両方に入れ, ワイドはオッズの幅の下限を使う. 発売前・取消などのオッズはNaN.
+
+    Args:
+        response (Dict[str, Any]): API_ODDS_TYPES[bet_type] の type で取得したレスポンス
+        bet_type (str): 馬券種
+        num_horses (int, optional): 頭数. Defaults to レスポンスの最大の馬番.
+
+    Returns:
+        np.ndarray: 馬番を添字とするオッズ
+    """
+    if bet_type not in API_ODDS_TYPES:
+        raise ValueError(f"対応していない馬券種です: {bet_type}")
+    _check_api_response(response)
+    table = response["data"]["odds"].get(str(API_ODDS_TYPES[bet_type]))
+    if not table:
+        raise ValueError(f"{bet_type} のオッズがありません")
+
+    size = _TICKET_SIZES[bet_type]
+    # "010203" のような2桁ずつの馬番をまとめて数値にする
+    keys = "".join(table.keys()).encode("ascii")
+    digits = np.frombuffer(keys, dtype=np.uint8).reshape(len(table), size, 2) - 48
+    horses = digits[:, :, 0].astype(np.intp) * 10 + digits[:, :, 1] - 1
+    texts = [values[0] for values in table.values()]
+    try:
+        odds = np.array(texts, dtype=float)
+    except ValueError:
+        # 発売前の "---.-" などを含む場合だけ1件ずつ変換する. Noneは NaN になる
+        odds = np.array([_to_odds(text) for text in texts], dtype=float)
+    # 取消・除外の馬券は0.0になる
+    odds[odds <= 0] = np.nan
+
+    if num_horses is None:
+        num_horses = int(horses.max()) + 1
+    matrix = np.full((num_horses,) * size, np.nan)
+    matrix[tuple(horses.T)] = odds
+    if bet_type in _UNORDERED:
+        matrix[tuple(horses[:, ::-1].T)] = odds
+    return matrix
@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 記録先のディレクトリに置くファイル. 記録中の日は追記専用のジャーナル (day_<日付>.journal) に書き,
+# 日付が変わったら1日分を1つの配列 (day_<日付>.npy) にまとめて索引にレースごとの行の範囲を加える
+_INDEX_FILE = "index.json"
+_DAY_PREFIX = "day_"
+_JOURNAL_SUFFIX = ".journal"
+_RECORD_DTYPE = np.dtype(
+    [
+        ("race_id", "S16"),
+        ("timestamp", np.float64),
+        ("umaban", np.int16),
+        ("odds", np.float32),
+    ]
+)
+_COLUMNS = ("timestamp", "umaban", "odds")
+_VERSION = 2
+
+
+def _day_of(timestamp: float) -> str:
+    """取得時刻 (UNIX時間) の日付 ("yyyymmdd"). ローカル時刻で区切る"""
+    return time.strftime("%Y%m%d", time.localtime(timestamp))
+
+
+def _day_path(path: Union[str, os.PathLike], day: str) -> str:
+    return os.path.join(path, f"{_DAY_PREFIX}{day}.npy")
+
+
+def _journal_path(path: Union[str, os.PathLike], day: str) -> str:
+    return os.path.join(path, f"{_DAY_PREFIX}{day}{_JOURNAL_SUFFIX}")
+
+
+def _journal_days(path: Union[str, os.PathLike]) -> List[str]:
+    """ジャーナルがある日付の昇順"""
+    pattern = re.escape(_DAY_PREFIX) + r"(\d{8})" + re.escape(_JOURNAL_SUFFIX)
+    matches = [re.fullmatch(pattern, name) for name in os.listdir(path)]
+    return sorted(match.group(1) for match in matches if match)
+
+
+def _read_journal(path: str) -> np.ndarray:
+    # 書き込み途中で止まった最後の行は読まない
+    count = os.path.getsize(path) // _RECORD_DTYPE.itemsize
+    return np.fromfile(path, dtype=_RECORD_DTYPE, count=count)
+
+
+def _sort_records(records: np.ndarray) -> np.ndarray:
+    """レースID, 時刻, 馬番の順に並べる. 同じ行が重なった場合は後に書いた方を残す"""
+    if len(records) == 0:
+        return records
+    records = records[
+        np.lexsort((records["umaban"], records["timestamp"], records["race_id"]))
+    ]
+    same = np.ones(len(records) - 1, dtype=bool)
+    for column in ("race_id", "timestamp", "umaban"):
+        same &= records[column][1:] == records[column][:-1]
+    return records[np.r_[~same, True]]
+
+
+def _race_ranges(records: np.ndarray) -> Dict[str, List[int]]:
+    """レースIDの順に並んだ記録のレースごとの行の範囲"""
+    race_ids = records["race_id"]
+    if len(race_ids) == 0:
+        return {}
+    starts = np.flatnonzero(np.r_[True, race_ids[1:] != race_ids[:-1]])
+    stops = np.r_[starts[1:], len(race_ids)]
+    return {
+        race_ids[start].decode(): [int(start), int(stop)]
+        for start, stop in zip(starts, stops)
+    }
+
+
+def _read_index(path: Union[str, os.PathLike]) -> Dict:
+    index_path = os.path.join(path, _INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {"version": _VERSION, "days": {}}
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    if index["version"] != _VERSION:
+        raise ValueError(f"対応していないオッズ記録です: {index['version']}")
+    return index
+
+
+class OddsArchive:
+    """記録したオッズをレースごとに読み出す
+
+    まとめ終えた日の配列はメモリマップで開くので, 読み出したレースの範囲だけを読み込む.
+    記録中の日のジャーナルは reload() の時に読み込む.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        """コンストラクタ
+
+        Args:
+            path (Union[str, os.PathLike]): 記録先のディレクトリ
+        """
+        self._path = path
+        self.reload()
+
+    def reload(self):
+        """索引とジャーナルを読み直して, 後から書き込まれた記録を読めるようにする"""
+        index = _read_index(self._path)
+        # 日付 -> 1日分の記録. まとめ終えた日は最初に使う時に開く
+        self._days: Dict[str, np.ndarray] = {}
+        sources = [(day, day, ranges) for day, ranges in index["days"].items()]
+        for day in _journal_days(self._path):
+            records = _sort_records(_read_journal(_journal_path(self._path, day)))
+            name = f"{day}{_JOURNAL_SUFFIX}"
+            self._days[name] = records
+            sources.append((day, name, _race_ranges(records)))
+
+        # race_id -> [(日付, 開始行, 終了行)]. 日付の順に並べる
+        self._ranges: Dict[str, List[Tuple[str, int, int]]] = {}
+        for _, name, ranges in sorted(sources):
+            for race_id, (start, stop) in ranges.items():
+                self._ranges.setdefault(race_id, []).append((name, start, stop))
+
+    def _day(self, name: str) -> np.ndarray:
+        records = self._days.get(name)
+        if records is None:
+            records = np.load(_day_path(self._path, name), mmap_mode="r")
+            self._days[name] = records
+        return records
+
+    def records(self, race_id: str) -> pd.DataFrame:
+        """レースのオッズを1行1頭の形で返す
+
+        Args:
+            race_id (str): レースID
+
+        Returns:
+            pd.DataFrame: timestamp (UNIX時間), umaban, odds の列. 時刻, 馬番の順
+        """
+        ranges = self._ranges.get(race_id, [])
+        data = {}
+        for column in _COLUMNS:
+            values = [
+                self._day(name)[column][start:stop] for name, start, stop in ranges
+            ]
+            data[column] = (
+                np.concatenate(values)
+                if values
+                else np.zeros(0, dtype=_RECORD_DTYPE[column])
+            )
+        return pd.DataFrame(data)
+
+    def history(self, race_id: str) -> pd.DataFrame:
+        """レースのオッズの推移
+
+        Args:
+            race_id (str): レースID
+
+        Returns:
+            pd.DataFrame: 取得時刻をindex, 馬番を列とする単勝オッズ. 記録が無ければ空
+        """
+        records = self.records(race_id)
+        history = records.pivot_table(
+            index="timestamp", columns="umaban", values="odds", aggfunc="last"
+        )
+        history.index = pd.to_datetime(history.index, unit="s")
+        history.columns = [str(umaban) for umaban in history.columns]
+        return history
+
+    def odds_at(self, race_id: str, timestamp: float) -> pd.Series:
+        """指定時刻の時点で最後に取得したオッズ
+
+        Args:
+            race_id (str): レースID
+            timestamp (float): UNIX時間
+
+        Returns:
+            pd.Series: 馬番をindexとする単勝オッズ. 記録が無ければ空
+        """
+        records = self.records(race_id)
+        records = records[records["timestamp"] <= timestamp]
+        if records.empty:
+            return pd.Series(dtype="float64")
+        last = records[records["timestamp"] == records["timestamp"].iloc[-1]]
+        return pd.Series(
+            last["odds"].to_numpy(dtype=np.float64),
+            index=[str(umaban) for umaban in last["umaban"]],
+        )
+
+    @property
+    def race_ids(self) -> List[str]:
+        return list(self._ranges)
+
+    def __contains__(self, race_id: str) -> bool:
+        return race_id in self._ranges
+
+
+class OddsRecorder:
+    """取得したオッズを追記専用の列形式のファイルに記録する
+
+    record() はバッファに積むだけですぐに戻り, 書き込みはバックグラウンドのスレッドが
+    flush_interval 秒ごと, またはバッファが max_buffer 行を超えた時にまとめて行う.
+    書き込みは取得日ごとのジャーナルへの追記で, 書き込みの回数によらずファイルは1日1つになる.
+    日付が変わったら前日までのジャーナルをレースID・時刻の順に並べた1つの配列にまとめ,
+    索引にその日のレースごとの行の範囲を加える. 索引に持つのはまとめ終えた日の範囲だけで,
+    メモリには索引を持たない. 1つのディレクトリに書き込むのは1プロセスだけとする.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        flush_interval: float = 5.0,
+        max_buffer: int = 10000,
+        clock: Callable[[], float] = time.time,
+    ):
+        """コンストラクタ
+
+        Args:
+            path (Union[str, os.PathLike]): 記録先のディレクトリ
+            flush_interval (float, optional): 書き込みの間隔の秒数. Defaults to 5.0.
+            max_buffer (int, optional): 間隔を待たずに書き込む行数. Defaults to 10000.
+            clock (Callable[[], float], optional): 取得時刻 (UNIX時間) を返す関数. Defaults to time.time.
+        """
+        self._path = path
+        self._flush_interval = flush_interval
+        self._max_buffer = max_buffer
+        self._clock = clock
+        os.makedirs(path, exist_ok=True)
+        _read_index(path)
+        # 前回の実行で日付が変わる前に止まった日のジャーナルをまとめる
+        self._compact_closed_days()
+
+        self._buffer: List[Tuple[str, float, np.ndarray, np.ndarray]] = []
+        self._buffered_rows = 0
+        self._lock = threading.Lock()
+        # 書き込みは同時に1つだけ
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, race_id: str, odds: pd.Series, timestamp: Optional[float] = None):
+        """オッズを記録する
+
+        Args:
+            race_id (str): レースID
+            odds (pd.Series): 馬番をindexとする単勝オッズ
+            timestamp (float, optional): 取得時刻 (UNIX時間). Defaults to 現在時刻.
+        """
+        if self._closed:
+            raise RuntimeError("OddsRecorderは終了しています")
+        if odds.empty:
+            return
+        if timestamp is None:
+            timestamp = self._clock()
+        if len(race_id.encode()) > _RECORD_DTYPE["race_id"].itemsize:
+            raise ValueError(f"レースIDが長すぎます: {race_id}")
+        umaban = np.asarray([int(u) for u in odds.index], dtype=np.int16)
+        values = np.asarray(odds.to_numpy(), dtype=np.float32)
+        with self._lock:
+            self._buffer.append((race_id, timestamp, umaban, values))
+            self._buffered_rows += len(umaban)
+            if self._buffered_rows >= self._max_buffer:
+                self._wakeup.set()
+
+    def flush(self):
+        """バッファの内容を書き込む"""
+        # ジャーナルが記録した順に並ぶように, 取り出しから書き込みまでを1つずつ行う
+        with self._flush_lock:
+            with self._lock:
+                buffer, self._buffer = self._buffer, []
+                self._buffered_rows = 0
+            if buffer:
+                self._append(buffer)
+            self._compact_closed_days()
+
+    def _append(self, buffer: List[Tuple[str, float, np.ndarray, np.ndarray]]):
+        counts = [len(snapshot[2]) for snapshot in buffer]
+        records = np.zeros(sum(counts), dtype=_RECORD_DTYPE)
+        records["race_id"] = np.repeat(
+            [snapshot[0].encode() for snapshot in buffer], counts
+        )
+        records["timestamp"] = np.repeat([snapshot[1] for snapshot in buffer], counts)
+        records["umaban"] = np.concatenate([snapshot[2] for snapshot in buffer])
+        records["odds"] = np.concatenate([snapshot[3] for snapshot in buffer])
+
+        days = np.repeat([_day_of(snapshot[1]) for snapshot in buffer], counts)
+        for day in np.unique(days):
+            with open(_journal_path(self._path, day), "ab") as f:
+                # 書き込み途中で止まった最後の行は切り捨ててから追記する
+                size = f.seek(0, os.SEEK_END)
+                if size % _RECORD_DTYPE.itemsize:
+                    f.truncate(size - size % _RECORD_DTYPE.itemsize)
+                records[days == day].tofile(f)
+
+    def _compact_closed_days(self):
+        """今日より前の日のジャーナルを1日1つの配列にまとめる"""
+        today = _day_of(self._clock())
+        for day in _journal_days(self._path):
+            if day < today:
+                self._compact(day)
+
+    def _compact(self, day: str):
+        journal_path = _journal_path(self._path, day)
+        records = [_read_journal(journal_path)]
+        day_path = _day_path(self._path, day)
+        # まとめた後に届いた記録は前にまとめた分と合わせる
+        if os.path.exists(day_path):
+            records.insert(0, np.load(day_path))
+        records = _sort_records(np.concatenate(records))
+
+        tmp_path = day_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, records)
+        os.replace(tmp_path, day_path)
+
+        index = _read_index(self._path)
+        index["days"][day] = _race_ranges(records)
+        index["days"] = dict(sorted(index["days"].items()))
+        index_path = os.path.join(self._path, _INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+        # 索引を書き終えてから消すので, 途中で止まっても次回にまとめ直す
+        os.remove(journal_path)
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("オッズの記録に失敗しました")
+
+    def close(self):
+        """残りを書き込んで終了する"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def archive(self) -> OddsArchive:
+        """書き込み済みの記録を読むアーカイブ"""
+        return OddsArchive(self._path)
@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.allocation import allocate_bets
+from src.bettor import Bettor, KellyTansyoBettor
+from src.pred_store import PredStore
+from src.race_id import make_race_id
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class _RacePosition(NamedTuple):
+    # 馬番のラベル. 予測確率・オッズの閾値を満たす馬だけ
+    labels: List[str]
+    odds: np.ndarray
+    # 資金に対するケリー基準の配分
+    fraction: np.ndarray
+
+
+class DayPortfolio(Bettor):
+    """1日の資金を当日の全レースに配分する
+
+    レースごとにケリー基準の配分 (KellyTansyoBettor.kelly_fractions) を求め,
+    まだ発走していないレースの配分の合計が残りの資金を超えないように縮める.
+    オッズが届いていないレースには, オッズのあるレースの配分の合計の平均を確保しておく.
+    オッズが届くたびにそのレースの配分だけを計算し直すので, 判断のたびの再計算は
+    レース数 x 頭数 に比例する.
+
+    select_bet で返したレースは発走したものとして掛け金を固定し, 残りの資金から除く.
+    state_dir を指定すると固定した掛け金を日ごとのファイルに保存し, 同じ日の load_day で読み直す.
+    cron やHTTPトリガーでプロセスをまたいでも1日の資金を超えない.
+    """
+
+    def __init__(
+        self,
+        bankroll: int = 10000,
+        kelly_fraction: float = 0.5,
+        pred_threshold: float = 0,
+        odds_threshold: float = 1.0,
+        min_bet: int = 100,
+        state_dir: Optional[str] = None,
+    ):
+        """コンストラクタ
+
+        Args:
+            bankroll (int, optional): 1日の投資資金. Defaults to 10000.
+            kelly_fraction (float, optional): ケリー基準の配分に掛ける割合. Defaults to 0.5.
+            pred_threshold (float, optional): 予測確率閾値. Defaults to 0.
+            odds_threshold (float, optional): オッズ閾値. Defaults to 1.0.
+            min_bet (int, optional): 買う馬券の最低掛け金. Defaults to 100.
+            state_dir (str, optional): 固定した掛け金を保存するディレクトリ. Defaults to None.
+        """
+        if not 0 < kelly_fraction <= 1:
+            raise ValueError(f"kelly_fraction は0より大きく1以下: {kelly_fraction}")
+        self._bankroll = bankroll
+        self._kelly_fraction = kelly_fraction
+        self._pred_threshold = pred_threshold
+        self._odds_threshold = odds_threshold
+        self._min_bet = min_bet
+        self._state_dir = state_dir
+        self._lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, day: Optional[Tuple[str, str]]):
+        self._day = day
+        # race_id -> 予測確率. 発走時刻の順
+        self._preds: Dict[str, pd.Series] = {}
+        self._positions: Dict[str, _RacePosition] = {}
+        # 発走して固定したレースの掛け金
+        self._fixed: Dict[str, pd.Series] = {}
+
+    @property
+    def solution_cache(self) -> None:
+        return None
+
+    @property
+    def bankroll(self) -> int:
+        return self._bankroll
+
+    @property
+    def remaining(self) -> int:
+        """固定した掛け金を除いた残りの資金"""
+        with self._lock:
+            return self._remaining()
+
+    def _remaining(self) -> int:
+        committed = sum(int(bet.sum()) for bet in self._fixed.values())
+        return self._bankroll - committed
+
+    def load_day(self, store: PredStore, year: str, month_day: str):
+        """当日のレースの予測を読み込む
+
+        日付が変わった場合は前日の配分を捨て, state_dir にその日の固定した掛け金があれば読み込む.
+        同じ日の読み直しでは, 届いたオッズと固定した掛け金を残したまま追加のレースを加える.
+
+        Args:
+            store (PredStore): 予測JSON
+            year (str): 年 (下2桁)
+            month_day (str): 月日 ("mmdd")
+        """
+        with self._lock:
+            if self._day != (year, month_day):
+                self._reset((year, month_day))
+                self._fixed = self._load_fixed()
+            for _, race in store.races_on(year, month_day):
+                race_id = make_race_id(
+                    year, race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+                )
+                self._preds[race_id] = pd.Series(race["pred"], dtype=float)
+
+    def update_odds(
+        self, race_id: str, odds: pd.Series, pred: Optional[pd.Series] = None
+    ):
+        """レースのオッズを更新してそのレースの配分だけを計算し直す
+
+        Args:
+            race_id (str): レースID
+            odds (pd.Series): 馬番をindexとする単勝オッズ
+            pred (pd.Series, optional): 予測確率. load_day で読み込んでいないレースの場合に使う. Defaults to None.
+        """
+        with self._lock:
+            if race_id in self._fixed:
+                logger.warning("発走済みのレースのオッズは使いません: %s", race_id)
+                return
+            if race_id not in self._preds:
+                if pred is None:
+                    raise KeyError(f"予測が読み込まれていないレースです: {race_id}")
+                self._preds[race_id] = pred.astype(float)
+            pred = self._preds[race_id]
+            pred_values = pred.to_numpy(dtype=float)
+            race_odds = odds.reindex(pred.index).to_numpy(dtype=float)
+            # オッズが無い馬 (取消など) は買わない
+            selected = (
+                (pred_values >= self._pred_threshold)
+                & (race_odds >= self._odds_threshold)
+                & ~np.isnan(race_odds)
+            )
+            fraction = KellyTansyoBettor.kelly_fractions(
+                pred_values, race_odds, selected
+            )
+            self._positions[race_id] = _RacePosition(
+                [f"{umaban}" for umaban in pred.index[selected]],
+                race_odds[selected],
+                fraction[selected],
+            )
+
+    def _solve(self) -> Dict[str, pd.Series]:
+        pending = [race_id for race_id in self._preds if race_id not in self._fixed]
+        priced = [race_id for race_id in pending if race_id in self._positions]
+        remaining = self._remaining()
+        if not priced or remaining < self._min_bet:
+            return {
+                race_id: pd.Series(0, index=self._positions[race_id].labels, dtype=int)
+                for race_id in priced
+            }
+
+        exposures = np.array(
+            [self._positions[race_id].fraction.sum() for race_id in priced]
+        )
+        # オッズが届いていないレースの分は, 届いたレースの平均と同じだけ確保する
+        total_exposure = exposures.sum() + exposures.mean() * (
+            len(pending) - len(priced)
+        )
+        scale = self._kelly_fraction
+        if total_exposure * scale > 1:
+            scale = 1 / total_exposure
+
+        fraction = np.concatenate(
+            [self._positions[race_id].fraction for race_id in priced]
+        )
+        odds = np.concatenate([self._positions[race_id].odds for race_id in priced])
+        # 当日の全馬券をまとめて100円単位にし, 合計が残りの資金を超えないようにする
+        bets = allocate_bets(
+            fraction * scale,
+            odds,
+            remaining,
+            exceed_profit_rate=0,
+            min_bet=self._min_bet,
+        )
+
+        stakes = {}
+        start = 0
+        for race_id in priced:
+            labels = self._positions[race_id].labels
+            stakes[race_id] = pd.Series(
+                bets[start : start + len(labels)], index=labels, name="bet"
+            ).astype(int)
+            start += len(labels)
+        return stakes
+
+    def stakes(self) -> Dict[str, pd.Series]:
+        """オッズが届いている未発走のレースの現時点の掛け金
+
+        Returns:
+            Dict[str, pd.Series]: レースIDごとの, 馬番をindexとする掛け金
+        """
+        with self._lock:
+            with span("portfolio", races=len(self._positions)):
+                return self._solve()
+
+    def fix(self, race_id: str, bet: pd.Series):
+        """発走したレースの掛け金を固定する"""
+        with self._lock:
+            self._fixed[race_id] = bet.drop("not_bet", errors="ignore")
+            self._save_fixed()
+
+    def _state_path(self) -> Optional[str]:
+        if self._state_dir is None or self._day is None:
+            return None
+        year, month_day = self._day
+        return os.path.join(self._state_dir, f"fixed_{year}{month_day}.json")
+
+    def _load_fixed(self) -> Dict[str, pd.Series]:
+        path = self._state_path()
+        if path is None:
+            return {}
+        try:
+            with open(path, "r") as f:
+                fixed = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.warning("固定した掛け金を読み込めませんでした: %s", path)
+            return {}
+        return {
+            race_id: pd.Series(bet, dtype=int, name="bet")
+            for race_id, bet in fixed.items()
+        }
+
+    def _save_fixed(self):
+        # self._lock を持って呼ぶ
+        path = self._state_path()
+        if path is None:
+            return
+        os.makedirs(self._state_dir, exist_ok=True)
+        fixed = {
+            race_id: {str(label): int(amount) for label, amount in bet.items()}
+            for race_id, bet in self._fixed.items()
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(fixed, f)
+        os.replace(tmp_path, path)
+
+    def select_bet(
+        self, pred: pd.Series, odds: pd.Series, race_id: Optional[str] = None
+    ) -> pd.Series:
+        """最新のオッズで当日の配分を解き直し, レースの掛け金を固定して返す
+
+        Args:
+            pred (pd.Series): 馬番をindexとする単勝予測確率
+            odds (pd.Series): 馬番をindexとする単勝オッズ
+            race_id (str, optional): レースID. Defaults to None.
+
+        Returns:
+            pd.Series: 馬券ごとの掛け金. 他の Bettor と同じく "not_bet" を含み, 常に0
+        """
+        if race_id is None:
+            raise ValueError("DayPortfolio にはレースIDが必要です")
+        self.update_odds(race_id, odds, pred)
+        with self._lock:
+            bet = self._fixed.get(race_id)
+            if bet is None:
+                with span("portfolio", race_id=race_id, races=len(self._positions)):
+                    bet = self._solve()[race_id]
+                self._fixed[race_id] = bet
+                self._save_fixed()
+        return pd.concat([bet, pd.Series([0], index=["not_bet"])]).rename("bet")
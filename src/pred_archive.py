@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from src.pred_store import to_minutes
+
+# アーカイブのディレクトリに置くファイル
+_RACES_FILE = "races.npy"
+_DAYS_FILE = "days.npy"
+_UMABAN_FILE = "umaban.npy"
+_PRED_FILE = "pred.npy"
+_META_MASK_FILE = "meta_mask.npy"
+_MARKER_FILE = "pred_archive.json"
+_VERSION = 2
+
+# レース表の固定列. これ以外の列はレースのメタデータ (JyoCD, RaceNum など) をそのまま持つ
+_KEY_COLUMNS = ("year", "month_day", "race_time")
+_INDEX_COLUMNS = (("minutes", np.int16), ("offset", np.int64), ("count", np.int16))
+# 数値と真偽値のメタデータの列の型. 文字列とJSONの列は固定長の文字列にする
+_META_DTYPES = {"bool": np.bool_, "int": np.int64, "float": np.float64}
+
+
+def is_pred_archive(path: Union[str, os.PathLike]) -> bool:
+    return os.path.isfile(os.path.join(path, _MARKER_FILE))
+
+
+def _text_dtype(values: List[str]) -> str:
+    return "U{}".format(max([len(value) for value in values] + [1]))
+
+
+def _meta_type(values: List[Any]) -> str:
+    """メタデータの列の型. 値の型がそろわない列はJSON文字列として保存する"""
+    types = {type(value) for value in values}
+    if len(types) != 1:
+        return "json" if types else "str"
+    (value_type,) = types
+    if value_type is int and not all(
+        np.iinfo(np.int64).min <= value <= np.iinfo(np.int64).max for value in values
+    ):
+        return "json"
+    return {bool: "bool", int: "int", float: "float", str: "str"}.get(
+        value_type, "json"
+    )
+
+
+def _meta_column(values: List[Any], meta_type: str) -> np.ndarray:
+    if meta_type == "json":
+        values = [json.dumps(value, ensure_ascii=False) for value in values]
+    if meta_type in ("str", "json"):
+        return np.array(values, dtype=_text_dtype(values))
+    return np.array(values, dtype=_META_DTYPES[meta_type])
+
+
+def write_pred_archive(pred: Dict[str, Any], path: Union[str, os.PathLike]):
+    """json[year][month_day][race_time] 形式の予測を列形式のアーカイブに書き出す
+
+    レース表は固定長の構造化配列で, 日付・発走時刻の順に並べる. 予測確率はfloat64の1次元配列に
+    全レース分を連結し, レースごとの開始位置と頭数をレース表に持つ. メタデータは列ごとに
+    値の型 (bool, int, float, str) のまま保存し, 型がそろわない列はJSON文字列にする.
+    キーの有無は別の真偽値の配列に持つ.
+
+    Args:
+        pred (Dict[str, Any]): 予測JSON
+        path (Union[str, os.PathLike]): 書き出すディレクトリ
+    """
+    rows = []
+    for year, days in pred.items():
+        for month_day, races in days.items():
+            for race_time, race in races.items():
+                rows.append((year, month_day, to_minutes(race_time), race_time, race))
+    rows.sort(key=lambda row: row[:3])
+
+    meta_columns = sorted({key for *_, race in rows for key in race if key != "pred"})
+    reserved = set(_KEY_COLUMNS) | {name for name, _ in _INDEX_COLUMNS}
+    if reserved & set(meta_columns):
+        raise ValueError(
+            "レース表の列名と重なるメタデータがあります: {}".format(
+                sorted(reserved & set(meta_columns))
+            )
+        )
+
+    columns = {
+        "year": [row[0] for row in rows],
+        "month_day": [row[1] for row in rows],
+        "race_time": [row[3] for row in rows],
+    }
+    meta_mask = np.array(
+        [[key in row[4] for key in meta_columns] for row in rows], dtype=np.bool_
+    ).reshape(len(rows), len(meta_columns))
+    meta_types = {}
+    meta_arrays = {}
+    for key in meta_columns:
+        meta_types[key] = _meta_type([row[4][key] for row in rows if key in row[4]])
+        # 無いキーの値は型に合わせた空の値にする
+        empty = {"bool": False, "int": 0, "float": 0.0, "str": ""}.get(
+            meta_types[key], None
+        )
+        meta_arrays[key] = _meta_column(
+            [row[4].get(key, empty) for row in rows], meta_types[key]
+        )
+
+    counts = np.array([len(row[4].get("pred", {})) for row in rows], dtype=np.int16)
+    offsets = np.zeros(len(rows), dtype=np.int64)
+    offsets[1:] = np.cumsum(counts, dtype=np.int64)[:-1]
+
+    dtype = [(name, _text_dtype(values)) for name, values in columns.items()]
+    dtype += [(key, array.dtype) for key, array in meta_arrays.items()]
+    races = np.zeros(len(rows), dtype=dtype + list(_INDEX_COLUMNS))
+    for name, values in columns.items():
+        races[name] = values
+    for key, array in meta_arrays.items():
+        races[key] = array
+    races["minutes"] = [row[2] for row in rows]
+    races["offset"] = offsets
+    races["count"] = counts
+
+    umaban = np.array(
+        [int(u) for *_, race in rows for u in race.get("pred", {})], dtype=np.int16
+    )
+    probabilities = np.array(
+        [p for *_, race in rows for p in race.get("pred", {}).values()],
+        dtype=np.float64,
+    )
+
+    # 日付ごとのレースの範囲
+    day_keys = [(row[0], row[1]) for row in rows]
+    starts = [i for i in range(len(rows)) if i == 0 or day_keys[i] != day_keys[i - 1]]
+    days = np.zeros(
+        len(starts),
+        dtype=[
+            ("year", races.dtype["year"]),
+            ("month_day", races.dtype["month_day"]),
+            ("start", np.int64),
+            ("stop", np.int64),
+        ],
+    )
+    days["year"] = [day_keys[i][0] for i in starts]
+    days["month_day"] = [day_keys[i][1] for i in starts]
+    days["start"] = starts
+    days["stop"] = starts[1:] + [len(rows)] if starts else []
+
+    os.makedirs(path, exist_ok=True)
+    marker_path = os.path.join(path, _MARKER_FILE)
+    if os.path.exists(marker_path):
+        os.remove(marker_path)
+    for name, array in [
+        (_RACES_FILE, races),
+        (_DAYS_FILE, days),
+        (_UMABAN_FILE, umaban),
+        (_PRED_FILE, probabilities),
+        (_META_MASK_FILE, meta_mask),
+    ]:
+        np.save(os.path.join(path, name), array)
+    # 最後に目印を書くので, 途中で止まったディレクトリはアーカイブとみなさない
+    with open(marker_path, "w") as f:
+        json.dump(
+            {
+                "version": _VERSION,
+                "meta_columns": meta_columns,
+                "meta_types": meta_types,
+            },
+            f,
+        )
+
+
+def convert_json_to_archive(
+    json_path: Union[str, os.PathLike], archive_path: Union[str, os.PathLike]
+):
+    """予測JSONファイルを列形式のアーカイブに変換する"""
+    with open(json_path, "r") as f:
+        pred = json.load(f)
+    write_pred_archive(pred, archive_path)
+
+
+class PredArchive:
+    """列形式の予測アーカイブ
+
+    各配列はメモリマップで開くので, 開くだけではファイルを読み込まない.
+    races_on() は指定日のレースだけを予測JSONと同じ形の辞書に戻す. 辞書に戻す時は
+    範囲内の列をまとめてPythonの値に変換し, レースごとにNumPyのスカラーを扱わない.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        """コンストラクタ
+
+        Args:
+            path (Union[str, os.PathLike]): アーカイブのディレクトリ
+        """
+        if not is_pred_archive(path):
+            raise FileNotFoundError(f"予測アーカイブが見つかりません: {path}")
+        with open(os.path.join(path, _MARKER_FILE), "r") as f:
+            marker = json.load(f)
+        if marker["version"] != _VERSION:
+            raise ValueError(f"対応していない予測アーカイブです: {marker['version']}")
+
+        self._meta_columns: List[str] = marker["meta_columns"]
+        self._meta_types: Dict[str, str] = marker["meta_types"]
+        self._meta_mask = np.load(os.path.join(path, _META_MASK_FILE), mmap_mode="r")
+        self._races = np.load(os.path.join(path, _RACES_FILE), mmap_mode="r")
+        self._umaban = np.load(os.path.join(path, _UMABAN_FILE), mmap_mode="r")
+        self._pred = np.load(os.path.join(path, _PRED_FILE), mmap_mode="r")
+        days = np.load(os.path.join(path, _DAYS_FILE))
+        self._days: Dict[Tuple[str, str], Tuple[int, int]] = {
+            (str(day["year"]), str(day["month_day"])): (
+                int(day["start"]),
+                int(day["stop"]),
+            )
+            for day in days
+        }
+
+    @property
+    def days(self) -> List[Tuple[str, str]]:
+        """アーカイブに含まれる (年, 月日) の昇順"""
+        return list(self._days)
+
+    def day_range(self, year: str, month_day: str) -> Tuple[int, int]:
+        """指定日のレースのレース表での範囲"""
+        return self._days.get((year, month_day), (0, 0))
+
+    def race_pred(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """i番目のレースの馬番と予測確率. コピーせずにアーカイブを参照する"""
+        start = int(self._races["offset"][i])
+        stop = start + int(self._races["count"][i])
+        return self._umaban[start:stop], self._pred[start:stop]
+
+    def meta_column(
+        self, key: str, start: int = 0, stop: Optional[int] = None
+    ) -> List[Any]:
+        """メタデータの列を保存した時の型の値のリストにする. キーが無いレースはNone"""
+        values = self._races[key][start:stop].tolist()
+        present = self._meta_mask[start:stop, self._meta_columns.index(key)].tolist()
+        loads = json.loads if self._meta_types[key] == "json" else None
+        return [
+            (loads(value) if loads is not None else value) if has else None
+            for value, has in zip(values, present)
+        ]
+
+    def _build_races(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        races: List[Dict[str, Any]] = [{} for _ in range(start, stop)]
+        if start >= stop:
+            return races
+        for j, key in enumerate(self._meta_columns):
+            values = self._races[key][start:stop].tolist()
+            present = self._meta_mask[start:stop, j].tolist()
+            loads = json.loads if self._meta_types[key] == "json" else None
+            for race, value, has in zip(races, values, present):
+                if has:
+                    race[key] = loads(value) if loads is not None else value
+
+        # レースは日付・発走時刻の順に連続して並ぶので, 予測もまとめて変換する
+        offsets = self._races["offset"][start:stop].tolist()
+        counts = self._races["count"][start:stop].tolist()
+        base = offsets[0]
+        end = offsets[-1] + counts[-1]
+        umaban = [str(u) for u in self._umaban[base:end].tolist()]
+        pred = self._pred[base:end].tolist()
+        for race, offset, count in zip(races, offsets, counts):
+            offset -= base
+            race["pred"] = dict(
+                zip(umaban[offset : offset + count], pred[offset : offset + count])
+            )
+        return races
+
+    def race(self, i: int) -> Dict[str, Any]:
+        """i番目のレースを予測JSONと同じ形の辞書にする"""
+        return self._build_races(i, i + 1)[0]
+
+    def races_on(self, year: str, month_day: str) -> Dict[str, Any]:
+        """指定日のレースを json[year][month_day] と同じ形で返す"""
+        start, stop = self.day_range(year, month_day)
+        race_times = self._races["race_time"][start:stop].tolist()
+        return dict(zip(race_times, self._build_races(start, stop)))
+
+    def to_json(self) -> Dict[str, Any]:
+        """アーカイブ全体を予測JSONと同じ形に戻す"""
+        race_times = self._races["race_time"].tolist()
+        races = self._build_races(0, len(self._races))
+        pred: Dict[str, Any] = {}
+        for (year, month_day), (start, stop) in self._days.items():
+            pred.setdefault(year, {})[month_day] = dict(
+                zip(race_times[start:stop], races[start:stop])
+            )
+        return pred
+
+    @property
+    def races(self) -> np.ndarray:
+        return self._races
+
+    @property
+    def umaban(self) -> np.ndarray:
+        return self._umaban
+
+    @property
+    def pred(self) -> np.ndarray:
+        return self._pred
+
+    @property
+    def meta_columns(self) -> List[str]:
+        return list(self._meta_columns)
+
+    def __len__(self):
+        return len(self._races)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="予測JSONを列形式のアーカイブに変換する"
+    )
+    parser.add_argument("json_path")
+    parser.add_argument("archive_path")
+    args = parser.parse_args()
+    convert_json_to_archive(args.json_path, args.archive_path)
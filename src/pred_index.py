@@ -0,0 +1,197 @@
+import io
+import json
+import os
+from typing import Any, BinaryIO, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+# 日付ごとの部分木の位置. index[year][month_day] = (開始バイト, 終了バイト)
+DayIndex = Dict[str, Dict[str, Tuple[int, int]]]
+
+_INDEX_SUFFIX = ".idx.json"
+
+
+def _quote_mask(data: np.ndarray) -> np.ndarray:
+    """エスケープされていない '"' の位置"""
+    quote = data == ord('"')
+    backslash = data == ord("\\")
+    if backslash.any():
+        # 直前に連続するバックスラッシュが奇数個ならエスケープされている
+        count = np.cumsum(backslash)
+        run = count - np.maximum.accumulate(np.where(backslash, 0, count))
+        quote[1:] &= run[:-1] % 2 == 0
+    return quote
+
+
+def _read_key(stream: BinaryIO, span: Tuple[int, int]) -> str:
+    stream.seek(span[0])
+    return json.loads(stream.read(span[1] - span[0]))
+
+
+def build_day_index(stream: BinaryIO, chunk_size: int = 1 << 20) -> DayIndex:
+    """予測JSONを先頭から走査し, 日付ごとの部分木のバイト位置を求める
+
+    json[year][month_day] の値の位置だけを記録し, 値そのものは解析しない.
+    チャンクごとに文字列の外の波括弧をNumPyでまとめて数え, 年・月日の階層の出入りだけをPythonで処理する.
+    ストリームはチャンク単位で読むので, メモリ使用量はファイルサイズに依存しない.
+
+    Args:
+        stream (BinaryIO): 予測JSONのシーク可能なバイトストリーム. 現在位置から読む
+        chunk_size (int, optional): 1回に読むバイト数. Defaults to 1MiB.
+
+    Returns:
+        DayIndex: 日付ごとの部分木の位置
+    """
+    # (年のキーの位置, 月日のキーの位置, 開始バイト, 終了バイト)
+    days = []
+    year_key = None
+    day_key = None
+    day_start = 0
+
+    depth = 0
+    in_string = 0
+    # 直前の2つの '"' の位置. '{' の直前の文字列がキーになる
+    last_quotes = np.full(2, -1, dtype=np.int64)
+
+    offset = stream.tell()
+    carry = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer = carry + chunk
+        if chunk:
+            # 末尾のバックスラッシュは次の文字と合わせて判定する
+            carry = buffer[len(buffer.rstrip(b"\\")) :]
+            buffer = buffer[: len(buffer) - len(carry)]
+        else:
+            carry = b""
+        if not buffer:
+            if not chunk:
+                break
+            continue
+
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        quote_pos = np.flatnonzero(_quote_mask(data)) + offset
+        is_open = data == ord("{")
+        brace_pos = np.flatnonzero(is_open | (data == ord("}")))
+
+        # 文字列の外の括弧だけを残す
+        outside = (np.searchsorted(quote_pos, brace_pos + offset) + in_string) % 2 == 0
+        brace_pos = brace_pos[outside]
+        delta = np.where(is_open[brace_pos], 1, -1)
+        depth_after = depth + np.cumsum(delta)
+        depth_before = depth_after - delta
+
+        quotes = np.concatenate((last_quotes, quote_pos))
+        events = np.flatnonzero(
+            ((delta == 1) & ((depth_before == 1) | (depth_before == 2)))
+            | ((delta == -1) & (depth_after == 2))
+        )
+        for i in events:
+            position = int(brace_pos[i]) + offset
+            if delta[i] == -1:
+                days.append((year_key, day_key, day_start, position + 1))
+                continue
+
+            k = np.searchsorted(quotes, position)
+            key = (int(quotes[k - 2]), int(quotes[k - 1]) + 1)
+            if depth_before[i] == 1:
+                year_key = key
+            else:
+                day_key = key
+                day_start = position
+
+        if len(brace_pos):
+            depth = int(depth_after[-1])
+        in_string = (in_string + len(quote_pos)) % 2
+        last_quotes = quotes[-2:]
+        offset += len(buffer)
+
+    if depth != 0 or in_string:
+        raise ValueError("予測JSONが途中で終わっています")
+
+    # キーは最後にまとめて読む
+    index: DayIndex = {}
+    keys = {}
+    for year_span, day_span, start, end in days:
+        for span in (year_span, day_span):
+            if span not in keys:
+                keys[span] = _read_key(stream, span)
+        index.setdefault(keys[year_span], {})[keys[day_span]] = (start, end)
+    return index
+
+
+def read_day_index(path: Union[str, os.PathLike]) -> DayIndex:
+    """予測JSONファイルの日付ごとの部分木の位置を返す
+
+    ファイルの横に索引 (<path>.idx.json) を保存し, ファイルのサイズと更新時刻が同じなら再利用する.
+
+    Args:
+        path (Union[str, os.PathLike]): 予測JSONのパス
+
+    Returns:
+        DayIndex: 日付ごとの部分木の位置
+    """
+    stat = os.stat(path)
+    index_path = f"{os.fspath(path)}{_INDEX_SUFFIX}"
+    try:
+        with open(index_path, "r") as f:
+            sidecar = json.load(f)
+        if sidecar["size"] == stat.st_size and sidecar["mtime_ns"] == stat.st_mtime_ns:
+            return {
+                year: {month_day: tuple(span) for month_day, span in days.items()}
+                for year, days in sidecar["index"].items()
+            }
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    with open(path, "rb") as f:
+        index = build_day_index(f)
+
+    # 書き込めない場所にあるファイルは毎回走査する
+    tmp_path = f"{index_path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "index": index}, f
+            )
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass
+    return index
+
+
+def load_day(
+    source: Union[str, os.PathLike, BinaryIO, bytes],
+    year: str,
+    month_day: str,
+    index: Optional[DayIndex] = None,
+) -> Dict[str, Any]:
+    """予測JSONから指定日の部分木だけを読み込む
+
+    Args:
+        source (Union[str, os.PathLike, BinaryIO, bytes]): 予測JSONのパス, シーク可能なバイトストリーム, またはバイト列
+        year (str): 年
+        month_day (str): 月日 ("mmdd")
+        index (DayIndex, optional): 日付ごとの部分木の位置. Defaults to 読み込み時に作る.
+
+    Returns:
+        Dict[str, Any]: json[year][month_day]. 無ければ空の辞書
+    """
+    if isinstance(source, (str, os.PathLike)):
+        if index is None:
+            index = read_day_index(source)
+        with open(source, "rb") as f:
+            return load_day(f, year, month_day, index)
+
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    if index is None:
+        start = source.tell()
+        index = build_day_index(source)
+        source.seek(start)
+
+    span = index.get(year, {}).get(month_day)
+    if span is None:
+        return {}
+    source.seek(span[0])
+    return json.loads(source.read(span[1] - span[0]))
@@ -0,0 +1,114 @@
+import bisect
+import datetime
+import logging
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def parse_race_time(race_time: str) -> datetime.time:
+    """発走時刻の文字列 ("hhmm" または "hh:mm") を時刻にする"""
+    text = race_time.replace(":", "").strip()
+    if len(text) != 4 or not text.isdigit():
+        raise ValueError(f"発走時刻の形式が不正です: {race_time}")
+    return datetime.time(int(text[:2]), int(text[2:]))
+
+
+def to_minutes(race_time: str) -> int:
+    """発走時刻の文字列を0時からの分数にする"""
+    time = parse_race_time(race_time)
+    return time.hour * 60 + time.minute
+
+
+class _DayIndex(NamedTuple):
+    """1日分のレース. 発走時刻の昇順"""
+
+    minutes: List[int]
+    races: List[Dict[str, Any]]
+
+
+class PredStore:
+    """予測JSONを日付ごとに発走時刻で索引付けしたもの
+
+    読み込み時に1回だけ発走時刻を解析して並べておき, 時間帯の問い合わせは二分探索で答える.
+    レースのレコードは予測JSONの辞書をそのまま参照する.
+    """
+
+    def __init__(self, json: Dict[str, Any]):
+        """コンストラクタ
+
+        Args:
+            json (Dict[str, Any]): json[year][month_day][race_time] 形式の予測JSON
+        """
+        self._days: Dict[Tuple[str, str], _DayIndex] = {}
+        for year, days in json.items():
+            for month_day, races in days.items():
+                entries = []
+                for race_time, race in races.items():
+                    try:
+                        entries.append((to_minutes(race_time), race))
+                    except ValueError as e:
+                        logger.warning(
+                            "%s%s のレースを読み飛ばします: %s", year, month_day, e
+                        )
+                entries.sort(key=lambda entry: entry[0])
+                self._days[(year, month_day)] = _DayIndex(
+                    [minute for minute, _ in entries], [race for _, race in entries]
+                )
+
+    def races_on(self, year: str, month_day: str) -> List[Tuple[int, Dict[str, Any]]]:
+        """指定日のレースを発走時刻の順に返す
+
+        Args:
+            year (str): 年
+            month_day (str): 月日 ("mmdd")
+
+        Returns:
+            List[Tuple[int, Dict[str, Any]]]: (0時からの分数, レース) のリスト
+        """
+        day = self._days.get((year, month_day))
+        if day is None:
+            return []
+        return list(zip(day.minutes, day.races))
+
+    def races_between(
+        self, year: str, month_day: str, start: int, end: int
+    ) -> List[Dict[str, Any]]:
+        """発走時刻が start 分から end 分 (両端を含む) のレースを返す
+
+        Args:
+            year (str): 年
+            month_day (str): 月日 ("mmdd")
+            start (int): 0時からの分数
+            end (int): 0時からの分数
+
+        Returns:
+            List[Dict[str, Any]]: 発走時刻の順のレース
+        """
+        day = self._days.get((year, month_day))
+        if day is None:
+            return []
+        lo = bisect.bisect_left(day.minutes, start)
+        hi = bisect.bisect_right(day.minutes, end)
+        return day.races[lo:hi]
+
+    def races_starting_within(
+        self, year: str, month_day: str, now_time: str, min_ahead: int, max_ahead: int
+    ) -> List[Dict[str, Any]]:
+        """現在時刻の min_ahead 分後から max_ahead 分後までに発走するレースを返す
+
+        Args:
+            year (str): 年
+            month_day (str): 月日 ("mmdd")
+            now_time (str): 現在時刻 ("hhmm")
+            min_ahead (int): 何分後から
+            max_ahead (int): 何分後まで
+
+        Returns:
+            List[Dict[str, Any]]: 発走時刻の順のレース
+        """
+        now = to_minutes(now_time)
+        return self.races_between(year, month_day, now + min_ahead, now + max_ahead)
+
+    def __len__(self):
+        return sum(len(day.races) for day in self._days.values())
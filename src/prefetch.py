@@ -0,0 +1,282 @@
+import datetime
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+import pandas as pd
+
+from src.pred_store import PredStore
+from src.race_id import make_race_id
+from src.scraper import OddsScraper
+from src.tracing import count
+
+logger = logging.getLogger(__name__)
+
+
+class OddsSnapshot(NamedTuple):
+    """先読みしたオッズ"""
+
+    odds: pd.Series
+    # 取得を始めた時刻. オッズはこの時刻以降のもの
+    fetched_at: datetime.datetime
+
+
+class _WatchedRace(NamedTuple):
+    year: str
+    race: Dict[str, Any]
+    post_time: datetime.datetime
+
+
+class OddsPrefetcher:
+    """発走前のレースのオッズを先読みし, 判断時刻には最後の1回だけ取得する
+
+    発走の lead_time 前から判断時刻 (発走の decision_lead_time 前) まで interval 秒ごとに
+    バックグラウンドでオッズを取得し, レースごとに最新のものだけをメモリに残す. 判断時刻の get_odds_by_race では
+    取得を1回だけ行い, refresh_timeout 秒以内に取得できなければ max_staleness 以内に
+    先読みしたオッズを使う. OddsScraper と同じ get_odds_by_race と base_url を持つので,
+    ConcurrentOddsScraper にスクレイパーの代わりに渡せる.
+    """
+
+    def __init__(
+        self,
+        scraper: OddsScraper,
+        lead_time: datetime.timedelta = datetime.timedelta(minutes=15),
+        decision_lead_time: datetime.timedelta = datetime.timedelta(minutes=7),
+        interval: float = 60.0,
+        max_staleness: datetime.timedelta = datetime.timedelta(minutes=2),
+        refresh_timeout: float = 15.0,
+        max_workers: int = 2,
+        clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+    ):
+        """コンストラクタ
+
+        Args:
+            scraper (OddsScraper): 1レース分のオッズを取得するスクレイパー
+            lead_time (datetime.timedelta, optional): 発走の何分前から先読みするか. Defaults to 15分.
+            decision_lead_time (datetime.timedelta, optional): 判断時刻. 発走の何分前まで先読みするか.
+                RaceScheduler の lead_time に合わせる. Defaults to 7分.
+            interval (float, optional): 先読みの間隔の秒数. Defaults to 60.0.
+            max_staleness (datetime.timedelta, optional): 判断時刻の取得が間に合わない場合に
+                使う先読みしたオッズの古さの上限. Defaults to 2分.
+            refresh_timeout (float, optional): 判断時刻の取得を待つ秒数. Defaults to 15.0.
+            max_workers (int, optional): 同時に先読みするレース数の上限. Defaults to 2.
+            clock (Callable[[], datetime.datetime], optional): 現在時刻を返す関数. Defaults to datetime.datetime.now.
+        """
+        self._scraper = scraper
+        self._lead_time = lead_time
+        self._decision_lead_time = decision_lead_time
+        self._interval = interval
+        self._max_staleness = max_staleness
+        self._refresh_timeout = refresh_timeout
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._races: Dict[str, _WatchedRace] = {}
+        self._snapshots: Dict[str, OddsSnapshot] = {}
+        # 取得中のレース. 同じレースの先読みを重ねない
+        self._inflight: Dict[str, Future] = {}
+        # 判断時刻の取得が先読みの順番待ちにならないように別のスレッドで行う
+        self._prefetch_executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="odds_prefetch"
+        )
+        self._refresh_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="odds_refresh"
+        )
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return self._scraper.base_url
+
+    def load(
+        self,
+        pred: Union[PredStore, Dict[str, Any]],
+        date: Optional[datetime.date] = None,
+    ) -> int:
+        """予測から指定日のまだ発走していないレースを先読みの対象に加える
+
+        Args:
+            pred (Union[PredStore, Dict[str, Any]]): 予測の索引または予測JSON
+            date (datetime.date, optional): 対象日. Defaults to 今日.
+
+        Returns:
+            int: 新たに加えたレース数
+        """
+        store = pred if isinstance(pred, PredStore) else PredStore(pred)
+        now = self._clock()
+        if date is None:
+            date = now.date()
+        year = date.strftime("%y")
+        midnight = datetime.datetime.combine(date, datetime.time())
+
+        added = 0
+        with self._lock:
+            for minutes, race in store.races_on(year, date.strftime("%m%d")):
+                race_id = make_race_id(
+                    year, race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+                )
+                post_time = midnight + datetime.timedelta(minutes=minutes)
+                if race_id in self._races or post_time <= now:
+                    continue
+                self._races[race_id] = _WatchedRace(year, race, post_time)
+                added += 1
+        return added
+
+    def _fetch(self, race_id: str, year: str, race: Dict[str, Any]) -> pd.Series:
+        fetched_at = self._clock()
+        odds = self._scraper.get_odds_by_race(
+            year, race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+        )
+        with self._lock:
+            # 後から始めた取得が先に終わっていれば残す
+            snapshot = self._snapshots.get(race_id)
+            if snapshot is None or snapshot.fetched_at <= fetched_at:
+                self._snapshots[race_id] = OddsSnapshot(odds, fetched_at)
+        return odds
+
+    def _submit(
+        self,
+        executor: ThreadPoolExecutor,
+        race_id: str,
+        year: str,
+        race: Dict[str, Any],
+    ) -> Future:
+        # self._lock を持って呼ぶ
+        future = executor.submit(self._fetch, race_id, year, race)
+        self._inflight[race_id] = future
+
+        def done(future: Future):
+            with self._lock:
+                if self._inflight.get(race_id) is future:
+                    del self._inflight[race_id]
+            if not future.cancelled() and future.exception() is not None:
+                logger.warning(
+                    "オッズの先読みに失敗しました: %s %s", race_id, future.exception()
+                )
+
+        future.add_done_callback(done)
+        return future
+
+    def refresh_due(self) -> int:
+        """先読みの時間帯に入ったレースのオッズの取得を始める
+
+        判断時刻を過ぎたレースは先読みしない. 発走時刻を過ぎたレースは対象から外し,
+        先読みしたオッズも捨てる.
+
+        Returns:
+            int: 取得を始めたレース数
+        """
+        now = self._clock()
+        started = 0
+        with self._lock:
+            for race_id, watched in list(self._races.items()):
+                if watched.post_time <= now:
+                    del self._races[race_id]
+                    self._snapshots.pop(race_id, None)
+                    continue
+                if watched.post_time - self._lead_time > now:
+                    continue
+                # 判断時刻の後は get_odds_by_race の取得だけで, 先読みは使われない
+                if watched.post_time - self._decision_lead_time <= now:
+                    continue
+                if race_id in self._inflight:
+                    continue
+                self._submit(
+                    self._prefetch_executor, race_id, watched.year, watched.race
+                )
+                count("odds_prefetch")
+                started += 1
+        return started
+
+    def latest(self, race_id: str) -> Optional[OddsSnapshot]:
+        """レースの先読みした最新のオッズ. 無ければNone"""
+        with self._lock:
+            return self._snapshots.get(race_id)
+
+    def get_odds_by_race(
+        self, year: str, jyo: str, kaiji: str, nichiji: str, race_num: str
+    ) -> pd.Series:
+        """判断時刻にオッズを1回だけ取得する
+
+        先読みが取得中でも判断時刻から取得し直す. refresh_timeout 秒以内に取得できないか
+        取得に失敗した場合は, max_staleness 以内に先読みしたオッズを返す.
+
+        Args:
+            year (str): 年
+            jyo (str): 競馬場
+            kaiji (str): 回次
+            nichiji (str): 日次
+            race_num (str): レース番組
+
+        Returns:
+            pd.Series: 該当レースの単勝オッズ
+
+        Raises:
+            TimeoutError: 取得が間に合わず, 使える先読みのオッズも無い場合
+        """
+        race_id = make_race_id(year, jyo, kaiji, nichiji, race_num)
+        race = {"JyoCD": jyo, "Kaiji": kaiji, "Nichiji": nichiji, "RaceNum": race_num}
+        with self._lock:
+            future = self._submit(self._refresh_executor, race_id, year, race)
+
+        try:
+            return future.result(timeout=self._refresh_timeout)
+        except FutureTimeoutError:
+            error: Exception = TimeoutError("オッズの取得が間に合いませんでした")
+        except Exception as e:
+            error = e
+
+        snapshot = self.latest(race_id)
+        if (
+            snapshot is None
+            or self._clock() - snapshot.fetched_at > self._max_staleness
+        ):
+            raise error
+        logger.warning(
+            "最新のオッズを取得できないため %s に先読みしたオッズを使います: %s %s",
+            snapshot.fetched_at.strftime("%H:%M:%S"),
+            race_id,
+            error,
+        )
+        count("odds_prefetch_stale")
+        return snapshot.odds
+
+    def start(self):
+        """バックグラウンドで interval 秒ごとに先読みを始める"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            try:
+                self.refresh_due()
+            except Exception:
+                logger.exception("オッズの先読みに失敗しました")
+            self._wakeup.wait(self._interval)
+            self._wakeup.clear()
+
+    def close(self):
+        """先読みを止める. 取得中のリクエストは待たない"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+        self._refresh_executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._races)
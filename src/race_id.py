@@ -0,0 +1,3 @@
+def make_race_id(year, jyo, kaiji, nichiji, race_num) -> str:
+    """netkeibaのレースIDを作る"""
+    return "{}{:02}{:02}{:02}{:02}".format(year, jyo, kaiji, nichiji, race_num)
@@ -1,23 +1,78 @@
 import io
 import json
+import logging
+import os
 import os.path
+from typing import Any, BinaryIO, Dict, Optional, Tuple, Union
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseDownload
 
+from src.pred_index import build_day_index, load_day, read_day_index
+from src.pred_store import PredStore
+from src.tracing import span
+
+logger = logging.getLogger(__name__)
+
 
 class GoogleDriveJsonReader:
+    """Google Drive上の予測JSONを読み込む
+
+    Drive APIのクライアントと認証情報は使い回し, ファイル名からIDへの検索結果も保持する.
+    refresh() はファイルの modifiedTime / md5Checksum を確認し, 変わっている時だけダウンロードする.
+    ダウンロードはチャンクごとにキャッシュのファイルへ書き, 全体をメモリに載せない.
+    cache_dir を指定するとファイルIDごとにディスクへ保存し, 再起動後も変わっていなければ再利用する.
+    day_store() は日付ごとの部分木の位置の索引を使い, 指定日の予測だけを解析する.
+    """
+
     _SCOPES = [
         "https://www.googleapis.com/auth/drive.metadata.readonly",
         "https://www.googleapis.com/auth/drive.readonly",
     ]
+    _INDEX_FILE = "index.json"
 
-    def __init__(self, credentials_json_path, token_json_path, json_path):
-        self._creds = self._set_credential(credentials_json_path, token_json_path)
-        self._json = self._read_json(json_path)
+    def __init__(
+        self,
+        credentials_json_path,
+        token_json_path,
+        json_path,
+        cache_dir: Optional[str] = None,
+        service=None,
+        chunk_size: int = 8 * 1024 * 1024,
+    ):
+        """コンストラクタ
+
+        Args:
+            credentials_json_path (str): 認証情報のJSONのパス
+            token_json_path (str): トークンのJSONのパス
+            json_path (str): Google Drive上の予測JSONのファイル名
+            cache_dir (str, optional): ダウンロードしたJSONを保存するディレクトリ. Defaults to None.
+            service (optional): Drive APIのクライアント. 指定した場合は認証しない. Defaults to None.
+            chunk_size (int, optional): ダウンロードで1回に取得するバイト数. Defaults to 8MiB.
+        """
+        self._json_path = json_path
+        self._cache_dir = cache_dir
+        self._chunk_size = chunk_size
+        if service is None:
+            self._creds = self._set_credential(credentials_json_path, token_json_path)
+            # Drive APIクライアントを初期化
+            service = build("drive", "v3", credentials=self._creds)
+        else:
+            self._creds = None
+        self._service = service
+
+        self._file_ids: Dict[str, str] = self._load_index()
+        self._metadata: Optional[Dict[str, Any]] = None
+        self._source: Optional[Union[str, bytes]] = None
+        self._json = None
+        self._store = None
+        self._day_index = None
+        self._day_stores: Dict[Tuple[str, str], PredStore] = {}
+        self.refresh()
 
     def _set_credential(self, credentials_json_path: str, token_json_path: str):
         creds = None
@@ -38,40 +93,209 @@ class GoogleDriveJsonReader:
 
         return creds
 
-    def _read_json(self, json_path):
-        # Drive APIクライアントを初期化
-        service = build("drive", "v3", credentials=self._creds)
+    def refresh(self) -> bool:
+        """Drive上のファイルが変わっていれば読み直す
+
+        JSONの解析は json / store / day_store を使う時まで遅らせる.
+
+        Returns:
+            bool: 読み直した場合はTrue
+        """
+        with span("drive_metadata"):
+            metadata = self._get_metadata()
+        if self._source is not None and self._same_version(self._metadata, metadata):
+            return False
+
+        file_id = metadata["id"]
+        day_index = None
+        if self._has_cache(file_id, metadata):
+            source = self._cache_path(f"{file_id}.json")
+        else:
+            with span("drive_download", size=metadata.get("size")):
+                source = self._download(file_id, metadata)
+            logger.info("予測JSONをダウンロードしました: %s", metadata)
+            if self._cache_dir is not None:
+                # 書き終えたファイルから索引を作り, 横に保存しておく
+                with span("drive_index"):
+                    day_index = read_day_index(source)
+
+        self._source = source
+        self._metadata = metadata
+        self._json = None
+        self._store = None
+        self._day_index = day_index
+        self._day_stores = {}
+        return True
+
+    def _download(self, file_id: str, metadata: Dict[str, Any]) -> Union[str, bytes]:
+        """ファイルをチャンクごとにダウンロードする
+
+        cache_dir があればキャッシュのファイルへ直接書いてパスを返し, 無ければ内容を返す.
+        """
+        request = self._service.files().get_media(fileId=file_id)
+        if self._cache_dir is None:
+            buffer = io.BytesIO()
+            self._stream(request, buffer)
+            return buffer.getvalue()
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        path = self._cache_path(f"{file_id}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            self._stream(request, f)
+        os.replace(tmp_path, path)
+        # 本体を書き終えてからメタデータを書くので, 途中で止まっても古い本体を使わない
+        self._write_file(f"{file_id}.meta.json", json.dumps(metadata).encode())
+        return path
+
+    def _stream(self, request, f: BinaryIO):
+        downloader = MediaIoBaseDownload(f, request, chunksize=self._chunk_size)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+
+    def load_day(self, year: str, month_day: str) -> Dict[str, Any]:
+        """指定日の予測だけを読み込む
 
+        Args:
+            year (str): 年
+            month_day (str): 月日 ("mmdd")
+
+        Returns:
+            Dict[str, Any]: json[year][month_day]. 無ければ空の辞書
+        """
+        if self._json is not None:
+            return self._json.get(year, {}).get(month_day, {})
+        if self._day_index is None:
+            if isinstance(self._source, bytes):
+                self._day_index = build_day_index(io.BytesIO(self._source))
+            else:
+                self._day_index = read_day_index(self._source)
+        return load_day(self._source, year, month_day, self._day_index)
+
+    def day_store(self, year: str, month_day: str) -> PredStore:
+        """指定日の予測だけを索引付けしたもの
+
+        Args:
+            year (str): 年
+            month_day (str): 月日 ("mmdd")
+
+        Returns:
+            PredStore: 指定日のレースの索引
+        """
+        key = (year, month_day)
+        if key not in self._day_stores:
+            self._day_stores[key] = PredStore(
+                {year: {month_day: self.load_day(year, month_day)}}
+            )
+        return self._day_stores[key]
+
+    def _get_metadata(self) -> Dict[str, Any]:
+        file_id = self._file_ids.get(self._json_path)
+        if file_id is not None:
+            try:
+                return self._fetch_metadata(file_id)
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                # ファイルが置き換えられた場合は名前で検索し直す
+                logger.info("ファイルIDが見つからないため検索し直します: %s", file_id)
+
+        file_id = self._find_file_id(self._json_path)
+        self._file_ids[self._json_path] = file_id
+        self._save_index()
+        return self._fetch_metadata(file_id)
+
+    def _find_file_id(self, json_path: str) -> str:
         # ファイル名で検索
         query = f"name = '{json_path}'"
-        response = service.files().list(q=query).execute()
+        response = self._service.files().list(q=query).execute()
         files = response.get("files", [])
 
         # ファイルが存在するか
         if not files:
             raise FileNotFoundError(f"パスにファイルが見つかりません. {json_path}")
 
-        file_id = files[0]["id"]
+        return files[0]["id"]
 
-        # ファイルをダウンロード
-        request = service.files().get_media(fileId=file_id)
-        file_io = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_io, request)
+    def _fetch_metadata(self, file_id: str) -> Dict[str, Any]:
+        return (
+            self._service.files()
+            .get(fileId=file_id, fields="id,modifiedTime,md5Checksum,size")
+            .execute()
+        )
 
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
+    @staticmethod
+    def _same_version(
+        old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]
+    ) -> bool:
+        if old is None or new is None:
+            return False
+        return all(
+            old.get(key) == new.get(key)
+            for key in ("id", "modifiedTime", "md5Checksum")
+        )
+
+    def _cache_path(self, name: str) -> str:
+        return os.path.join(self._cache_dir, name)
 
-        file_io.seek(0)
+    def _load_index(self) -> Dict[str, str]:
+        if self._cache_dir is None:
+            return {}
+        try:
+            with open(self._cache_path(self._INDEX_FILE), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
 
-        json_content = json.load(file_io)
+    def _save_index(self):
+        if self._cache_dir is None:
+            return
+        self._write_file(
+            self._INDEX_FILE, json.dumps(self._file_ids, ensure_ascii=False).encode()
+        )
 
-        return json_content
+    def _has_cache(self, file_id: str, metadata: Dict[str, Any]) -> bool:
+        if self._cache_dir is None:
+            return False
+        try:
+            with open(self._cache_path(f"{file_id}.meta.json"), "r") as f:
+                cached_metadata = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return self._same_version(cached_metadata, metadata) and os.path.exists(
+            self._cache_path(f"{file_id}.json")
+        )
+
+    def _write_file(self, name: str, content: bytes):
+        os.makedirs(self._cache_dir, exist_ok=True)
+        path = self._cache_path(name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
 
     @property
     def json(self):
+        if self._json is None:
+            if isinstance(self._source, bytes):
+                self._json = json.loads(self._source)
+            else:
+                with open(self._source, "rb") as f:
+                    self._json = json.load(f)
         return self._json
 
+    @property
+    def store(self) -> PredStore:
+        # 発走時刻の索引は最初に使う時に1回だけ作る
+        if self._store is None:
+            self._store = PredStore(self.json)
+        return self._store
+
     @property
     def creds(self):
         return self._creds
+
+    @property
+    def metadata(self) -> Optional[Dict[str, Any]]:
+        return self._metadata
@@ -0,0 +1,174 @@
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Union
+
+from src.pred_store import PredStore
+from src.race_id import make_race_id
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledRace(NamedTuple):
+    """判断時刻の順に並べるレース"""
+
+    decision_at: datetime.datetime
+    seq: int
+    race_id: str
+    post_time: datetime.datetime
+    race: Dict[str, Any]
+
+
+class RaceScheduler:
+    """その日のレースを発走時刻前の判断時刻の順に取り出す
+
+    発走時刻は読み込み時に1回だけ解析し, 判断時刻(発走の lead_time 前)のヒープに積む.
+    待機は毎回時計から残り時間を計算するので処理時間によるずれが蓄積しない.
+    判断時刻を過ぎても発走の min_lead_time 前までなら取り出し, 1度取り出したレースは再度取り出さない.
+    """
+
+    def __init__(
+        self,
+        lead_time: datetime.timedelta = datetime.timedelta(minutes=7),
+        min_lead_time: datetime.timedelta = datetime.timedelta(minutes=2),
+        clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """コンストラクタ
+
+        Args:
+            lead_time (datetime.timedelta, optional): 発走の何分前に判断するか. Defaults to 7分.
+            min_lead_time (datetime.timedelta, optional): 判断時刻を過ぎたレースを
+                まだ処理できる発走までの最短時間. Defaults to 2分.
+            clock (Callable[[], datetime.datetime], optional): 現在時刻を返す関数. Defaults to datetime.datetime.now.
+            sleep (Callable[[float], None], optional): 指定秒数待つ関数. Defaults to time.sleep.
+        """
+        self._lead_time = lead_time
+        self._min_lead_time = min_lead_time
+        self._clock = clock
+        self._sleep = sleep
+        self._heap: List[ScheduledRace] = []
+        self._seq = itertools.count()
+        self._scheduled: Set[str] = set()
+        # 取り出したレースのIDと発走時刻
+        self._handled: Dict[str, datetime.datetime] = {}
+
+    def load(
+        self,
+        pred: Union[PredStore, Dict[str, Any]],
+        date: Optional[datetime.date] = None,
+    ) -> int:
+        """予測から指定日のレースを読み込む
+
+        すでに読み込んだレース, 処理済みのレース, 発走済みのレースは追加しない.
+
+        Args:
+            pred (Union[PredStore, Dict[str, Any]]): 予測の索引または予測JSON
+            date (datetime.date, optional): 対象日. Defaults to 今日.
+
+        Returns:
+            int: 新たに追加したレース数
+        """
+        store = pred if isinstance(pred, PredStore) else PredStore(pred)
+        now = self._clock()
+        if date is None:
+            date = now.date()
+        year = date.strftime("%y")
+        midnight = datetime.datetime.combine(date, datetime.time())
+
+        added = 0
+        for minutes, race in store.races_on(year, date.strftime("%m%d")):
+            race_id = make_race_id(
+                year, race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+            )
+            if race_id in self._scheduled or race_id in self._handled:
+                continue
+
+            post_time = midnight + datetime.timedelta(minutes=minutes)
+            if post_time <= now:
+                continue
+
+            heapq.heappush(
+                self._heap,
+                ScheduledRace(
+                    post_time - self._lead_time,
+                    next(self._seq),
+                    race_id,
+                    post_time,
+                    race,
+                ),
+            )
+            self._scheduled.add(race_id)
+            added += 1
+        return added
+
+    def pop_due(self) -> List[Dict[str, Any]]:
+        """判断時刻を迎えたレースを取り出す
+
+        Returns:
+            List[Dict[str, Any]]: 判断時刻を迎えたレース. 判断時刻の順
+        """
+        now = self._clock()
+        due = []
+        while self._heap and self._heap[0].decision_at <= now:
+            entry = heapq.heappop(self._heap)
+            self._scheduled.discard(entry.race_id)
+            self._handled[entry.race_id] = entry.post_time
+
+            if entry.post_time - now < self._min_lead_time:
+                logger.warning(
+                    "判断時刻を過ぎたためスキップします: %s (発走 %s)",
+                    entry.race_id,
+                    entry.post_time.strftime("%H:%M"),
+                )
+                continue
+            due.append(entry.race)
+        return due
+
+    def wait_next(
+        self, max_wait: Optional[datetime.timedelta] = None
+    ) -> List[Dict[str, Any]]:
+        """次の判断時刻まで待ってレースを取り出す
+
+        Args:
+            max_wait (datetime.timedelta, optional): 最大の待ち時間. Defaults to 次の判断時刻まで.
+
+        Returns:
+            List[Dict[str, Any]]: 判断時刻を迎えたレース. max_wait までに無ければ空
+        """
+        start = self._clock()
+        limit = start + max_wait if max_wait is not None else None
+        while True:
+            due = self.pop_due()
+            if due:
+                return due
+
+            deadline = self.next_decision_at
+            if deadline is None or (limit is not None and limit < deadline):
+                deadline = limit
+            if deadline is None:
+                return []
+
+            # sleepが早く戻っても次の判定で残りを待ち直す
+            remaining = (deadline - self._clock()).total_seconds()
+            if remaining > 0:
+                self._sleep(remaining)
+            elif deadline is limit:
+                return []
+
+    def post_time(self, race_id: str) -> Optional[datetime.datetime]:
+        """取り出したレースの発走時刻. 取り出していないレースはNone"""
+        return self._handled.get(race_id)
+
+    @property
+    def lead_time(self) -> datetime.timedelta:
+        return self._lead_time
+
+    @property
+    def next_decision_at(self) -> Optional[datetime.datetime]:
+        return self._heap[0].decision_at if self._heap else None
+
+    def __len__(self):
+        return len(self._heap)
@@ -1,47 +1,58 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Optional, Sequence
+
+import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.chrome import service as fs
-from selenium.common.exceptions import NoSuchElementException
-from selenium import webdriver
-from webdriver_manager.chrome import ChromeDriverManager
+import requests
+
+from src.odds_client import HttpOddsFetcher
+from src.odds_parser import (
+    API_ODDS_TYPES,
+    parse_tansyo_odds,
+    parse_tansyo_odds_api,
+    parse_ticket_odds_api,
+)
+from src.race_id import make_race_id
+from src.tracing import count, span
+
+if TYPE_CHECKING:
+    from src.driver_pool import ChromeDriverPool
+    from src.odds_recorder import OddsRecorder
+
+logger = logging.getLogger(__name__)
+
+# get_ticket_odds_by_race で取得する馬券種
+TICKET_BET_TYPES = ("umaren", "wide", "umatan", "sanrentan")
 
 
 class OddsScraper:
     """NetKeibaサイトから指定レースの単勝オッズをスクレイピングする"""
 
-    def __init__(self, base_url):
-        self._driver = self._set_driver()
-
-    def _set_driver(self):
-        options = webdriver.ChromeOptions()
-        options.add_argument("--headless")  # or use pyvirtualdiplay
-        options.add_argument("--no-sandbox")  # needed, because colab runs as root
-        options.add_argument("enable-automation")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--disable-extensions")
-        options.add_argument('--proxy-server="direct://"')
-        options.add_argument("--proxy-bypass-list=*")
-        options.add_argument("--blink-settings=imagesEnabled=false")
-        options.add_argument("--lang=ja")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument("--dns-prefetch-disable")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--log-level=3")
-        options.add_argument(
-            "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36"
-        )
-        options.add_experimental_option("excludeSwitches", ["enable-automation"])
-        options.add_experimental_option("useAutomationExtension", False)
-
-        # ドライバー指定でChromeブラウザを開く
-        chrome_service = fs.Service(ChromeDriverManager().install())
-
-        # open it, go to a website, and get results
-        driver = webdriver.Chrome(service=chrome_service, options=options)
-
-        return driver
+    def __init__(
+        self,
+        base_url: str,
+        driver_pool: Optional["ChromeDriverPool"] = None,
+        http_fetcher: Optional[HttpOddsFetcher] = None,
+        recorder: Optional["OddsRecorder"] = None,
+    ):
+        """コンストラクタ
+
+        Args:
+            base_url (str): オッズページのURL. race_id を付けてアクセスする
+            driver_pool (ChromeDriverPool, optional): 共有するドライバープール.
+                指定しない場合はブラウザが必要になった時にドライバー1つのプールを作る. Defaults to None.
+            http_fetcher (HttpOddsFetcher, optional): 指定した場合はまずHTTPで取得し,
+                失敗した時だけブラウザを使う. Defaults to None.
+            recorder (OddsRecorder, optional): 指定した場合は取得したオッズを記録する. Defaults to None.
+        """
+        self._base_url = base_url
+        self._owns_driver_pool = driver_pool is None
+        self._driver_pool = driver_pool
+        self._driver_pool_lock = threading.Lock()
+        self._http_fetcher = http_fetcher
+        self._recorder = recorder
 
     def get_odds_by_race(
         self, year: int, jyo: int, kaiji: int, nichiji: int, race_num: int
@@ -58,30 +69,133 @@ class OddsScraper:
         Returns:
             pd.Series: 該当レースの単勝オッズ
         """
-        self._driver.get(
-            "https://race.netkeiba.com/odds/index.html?type=b1&race_id={}{:02}{:02}{:02}{:02}".format(
-                year, jyo, kaiji, nichiji, race_num
-            )
-        )
-
-        html = self._driver.page_source.encode("utf-8")
-        soup = BeautifulSoup(html, "html.parser")
-
-        tracks = soup.find(class_="RaceOdds_HorseList Tanfuku", id="odds_fuku_block")
-        uma_kumi_list = []
-        odds_dict = {}
-        for track in tracks.select("[class='W31']"):
-            umaban1 = track.contents[0]
-            uma_kumi_list.append(umaban1)
-        for uma_kumi in uma_kumi_list:
-            id_ = "odds-1_{}".format(uma_kumi.zfill(2))
-            odds = soup.find("span", id=id_)
-            if odds is not None:
-                odds_num = float(odds.string)
-                # if odds_num < odds_threshold:
-                odds_dict[uma_kumi] = odds_num
-        return pd.Series(odds_dict)
+        race_id = make_race_id(year, jyo, kaiji, nichiji, race_num)
+        odds = self._get_odds(race_id)
+        if self._recorder is not None:
+            self._recorder.record(race_id, odds)
+        return odds
+
+    def get_ticket_odds_by_race(
+        self,
+        year: int,
+        jyo: int,
+        kaiji: int,
+        nichiji: int,
+        race_num: int,
+        bet_types: Sequence[str] = TICKET_BET_TYPES,
+    ) -> Dict[str, np.ndarray]:
+        """引数に該当するレースの馬券種ごとのオッズを馬番を添字とする配列で返す
+
+        馬券種ごとのオッズAPIを同じセッションから並行して取得し, 届いたものから
+        取得したスレッドで配列にする. 頭数は全馬券種で揃える.
+
+        Args:
+            year (int): 年
+            jyo (int): 競馬場
+            kaiji (int): 回次
+            nichiji (int): 日次
+            race_num (int): レース番組
+            bet_types (Sequence[str], optional): 馬券種. Defaults to 馬連, ワイド, 馬単, 三連単.
+
+        Returns:
+            Dict[str, np.ndarray]: 馬券種ごとの parse_ticket_odds_api のオッズの配列
+        """
+        if self._http_fetcher is None:
+            # 馬券種ごとのオッズ表はページ上でJavaScriptがAPIから埋めるので, APIから取得する
+            raise ValueError("馬券種ごとのオッズの取得には http_fetcher が必要です")
+        if not bet_types:
+            return {}
+        race_id = make_race_id(year, jyo, kaiji, nichiji, race_num)
+
+        def fetch(bet_type: str) -> np.ndarray:
+            with span("odds_fetch", source="api", bet_type=bet_type, race_id=race_id):
+                response = self._http_fetcher.fetch_odds_api(
+                    race_id, API_ODDS_TYPES[bet_type]
+                )
+            with span("odds_parse", source="api", bet_type=bet_type, race_id=race_id):
+                return parse_ticket_odds_api(response, bet_type)
+
+        with ThreadPoolExecutor(
+            max_workers=len(bet_types), thread_name_prefix="ticket_odds"
+        ) as executor:
+            matrices = dict(zip(bet_types, executor.map(fetch, bet_types)))
+
+        # 人気の無い馬の馬券が無い場合に備えて, 最も大きい配列に揃える
+        num_horses = max(matrix.shape[0] for matrix in matrices.values())
+        for bet_type, matrix in matrices.items():
+            if matrix.shape[0] < num_horses:
+                padding = [(0, num_horses - matrix.shape[0])] * matrix.ndim
+                matrices[bet_type] = np.pad(matrix, padding, constant_values=np.nan)
+        return matrices
+
+    def _get_odds(self, race_id: str) -> pd.Series:
+        if self._http_fetcher is not None:
+            try:
+                return self._get_odds_by_http(race_id)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                logger.warning(
+                    "HTTPでのオッズ取得に失敗. ブラウザで再取得します: %s", e
+                )
+                count("odds_browser_fallback")
+
+        return self._get_odds_by_browser(race_id)
+
+    def _get_odds_by_http(self, race_id: str) -> pd.Series:
+        """オッズAPI, オッズページの順にHTTPで単勝オッズを取得する"""
+        try:
+            with span("odds_fetch", source="api", race_id=race_id):
+                response = self._http_fetcher.fetch_odds_api(race_id)
+            with span("odds_parse", source="api", race_id=race_id):
+                return parse_tansyo_odds_api(response)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.info("オッズAPIからの取得に失敗. ページから取得します: %s", e)
+            count("odds_api_fallback")
+
+        with span("odds_fetch", source="page", race_id=race_id):
+            html = self._http_fetcher.fetch_odds_page(race_id)
+        with span("odds_parse", source="page", race_id=race_id):
+            odds = parse_tansyo_odds(html)
+        if odds.empty:
+            # ページ上でJavaScriptが埋める場合があるのでブラウザに任せる
+            raise ValueError("ページに単勝オッズがありません")
+        return odds
+
+    def _get_odds_by_browser(self, race_id: str) -> pd.Series:
+        """ブラウザでオッズページを開いて単勝オッズを取得する"""
+        url = "{}race_id={}".format(self._base_url, race_id)
+
+        # プールからドライバーを借りてページを取得
+        with self.driver_pool.driver() as driver:
+            with span("page_load", race_id=race_id):
+                driver.get(url)
+                html = driver.page_source.encode("utf-8")
+
+        with span("odds_parse", source="browser", race_id=race_id):
+            return parse_tansyo_odds(html)
+
+    def close(self):
+        """内部で作成したドライバープールを終了する"""
+        if self._owns_driver_pool and self._driver_pool is not None:
+            self._driver_pool.close()
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+    @property
+    def driver_pool(self) -> "ChromeDriverPool":
+        with self._driver_pool_lock:
+            if self._driver_pool is None:
+                # seleniumはブラウザを使う時まで読み込まない
+                from src.driver_pool import ChromeDriverPool
+
+                self._driver_pool = ChromeDriverPool(size=1)
+            return self._driver_pool
+
+    @property
+    def http_fetcher(self):
+        return self._http_fetcher
 
     @property
-    def driver(self):
-        return self._driver
+    def recorder(self):
+        return self._recorder
@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class CachedSolution(NamedTuple):
+    """1レース分の最適化結果"""
+
+    index: Tuple[str, ...]
+    pred: np.ndarray
+    odds: np.ndarray
+    budget: int
+    x: np.ndarray
+    bet: pd.Series
+    stored_at: float
+
+
+class SolutionCache:
+    """レースごとの最適化結果を保持し、ポーリングをまたいで再利用する
+
+    予測確率とオッズが前回と同一なら結果をそのまま返し,
+    わずかな変化なら前回の最適解を初期解として使えるようにする.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 1800.0,
+        tolerance: float = 0.05,
+        max_entries: int = 256,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """コンストラクタ
+
+        Args:
+            ttl (float, optional): 結果を保持する秒数. Defaults to 1800.0.
+            tolerance (float, optional): 初期解に使う予測確率・オッズの最大相対変化. Defaults to 0.05.
+            max_entries (int, optional): 保持するレース数の上限. Defaults to 256.
+            clock (Callable[[], float], optional): 現在時刻を返す関数. Defaults to time.monotonic.
+        """
+        self._ttl = ttl
+        self._tolerance = tolerance
+        self._max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[str, CachedSolution]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "warm_starts": 0,
+            "misses": 0,
+            "evictions": 0,
+            "cold_solves": 0,
+            "cold_iterations": 0,
+            "warm_solves": 0,
+            "warm_iterations": 0,
+        }
+
+    def lookup(
+        self,
+        race_id: str,
+        index: List[str],
+        pred: np.ndarray,
+        odds: np.ndarray,
+        budget: int,
+    ) -> Tuple[Optional[pd.Series], Optional[np.ndarray]]:
+        """前回の結果を探す
+
+        Args:
+            race_id (str): レースID
+            index (List[str]): 馬券のリスト
+            pred (np.ndarray): 予測確率
+            odds (np.ndarray): オッズ
+            budget (int): 投資予算
+
+        Returns:
+            Tuple[Optional[pd.Series], Optional[np.ndarray]]:
+                同一なら (前回の掛け金, None), わずかな変化なら (None, 初期解), それ以外は (None, None)
+        """
+        pred = np.asarray(pred, dtype=float)
+        odds = np.asarray(odds, dtype=float)
+        with self._lock:
+            self._evict_expired()
+            entry = self._entries.get(race_id)
+            if entry is None or entry.index != tuple(index) or entry.budget != budget:
+                self._stats["misses"] += 1
+                return None, None
+
+            self._entries.move_to_end(race_id)
+            if np.array_equal(entry.pred, pred) and np.array_equal(entry.odds, odds):
+                self._stats["hits"] += 1
+                return entry.bet.copy(), None
+
+            if (
+                self._relative_change(entry.pred, pred) <= self._tolerance
+                and self._relative_change(entry.odds, odds) <= self._tolerance
+            ):
+                self._stats["warm_starts"] += 1
+                return None, entry.x.copy()
+
+            self._stats["misses"] += 1
+            return None, None
+
+    def store(
+        self,
+        race_id: str,
+        index: List[str],
+        pred: np.ndarray,
+        odds: np.ndarray,
+        budget: int,
+        x: np.ndarray,
+        bet: pd.Series,
+        iterations: int,
+        warm_start: bool = False,
+    ):
+        """最適化結果を保持する
+
+        Args:
+            race_id (str): レースID
+            index (List[str]): 馬券のリスト
+            pred (np.ndarray): 予測確率
+            odds (np.ndarray): オッズ
+            budget (int): 投資予算
+            x (np.ndarray): 最適解
+            bet (pd.Series): 掛け金
+            iterations (int): 最適化の反復回数
+            warm_start (bool, optional): 前回の最適解から始めたか. Defaults to False.
+        """
+        entry = CachedSolution(
+            tuple(index),
+            np.array(pred, dtype=float),
+            np.array(odds, dtype=float),
+            budget,
+            np.array(x, dtype=float),
+            bet.copy(),
+            self._clock(),
+        )
+        kind = "warm" if warm_start else "cold"
+        with self._lock:
+            self._stats[f"{kind}_solves"] += 1
+            self._stats[f"{kind}_iterations"] += int(iterations)
+
+            self._entries[race_id] = entry
+            self._entries.move_to_end(race_id)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _evict_expired(self):
+        now = self._clock()
+        expired = [
+            race_id
+            for race_id, entry in self._entries.items()
+            if now - entry.stored_at > self._ttl
+        ]
+        for race_id in expired:
+            del self._entries[race_id]
+        self._stats["evictions"] += len(expired)
+
+    @staticmethod
+    def _relative_change(old: np.ndarray, new: np.ndarray) -> float:
+        if old.shape != new.shape:
+            return np.inf
+        scale = np.maximum(np.abs(old), 1e-12)
+        return float(np.max(np.abs(new - old) / scale, initial=0.0))
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def __len__(self):
+        return len(self._entries)
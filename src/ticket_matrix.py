@@ -0,0 +1,176 @@
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# 馬券種ごとの (着順の結果に使う頭数, 馬券に含む頭数, 順番を区別するか)
+_BET_TYPES = {
+    "tansyo": (1, 1, True),
+    "umaren": (2, 2, False),
+    "wide": (3, 2, False),
+    "umatan": (2, 2, True),
+    "sanrentan": (3, 3, True),
+}
+
+# 馬券ラベルの馬番の区切り文字
+_SEPARATOR = {True: ">", False: "-"}
+
+
+def bet_types() -> List[str]:
+    return list(_BET_TYPES)
+
+
+def _check_bet_type(bet_type: str):
+    if bet_type not in _BET_TYPES:
+        raise ValueError(f"対応していない馬券種です: {bet_type}")
+
+
+@lru_cache(maxsize=None)
+def _permutations(num_horses: int, k: int) -> np.ndarray:
+    """0..num_horses-1 から k 頭を選ぶ順列を辞書順に並べた (件数, k) の配列"""
+    grids = np.indices((num_horses,) * k).reshape(k, -1).T
+    distinct = np.ones(len(grids), dtype=bool)
+    for i in range(k):
+        for j in range(i + 1, k):
+            distinct &= grids[:, i] != grids[:, j]
+    return grids[distinct]
+
+
+@lru_cache(maxsize=None)
+def ticket_combinations(bet_type: str, num_horses: int) -> np.ndarray:
+    """馬券ごとの馬の位置 (件数, 馬券に含む頭数)"""
+    _check_bet_type(bet_type)
+    _, size, ordered = _BET_TYPES[bet_type]
+    tickets = _permutations(num_horses, size)
+    if not ordered:
+        tickets = tickets[np.all(np.diff(tickets, axis=1) > 0, axis=1)]
+    tickets.flags.writeable = False
+    return tickets
+
+
+@lru_cache(maxsize=None)
+def outcome_combinations(bet_type: str, num_horses: int) -> np.ndarray:
+    """着順の結果ごとの上位馬の位置 (件数, 着順の結果に使う頭数)"""
+    _check_bet_type(bet_type)
+    places, _, _ = _BET_TYPES[bet_type]
+    outcomes = _permutations(num_horses, places)
+    outcomes.flags.writeable = False
+    return outcomes
+
+
+def _ticket_index(bet_type: str, num_horses: int, horses: np.ndarray) -> np.ndarray:
+    """馬の位置の組 (件数, 馬券に含む頭数) から馬券の番号を計算する"""
+    _, size, ordered = _BET_TYPES[bet_type]
+    if not ordered:
+        horses = np.sort(horses, axis=1)
+
+    # 全順列の中での番号に変換してから、馬券の並びでの番号に引き直す
+    code = np.zeros(len(horses), dtype=np.int64)
+    for i in range(size):
+        code = code * num_horses + horses[:, i]
+    tickets = ticket_combinations(bet_type, num_horses)
+    ticket_code = np.zeros(len(tickets), dtype=np.int64)
+    for i in range(size):
+        ticket_code = ticket_code * num_horses + tickets[:, i]
+    return np.searchsorted(ticket_code, code)
+
+
+@lru_cache(maxsize=None)
+def hit_matrix(bet_type: str, num_horses: int) -> sp.csr_matrix:
+    """着順の結果 x 馬券 の的中行列. 的中する馬券のみ1になる
+
+    頭数ごとにキャッシュするので、戻り値は変更しないこと.
+
+    Args:
+        bet_type (str): 馬券種
+        num_horses (int): 出走頭数
+
+    Returns:
+        sp.csr_matrix: 的中行列
+    """
+    outcomes = outcome_combinations(bet_type, num_horses)
+    _, size, _ = _BET_TYPES[bet_type]
+
+    if bet_type == "wide":
+        # 3着以内の2頭の組はすべて的中
+        pairs = [outcomes[:, [0, 1]], outcomes[:, [0, 2]], outcomes[:, [1, 2]]]
+        rows = np.tile(np.arange(len(outcomes)), len(pairs))
+        cols = np.concatenate(
+            [_ticket_index(bet_type, num_horses, pair) for pair in pairs]
+        )
+    else:
+        rows = np.arange(len(outcomes))
+        cols = _ticket_index(bet_type, num_horses, outcomes[:, :size])
+
+    num_tickets = len(ticket_combinations(bet_type, num_horses))
+    return sp.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(len(outcomes), num_tickets)
+    )
+
+
+def ticket_labels(bet_type: str, umaban_list: List[str]) -> List[str]:
+    """馬券のラベル. 馬連・ワイドは "1-2", 馬単・三連単は "1>2>3" の形式
+
+    Args:
+        bet_type (str): 馬券種
+        umaban_list (List[str]): 出走馬番リスト
+
+    Returns:
+        List[str]: hit_matrix の列の並びに対応する馬券のラベル
+    """
+    _check_bet_type(bet_type)
+    _, _, ordered = _BET_TYPES[bet_type]
+    umaban = np.asarray([f"{u}" for u in umaban_list], dtype=object)
+    tickets = ticket_combinations(bet_type, len(umaban_list))
+    return [_SEPARATOR[ordered].join(row) for row in umaban[tickets]]
+
+
+def ticket_odds(
+    bet_type: str, odds_matrix: np.ndarray, umaban_list: List[str]
+) -> pd.Series:
+    """馬番を添字とする密なオッズの配列を馬券のラベルをindexとするオッズにする
+
+    Args:
+        bet_type (str): 馬券種
+        odds_matrix (np.ndarray): parse_ticket_odds_api のオッズの配列
+        umaban_list (List[str]): 出走馬番リスト
+
+    Returns:
+        pd.Series: ticket_labels の並びのうちオッズのある馬券のオッズ.
+            OptimizeTicketBettor.select_bet にそのまま渡せる
+    """
+    tickets = ticket_combinations(bet_type, len(umaban_list))
+    # 配列の添字は馬番 - 1. 配列の範囲外の馬番はオッズ無しとする
+    positions = np.asarray([int(u) - 1 for u in umaban_list], dtype=np.intp)
+    horses = positions[tickets]
+    inside = np.all(horses < odds_matrix.shape[0], axis=1)
+    values = np.full(len(tickets), np.nan)
+    values[inside] = odds_matrix[tuple(horses[inside].T)]
+
+    labels = np.asarray(ticket_labels(bet_type, umaban_list), dtype=object)
+    available = ~np.isnan(values)
+    return pd.Series(values[available], index=labels[available], dtype="float64")
+
+
+def outcome_probabilities(bet_type: str, win_prob: np.ndarray) -> np.ndarray:
+    """単勝予測確率から着順の結果ごとの確率をHarvilleの式で計算する
+
+    Args:
+        bet_type (str): 馬券種
+        win_prob (np.ndarray): 単勝予測確率
+
+    Returns:
+        np.ndarray: outcome_combinations の並びに対応する確率
+    """
+    win_prob = np.asarray(win_prob, dtype=float)
+    outcomes = outcome_combinations(bet_type, len(win_prob))
+
+    prob = np.ones(len(outcomes))
+    remaining = np.full(len(outcomes), win_prob.sum())
+    for i in range(outcomes.shape[1]):
+        horse_prob = win_prob[outcomes[:, i]]
+        prob *= horse_prob / np.where(remaining > 0, remaining, 1)
+        remaining = remaining - horse_prob
+    return prob
@@ -0,0 +1,326 @@
+import bisect
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# 処理段階ごとの所要時間のバケット (秒)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 通知時点の発走までの秒数のバケット
+BEFORE_POST_BUCKETS = (30, 60, 120, 180, 240, 300, 360, 420, 480, 600)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    text = ",".join(
+        '{}="{}"'.format(
+            key,
+            value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for key, value in labels
+    )
+    return "{" + text + "}"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class _Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """カウンター, ゲージ, ヒストグラムを保持してPrometheusのテキスト形式で出力する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 名前 -> (種類, 説明)
+        self._metrics: Dict[str, Tuple[str, str]] = {}
+        self._values: Dict[str, Dict[Labels, object]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+
+    def _register(self, name: str, kind: str, help: str):
+        registered = self._metrics.get(name)
+        if registered is None:
+            self._metrics[name] = (kind, help)
+            self._values[name] = {}
+        elif registered[0] != kind:
+            raise ValueError(f"{name} は {registered[0]} として登録されています")
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels):
+        """カウンターを増やす"""
+        with self._lock:
+            self._register(name, "counter", help)
+            key = _labels(labels)
+            self._values[name][key] = self._values[name].get(key, 0) + value
+
+    def set(self, name: str, value: float, help: str = "", **labels):
+        """ゲージの値を設定する"""
+        with self._lock:
+            self._register(name, "gauge", help)
+            self._values[name][_labels(labels)] = value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Sequence[float] = STAGE_BUCKETS,
+        help: str = "",
+        **labels,
+    ):
+        """ヒストグラムに値を加える"""
+        with self._lock:
+            self._register(name, "histogram", help)
+            self._buckets.setdefault(name, tuple(buckets))
+            key = _labels(labels)
+            histogram = self._values[name].get(key)
+            if histogram is None:
+                histogram = self._values[name][key] = _Histogram(self._buckets[name])
+            histogram.observe(value)
+
+    def get(self, name: str, **labels) -> Optional[float]:
+        """カウンター・ゲージの値. ヒストグラムは観測回数"""
+        with self._lock:
+            value = self._values.get(name, {}).get(_labels(labels))
+        if isinstance(value, _Histogram):
+            return value.count
+        return value
+
+    def render(self) -> str:
+        """Prometheusのテキスト形式にする"""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._metrics):
+                kind, help = self._metrics[name]
+                if help:
+                    lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in sorted(self._values[name].items()):
+                    if not isinstance(value, _Histogram):
+                        lines.append(
+                            f"{name}{_format_labels(labels)} {_format_value(value)}"
+                        )
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(
+                        value.buckets + (float("inf"),), value.counts
+                    ):
+                        cumulative += count
+                        bucket_labels = labels + (("le", _format_value(bound)),)
+                        lines.append(
+                            f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_sum{_format_labels(labels)} {_format_value(value.sum)}"
+                    )
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """テキスト形式のファイルに書き出す (node_exporter の textfile collector 用)
+
+        書きかけのファイルを読まれないように一時ファイルに書いてから置き換える.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+        """/metrics でテキスト形式を返すHTTPサーバーをバックグラウンドで起動する
+
+        Args:
+            port (int): ポート番号. 0なら空いているポート
+            host (str, optional): 待ち受けるアドレス. Defaults to "127.0.0.1".
+
+        Returns:
+            ThreadingHTTPServer: 起動したサーバー. shutdown() と server_close() で止める
+        """
+        # 起動時間を短くするため, サーバーを使う時だけ読み込む
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class Tracer:
+    """処理段階ごとの所要時間と件数を記録する
+
+    span() で囲んだ処理の秒数を段階ごとのヒストグラムに加え, 1行のJSONとしてログに出す.
+    例外で抜けた場合は段階ごとのエラー数も数える.
+    """
+
+    def __init__(
+        self,
+        registry: Optional[MetricsRegistry] = None,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        """コンストラクタ
+
+        Args:
+            registry (MetricsRegistry, optional): 記録先. Defaults to 新しいレジストリ.
+            clock (Callable[[], float], optional): 経過秒数を測る時計. Defaults to time.perf_counter.
+        """
+        self._registry = registry if registry is not None else MetricsRegistry()
+        self._clock = clock
+
+    @contextmanager
+    def span(self, stage: str, **fields) -> Iterator[Dict[str, object]]:
+        """with文で囲んだ処理の所要時間を記録する
+
+        Args:
+            stage (str): 処理段階の名前. ヒストグラムのラベルになる
+            **fields: ログにだけ出す項目 (レースIDなど)
+
+        Yields:
+            Dict[str, object]: ログに出す項目. 処理中に項目を追加できる
+        """
+        start = self._clock()
+        status = "ok"
+        try:
+            yield fields
+        except BaseException:
+            status = "error"
+            self._registry.inc(
+                "bet_notify_stage_errors_total",
+                help="処理段階ごとの例外の数",
+                stage=stage,
+            )
+            raise
+        finally:
+            seconds = self._clock() - start
+            self._registry.observe(
+                "bet_notify_stage_seconds",
+                seconds,
+                STAGE_BUCKETS,
+                help="処理段階ごとの所要時間 (秒)",
+                stage=stage,
+            )
+            # ログを出さない場合はJSONを作らない
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    json.dumps(
+                        {
+                            "event": "span",
+                            "stage": stage,
+                            "seconds": round(seconds, 6),
+                            "status": status,
+                            **fields,
+                        },
+                        ensure_ascii=False,
+                        default=str,
+                    )
+                )
+
+    def count(self, event: str, value: float = 1):
+        """出来事の件数を数える"""
+        self._registry.inc(
+            "bet_notify_events_total", value, help="出来事ごとの件数", event=event
+        )
+
+    def before_post(self, seconds: float):
+        """通知した時点の発走までの秒数を記録する"""
+        self._registry.set(
+            "bet_notify_seconds_before_post",
+            seconds,
+            help="最後に通知した時点の発走までの秒数",
+        )
+        self._registry.observe(
+            "bet_notify_seconds_before_post_at_notify",
+            seconds,
+            BEFORE_POST_BUCKETS,
+            help="通知した時点の発走までの秒数",
+        )
+
+    @property
+    def registry(self) -> MetricsRegistry:
+        return self._registry
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def set_tracer(tracer: Tracer) -> Tracer:
+    """既定のトレーサーを差し替え, 元のトレーサーを返す"""
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+def span(stage: str, **fields):
+    """既定のトレーサーの span"""
+    return _tracer.span(stage, **fields)
+
+
+def count(event: str, value: float = 1):
+    """既定のトレーサーの count"""
+    _tracer.count(event, value)
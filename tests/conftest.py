@@ -0,0 +1,163 @@
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+class OddsServer:
+    """記録済みのnetkeibaのページを返すローカルHTTPサーバ
+
+    api_responses に (race_id, type) ごとのオッズAPIのレスポンスを入れると記録の代わりに返す.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.connections = set()
+        self.fail_api = False
+        self.api_responses = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests.append(self)
+                server.connections.add(self.client_address)
+
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                race_id = query.get("race_id", [""])[0]
+                odds_type = query.get("type", ["1"])[0]
+                response = server.api_responses.get((race_id, odds_type))
+                if url.path == "/api/api_get_jra_odds.html" and response is not None:
+                    self._send(json.dumps(response).encode(), "application/json")
+                    return
+                if url.path == "/odds/index.html":
+                    path = DATA_DIR / f"odds_b1_{race_id}.html"
+                    content_type = "text/html"
+                elif url.path == "/api/api_get_jra_odds.html" and not server.fail_api:
+                    path = DATA_DIR / f"odds_api_b1_{race_id}.json"
+                    content_type = "application/json"
+                else:
+                    path = None
+
+                if path is None or not path.exists():
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self._send(path.read_bytes(), content_type)
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+
+@pytest.fixture
+def odds_server():
+    server = OddsServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+class NotifyServer:
+    """LINE Notifyの代わりに通知を受け取るローカルHTTPサーバ
+
+    responses に (ステータス, ヘッダ) を積むと順に返し, 無くなったら200を返す.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.authorizations = []
+        self.connections = set()
+        self.responses = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                server.connections.add(self.client_address)
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+
+                status, headers = (
+                    server.responses.pop(0) if server.responses else (200, {})
+                )
+                if status == 200:
+                    query = parse_qs(urlparse(self.path).query)
+                    server.messages.append(query["message"][0])
+                    server.authorizations.append(self.headers.get("Authorization"))
+
+                body = b'{"status": %d}' % status
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/api/notify"
+
+
+@pytest.fixture
+def notify_server():
+    server = NotifyServer()
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,117 @@
+"""テストとベンチマークで使う入力データを作る"""
+
+import itertools
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.odds_parser import API_ODDS_TYPES
+from src.pred_store import PredStore
+from src.race_id import make_race_id
+
+ROOT_DIR = Path(__file__).parent.parent
+
+# main の読み込み時には読み込まないモジュール
+HEAVY_MODULES = [
+    "pandas",
+    "numpy",
+    "scipy",
+    "selenium",
+    "webdriver_manager",
+    "googleapiclient",
+    "requests",
+]
+
+_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure_import(module: str = "main") -> Tuple[float, List[str]]:
+    """新しいプロセスで module を読み込む秒数と, 読み込まれた重いモジュール"""
+    output = subprocess.run(
+        [sys.executable, "-c", _SCRIPT.format(module=module)],
+        cwd=ROOT_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result = json.loads(output)
+    loaded = [name for name in HEAVY_MODULES if name in result["modules"]]
+    return result["seconds"], loaded
+
+
+def make_race(n: int, seed: int) -> Tuple[pd.Series, pd.Series]:
+    """n頭立てのレースの予測確率とオッズを作成する"""
+    rng = np.random.default_rng(seed)
+    pred = rng.dirichlet(np.ones(n))
+    odds = np.maximum(np.round(0.8 / pred * rng.uniform(0.7, 1.3, n), 1), 1.1)
+    index = [str(i + 1) for i in range(n)]
+    return pd.Series(pred, index=index), pd.Series(odds, index=index)
+
+
+def make_ticket_odds_response(
+    bet_type: str, num_horses: int, seed: int = 0, scratched: Iterable[int] = ()
+) -> Dict[str, Any]:
+    """馬券種ごとのオッズAPIと同じ形のレスポンスを作る
+
+    Args:
+        bet_type (str): 馬券種
+        num_horses (int): 頭数
+        seed (int, optional): 乱数のシード. Defaults to 0.
+        scratched (Iterable[int], optional): 取消馬の馬番. オッズを "0.0" にする. Defaults to ().
+
+    Returns:
+        Dict[str, Any]: 馬番を2桁ずつ並べたキーと [オッズ, オッズの上限, 人気] の値
+    """
+    rng = np.random.default_rng(seed)
+    size = {"tansyo": 1, "umaren": 2, "wide": 2, "umatan": 2, "sanrentan": 3}[bet_type]
+    if bet_type in ("umaren", "wide"):
+        tickets = list(itertools.combinations(range(1, num_horses + 1), size))
+    else:
+        tickets = list(itertools.permutations(range(1, num_horses + 1), size))
+    scratched = set(scratched)
+    odds = np.round(np.exp(rng.uniform(0, 8, len(tickets))) + 1, 1)
+    table = {}
+    for ticket, value in zip(tickets, odds):
+        text = "0.0" if scratched.intersection(ticket) else f"{value:.1f}"
+        upper = f"{value * 1.3:.1f}" if bet_type == "wide" else ""
+        table["".join(f"{u:02}" for u in ticket)] = [text, upper, "1"]
+    return {
+        "status": "middle",
+        "data": {"odds": {str(API_ODDS_TYPES[bet_type]): table}},
+    }
+
+
+def make_card(num_races: int, seed: int = 0) -> Tuple[PredStore, Dict[str, pd.Series]]:
+    """num_races レース, 3場の予測JSONとレースIDごとのオッズ"""
+    rng = np.random.default_rng(seed)
+    races = {}
+    odds = {}
+    for i in range(num_races):
+        n = int(rng.integers(8, 19))
+        pred, race_odds = make_race(n, seed + i)
+        race_time = 600 + i * 10
+        race = {
+            "JyoCD": f"{i % 3 + 5:02}",
+            "Kaiji": "02",
+            "Nichiji": "04",
+            "RaceNum": f"{i // 3 + 1:02}",
+            "pred": pred.to_dict(),
+        }
+        races[f"{race_time // 60:02}{race_time % 60:02}"] = race
+        race_id = make_race_id(
+            "23", race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+        )
+        # 予測と市場の見方がずれて期待値が1を超える馬を作る
+        odds[race_id] = race_odds * rng.uniform(0.7, 1.5, n)
+    return PredStore({"23": {"0505": races}}), odds
@@ -0,0 +1,89 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from src.allocation import allocate_bets
+
+
+def brute_force(fraction, odds, budget, rate, min_bet):
+    """全ての掛け金の組を調べて二乗誤差が最小の配分を返す"""
+    max_units = budget // 100
+    target = fraction * budget / 100
+    best_cost, best = np.sum(target**2), np.zeros(len(fraction))
+    for units in itertools.product(range(max_units + 1), repeat=len(fraction)):
+        units = np.array(units)
+        total = units.sum()
+        if total > max_units:
+            continue
+        on = units > 0
+        if np.any(on & (units * 100 < min_bet)) or np.any(
+            on & (units * odds < rate * total)
+        ):
+            continue
+        cost = np.sum((units - target) ** 2)
+        if cost < best_cost - 1e-12:
+            best_cost, best = cost, units
+    return best * 100
+
+
+def assert_feasible(bet, odds, budget, rate, min_bet):
+    on = bet > 0
+    assert bet.sum() <= budget
+    assert np.all(bet % 100 == 0)
+    assert np.all(bet[on] >= min_bet)
+    assert np.all(bet[on] * odds[on] >= rate * bet.sum())
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_same_as_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 5))
+    fraction = rng.dirichlet(np.ones(n + 1))[:n]
+    odds = np.round(rng.uniform(1.1, 12, n), 1)
+    budget = int(rng.integers(1, 9)) * 100
+    rate = float(rng.choice([1.0, 1.1, 1.5]))
+    min_bet = int(rng.choice([100, 200]))
+
+    bet = allocate_bets(fraction, odds, budget, rate, min_bet)
+
+    assert_feasible(bet, odds, budget, rate, min_bet)
+    target = fraction * budget / 100
+    expected = brute_force(fraction, odds, budget, rate, min_bet)
+    assert np.sum((bet / 100 - target) ** 2) == pytest.approx(
+        np.sum((expected / 100 - target) ** 2)
+    )
+
+
+def test_rounding_breaks_profit_target():
+    """丸めると目標回収率を下回る馬券の掛け金を調整する"""
+    fraction = np.array([0.36, 0.34, 0.3])
+    odds = np.array([3.0, 3.4, 3.6])
+    # 丸めると 400, 300, 300 で, 300円の馬券は的中しても払戻が 1020円 < 1.1 x 1000円
+    bet = allocate_bets(fraction, odds, 1000, exceed_profit_rate=1.1)
+
+    assert_feasible(bet, odds, 1000, 1.1, 100)
+    assert bet.sum() > 0
+
+
+def test_no_bet():
+    assert np.all(allocate_bets(np.zeros(3), np.array([2.0, 3.0, 4.0]), 1000) == 0)
+    # 予算が100円未満なら買わない
+    assert np.all(allocate_bets(np.array([1.0]), np.array([2.0]), 50) == 0)
+
+
+def test_min_bet():
+    bet = allocate_bets(np.array([0.15, 0.8]), np.array([20.0, 1.5]), 1000, 1.0, 300)
+    assert_feasible(bet, np.array([20.0, 1.5]), 1000, 1.0, 300)
+    assert bet[0] in (0, 300)
+
+
+@pytest.mark.parametrize("budget", [10000, 30000])
+def test_large_budget(budget):
+    rng = np.random.default_rng(0)
+    fraction = rng.dirichlet(np.ones(9))[:8]
+    odds = np.maximum(np.round(0.8 / rng.dirichlet(np.ones(8)), 1), 1.1)
+
+    bet = allocate_bets(fraction, odds, budget, exceed_profit_rate=1.1)
+
+    assert_feasible(bet, odds, budget, 1.1, 100)
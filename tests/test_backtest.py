@@ -0,0 +1,254 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.backtest import (
+    BacktestRace,
+    BacktestReport,
+    Backtester,
+    RaceResult,
+    build_backtest_races,
+    load_odds_csv,
+    load_results_csv,
+    run_races,
+)
+from src.bettor import Bettor
+from src.portfolio import DayPortfolio
+from src.pred_archive import PredArchive, write_pred_archive
+
+
+class FavoriteBettor(Bettor):
+    """予測確率が最大の馬に amount 円賭ける. プロセスをまたぐのでモジュールの直下に置く"""
+
+    def __init__(self, amount: int = 100):
+        self._amount = amount
+
+    def select_bet(self, pred, odds, race_id=None):
+        return pd.Series([self._amount], index=[pred.idxmax()])
+
+
+pred_json = {
+    "23": {
+        "0514": {
+            "1540": {
+                "JyoCD": "05",
+                "Kaiji": "02",
+                "Nichiji": "08",
+                "RaceNum": "11",
+                "pred": {"1": 0.6, "2": 0.4},
+            },
+            "1010": {
+                "JyoCD": "08",
+                "Kaiji": "03",
+                "Nichiji": "02",
+                "RaceNum": "03",
+                "pred": {"1": 0.3, "2": 0.7},
+            },
+        },
+        "0513": {
+            "1000": {
+                "JyoCD": "05",
+                "Kaiji": "02",
+                "Nichiji": "07",
+                "RaceNum": "01",
+                "pred": {"3": 0.9, "4": 0.1},
+            }
+        },
+    }
+}
+
+
+@pytest.fixture
+def csv_paths(tmp_path):
+    odds_path = tmp_path / "odds.csv"
+    odds_path.write_text(
+        "race_id,umaban,odds\n"
+        "2305020811,1,1.5\n"
+        "2305020811,2,2.5\n"
+        "2308030203,1,3.0\n"
+        "2308030203,2,1.4\n"
+        "2305020701,3,1.1\n"
+        "2305020701,4,8.0\n"
+    )
+    results_path = tmp_path / "results.csv"
+    results_path.write_text(
+        "race_id,ticket,payout\n"
+        "2305020811,2,250\n"
+        "2308030203,2,140\n"
+        "2305020701,3,110\n"
+    )
+    return odds_path, results_path
+
+
+def test_load_csv(csv_paths):
+    odds = load_odds_csv(csv_paths[0])
+    assert odds["2305020811"] == {"1": 1.5, "2": 2.5}
+    results = load_results_csv(csv_paths[1])
+    assert results["2308030203"] == {"2": 140.0}
+
+
+def test_build_backtest_races(csv_paths):
+    odds = load_odds_csv(csv_paths[0])
+    results = load_results_csv(csv_paths[1])
+    races = build_backtest_races(pred_json, odds, results)
+
+    # 日付・発走時刻の順
+    assert [race.race_id for race in races] == [
+        "2305020701",
+        "2308030203",
+        "2305020811",
+    ]
+    assert races[1].minutes == 610
+    assert races[1].track == "08"
+
+    # オッズか結果の無いレースは除く
+    del odds["2305020811"]
+    assert len(build_backtest_races(pred_json, odds, results)) == 2
+
+
+def test_build_backtest_races_from_archive(tmp_path, csv_paths):
+    write_pred_archive(pred_json, tmp_path / "archive")
+    odds = load_odds_csv(csv_paths[0])
+    results = load_results_csv(csv_paths[1])
+    from_archive = build_backtest_races(
+        PredArchive(tmp_path / "archive"), odds, results
+    )
+    from_json = build_backtest_races(pred_json, odds, results)
+    assert from_archive == from_json
+
+
+def test_run_races(csv_paths):
+    races = build_backtest_races(
+        pred_json, load_odds_csv(csv_paths[0]), load_results_csv(csv_paths[1])
+    )
+    results = run_races(FavoriteBettor, races)
+    assert [(result.stake, result.payout, result.hit) for result in results] == [
+        (100, 110.0, True),
+        (100, 140.0, True),
+        (100, 0.0, False),
+    ]
+
+
+def make_result(date, minutes, stake, payout, track="05"):
+    return RaceResult(
+        f"{date}{minutes}", date, minutes, track, stake, payout, payout > 0
+    )
+
+
+def test_report_summary():
+    report = BacktestReport(
+        [
+            make_result("230514", 600, 1000, 0.0),
+            make_result("230513", 600, 1000, 1500.0),
+            make_result("230514", 700, 0, 0.0, track="08"),
+            make_result("230514", 800, 1000, 0.0, track="08"),
+            make_result("230515", 600, 1000, 2500.0, track="08"),
+        ]
+    )
+    # 日付・発走時刻の順に並べる
+    assert list(report.results["date"]) == [
+        "230513",
+        "230514",
+        "230514",
+        "230514",
+        "230515",
+    ]
+
+    summary = report.summary()
+    assert summary["races"] == 5
+    assert summary["bet_races"] == 4
+    assert summary["stake"] == 4000
+    assert summary["payout"] == 4000
+    assert summary["profit"] == 0
+    assert summary["roi"] == pytest.approx(1.0)
+    assert summary["hit_rate"] == pytest.approx(0.5)
+    # 累積収支 500, -500, -500, -1500, 0 で最高値 500 からの下落
+    assert summary["max_drawdown"] == 2000
+
+    by_track = report.by_track()
+    assert list(by_track.index) == ["05", "08"]
+    assert by_track.loc["08", "bet_races"] == 2
+    assert by_track.loc["08", "roi"] == pytest.approx(1.25)
+
+
+def test_report_drawdown_from_start():
+    """開始直後から負けた場合は0からの下落をドローダウンとする"""
+    report = BacktestReport(
+        [make_result("230513", 600, 1000, 0.0), make_result("230513", 700, 500, 0.0)]
+    )
+    assert report.summary()["max_drawdown"] == 1500
+
+
+def test_report_no_bet():
+    summary = BacktestReport([make_result("230513", 600, 0, 0.0)]).summary()
+    assert np.isnan(summary["roi"])
+    assert np.isnan(summary["hit_rate"])
+    assert summary["max_drawdown"] == 0
+
+
+def make_races(num_races, seed=0, payout_rate=0.8, races_per_day=5):
+    rng = np.random.default_rng(seed)
+    races = []
+    for i in range(num_races):
+        pred = rng.dirichlet(np.ones(4))
+        odds = np.round(payout_rate / pred, 1)
+        winner = str(rng.choice(4, p=pred) + 1)
+        races.append(
+            BacktestRace(
+                f"race{i:04}",
+                f"2305{10 + i // races_per_day}",
+                i,
+                f"{i % 3 + 1:02}",
+                {str(u + 1): float(p) for u, p in enumerate(pred)},
+                {str(u + 1): float(o) for u, o in enumerate(odds)},
+                {winner: float(odds[int(winner) - 1] * 100)},
+            )
+        )
+    return races
+
+
+def test_backtester_parallel():
+    """プロセスプールで実行しても1プロセスと同じ結果になる"""
+    races = make_races(30)
+    inline = Backtester(FavoriteBettor, max_workers=1, chunk_size=7).run(races)
+    parallel = Backtester(FavoriteBettor, max_workers=2, chunk_size=7).run(races)
+    pd.testing.assert_frame_equal(inline.results, parallel.results)
+    assert len(parallel.results) == 30
+
+
+def test_backtester_day_portfolio():
+    """DayPortfolio は日ごとに1日の資金の範囲で賭ける. 1日のレースはチャンクに分けない"""
+    races = make_races(10, payout_rate=1.5)
+    report = Backtester(DayPortfolio, max_workers=1, chunk_size=2).run(races)
+
+    stake_by_day = report.results.groupby("date")["stake"].sum()
+    assert len(stake_by_day) == 2
+    assert ((stake_by_day > 0) & (stake_by_day <= 10000)).all()
+    assert list(report.results["stake"]) == [
+        result.stake for result in run_races(DayPortfolio, races)
+    ]
+
+
+def test_sweep():
+    races = make_races(10)
+    result = Backtester(max_workers=2, chunk_size=4).sweep(
+        races, {"amount": [100, 300]}, bettor_class=FavoriteBettor
+    )
+    assert list(result["amount"]) == [100, 300]
+    assert list(result["races"]) == [10, 10]
+    # 掛け金を3倍にすると収支も3倍になる
+    assert result["profit"][1] == pytest.approx(result["profit"][0] * 3)
+    assert result["roi"][1] == pytest.approx(result["roi"][0])
+
+
+def test_sweep_optimize_bettor():
+    races = make_races(4)
+    result = Backtester(max_workers=1).sweep(
+        races,
+        {"pred_threshold": [0, 0.2], "exceed_profit_rate": [1.0, 1.1]},
+        budget=1000,
+        odds_threshold=1.0,
+    )
+    assert len(result) == 4
+    assert list(result.columns[:2]) == ["pred_threshold", "exceed_profit_rate"]
+    assert (result["stake"] <= 4 * 1000).all()
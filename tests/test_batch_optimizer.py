@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+import scipy.optimize as sco
+
+from src.batch_optimizer import (
+    _project_simplex,
+    sharpe_objective_batch,
+    solve_sharpe_batch,
+)
+from src.bettor import OptimizeTansyoBettor
+
+
+def test_project_simplex():
+    values = np.array([[0.5, 0.5, 0.5], [2.0, 0.0, -1.0], [0.2, 0.3, 9.0]])
+    mask = np.array([[True, True, True], [True, True, True], [True, True, False]])
+    result = _project_simplex(values, mask)
+
+    assert np.allclose(result.sum(axis=1), 1)
+    assert np.allclose(result[0], [1 / 3, 1 / 3, 1 / 3])
+    assert np.allclose(result[1], [1, 0, 0])
+    # マスクした要素は0になる
+    assert np.allclose(result[2], [0.45, 0.55, 0])
+
+
+def test_objective_matches_single_race():
+    """パディングしても1レースずつ計算した値と一致するか"""
+    rng = np.random.default_rng(0)
+    pred_odds = rng.normal(size=(2, 4, 4))
+    mask = np.array([[True] * 4, [True, True, True, False]])
+    pred_odds[1, 3, :] = 0
+    pred_odds[1, :, 3] = 0
+    weights = rng.uniform(size=(2, 4)) * mask
+
+    loss, grad = sharpe_objective_batch(weights, pred_odds, mask)
+
+    for i, n in enumerate([4, 3]):
+        returns = pred_odds[i, :n, :n] @ weights[i, :n]
+        expected = -returns.mean() / returns.std(ddof=1)
+        assert loss[i] == pytest.approx(expected)
+    assert np.all(grad[1, 3:] == 0)
+
+
+def test_solve_matches_slsqp():
+    """SLSQPで1レースずつ解いた目的関数の値と一致するか"""
+    rng = np.random.default_rng(0)
+    num_races, num_horses = 20, 10
+    pred = rng.dirichlet(np.ones(num_horses), size=num_races)
+    odds = np.maximum(0.8 / pred * rng.uniform(0.7, 1.3, pred.shape), 1.1)
+    pred_odds = pred[:, :, np.newaxis] * (
+        np.eye(num_horses) * odds[:, np.newaxis, :] - 1
+    )
+    mask = np.ones((num_races, num_horses), dtype=bool)
+
+    weights, converged, loss = solve_sharpe_batch(pred_odds, mask, mask)
+
+    assert converged.all()
+    assert np.allclose(weights.sum(axis=1), 1)
+    for i in range(num_races):
+        expected = sco.minimize(
+            OptimizeTansyoBettor._objective,
+            np.ones(num_horses) / num_horses,
+            args=(pred_odds[i],),
+            jac=True,
+            method="SLSQP",
+            bounds=[(0, 1)] * num_horses,
+            constraints=[{"type": "ineq", "fun": lambda x: 1 - x.sum()}],
+        )
+        assert loss[i] <= expected["fun"] + 1e-6
+
+
+def test_single_ticket_is_not_solved():
+    pred_odds = np.array([[[0.5]]])
+    mask = np.ones((1, 1), dtype=bool)
+    _, converged, _ = solve_sharpe_batch(pred_odds, mask, mask)
+    assert not converged[0]
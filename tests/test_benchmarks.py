@@ -0,0 +1,144 @@
+import json
+
+import pytest
+
+from benchmarks import run as benchmark_run
+from benchmarks.run import Regression, compare, direction
+
+
+def test_direction():
+    assert direction("bench_bettor/n05/select_bet/seconds") == -1
+    assert direction("bench_pred_loader/1day/json_load/peak_mb") == -1
+    assert direction("bench_backtest/pool/races_per_minute") == 1
+    # 入力の大きさは比較しない
+    assert direction("bench_pred_loader/1day/size_mb") is None
+
+
+def test_compare():
+    baseline = {
+        "a/seconds": 1.0,
+        "b/seconds": 1.0,
+        "c/races_per_minute": 100.0,
+        "d/races_per_minute": 100.0,
+        "e/size_mb": 1.0,
+    }
+    results = {
+        "a/seconds": 1.2,
+        "b/seconds": 1.5,
+        "c/races_per_minute": 50.0,
+        "d/races_per_minute": 200.0,
+        "e/size_mb": 10.0,
+        # ベースラインに無い指標は比較しない
+        "f/seconds": 100.0,
+    }
+    assert compare(results, baseline, 0.25) == [
+        Regression("b/seconds", 1.0, 1.5, 0.5),
+        Regression("c/races_per_minute", 100.0, 50.0, 0.5),
+    ]
+    assert compare(results, baseline, 0.6) == []
+
+
+def test_compare_noise_floor():
+    """10ms未満の差は割合が大きくても比較しない"""
+    baseline = {"fast/seconds": 0.004, "slow/seconds": 0.04}
+    results = {"fast/seconds": 0.008, "slow/seconds": 0.06}
+    assert compare(results, baseline, 0.25) == [
+        Regression("slow/seconds", 0.04, 0.06, pytest.approx(0.5))
+    ]
+    assert len(compare(results, baseline, 0.25, min_seconds=0)) == 2
+
+    # 件数の指標は1件あたりの秒数で比べる. 1.7ms -> 2.5ms は10ms未満の差
+    baseline = {"select/races_per_minute": 35000.0, "batch/races_per_minute": 600.0}
+    results = {"select/races_per_minute": 24000.0, "batch/races_per_minute": 400.0}
+    assert [regression.name for regression in compare(results, baseline, 0.25)] == [
+        "batch/races_per_minute"
+    ]
+
+
+def test_run_benchmarks_best_of(monkeypatch):
+    """繰り返した結果は指標ごとに最も良い値を使う"""
+    values = iter([(2.0, 100.0, 5.0), (1.0, 300.0, 7.0), (1.5, 200.0, 6.0)])
+
+    class FakeModule:
+        @staticmethod
+        def run():
+            seconds, per_minute, size = next(values)
+            return {"seconds": seconds, "races_per_minute": per_minute, "size_mb": size}
+
+    monkeypatch.setattr(
+        benchmark_run.importlib, "import_module", lambda name: FakeModule
+    )
+    assert benchmark_run.run_benchmarks(["bench_fake"], repeat=3) == {
+        "bench_fake/seconds": 1.0,
+        "bench_fake/races_per_minute": 300.0,
+        # 比較しない指標は最後の値
+        "bench_fake/size_mb": 6.0,
+    }
+
+
+@pytest.fixture
+def fake_benchmark(monkeypatch):
+    """ベンチマークの代わりに指定した値を返す"""
+    values = {"value": 1.0, "sequence": [], "calls": []}
+
+    def run_benchmarks(names, repeat=1, previous=None):
+        values["calls"].append(list(names))
+        value = values["sequence"].pop(0) if values["sequence"] else values["value"]
+        results = dict(previous or {})
+        for name in names:
+            key = f"{name}/seconds"
+            results[key] = min(results.get(key, value), value)
+        return results
+
+    monkeypatch.setattr(benchmark_run, "run_benchmarks", run_benchmarks)
+    return values
+
+
+def test_main(tmp_path, fake_benchmark):
+    output = tmp_path / "results.json"
+    baseline = tmp_path / "baseline.json"
+    args = ["bench_bettor", "--output", str(output), "--baseline", str(baseline)]
+
+    # ベースラインが無ければ比較できないので失敗する
+    assert benchmark_run.main(args) == 2
+    assert json.loads(output.read_text())["results"] == {"bench_bettor/seconds": 1.0}
+
+    assert benchmark_run.main(args + ["--update-baseline"]) == 0
+    fake_benchmark["value"] = 1.1
+    assert benchmark_run.main(args) == 0
+    fake_benchmark["value"] = 2.0
+    assert benchmark_run.main(args) == 1
+    assert benchmark_run.main(args + ["--threshold", "1.5"]) == 0
+
+
+def test_main_retries(tmp_path, fake_benchmark):
+    """悪化した指標のベンチマークだけを計測し直して判定する"""
+    output = tmp_path / "results.json"
+    baseline = tmp_path / "baseline.json"
+    args = ["--output", str(output), "--baseline", str(baseline)]
+    assert benchmark_run.main(["--update-baseline"] + args) == 0
+
+    # 1回目だけ遅い場合は計測し直した値で判定する
+    fake_benchmark["calls"].clear()
+    fake_benchmark["sequence"] = [2.0]
+    assert benchmark_run.main(args) == 0
+    assert len(fake_benchmark["calls"]) == 2
+    assert fake_benchmark["calls"][1] == sorted(benchmark_run.BENCHMARKS)
+
+    # 遅いままなら --retries 回計測し直してから失敗する
+    fake_benchmark["calls"].clear()
+    fake_benchmark["value"] = 2.0
+    assert benchmark_run.main(args + ["--retries", "1"]) == 1
+    assert len(fake_benchmark["calls"]) == 2
+
+
+def test_baseline_committed():
+    """リポジトリのベースラインに全ベンチマークの指標がある"""
+    baseline = benchmark_run.load_results(benchmark_run.DEFAULT_BASELINE)
+    prefixes = {name.split("/")[0] for name in baseline}
+    assert prefixes == set(benchmark_run.BENCHMARKS)
+
+
+def test_unknown_benchmark():
+    with pytest.raises(SystemExit):
+        benchmark_run.main(["bench_unknown"])
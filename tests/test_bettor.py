@@ -1,8 +1,31 @@
+import tracemalloc
+
 import numpy as np
 import pandas as pd
 import pytest
+import scipy.optimize as sco
+
+from tests.helpers import make_race
+from src.bettor import (
+    KellyTansyoBettor,
+    OptimizeSanrentanBettor,
+    OptimizeTansyoBettor,
+    OptimizeTicketBettor,
+    OptimizeUmarenBettor,
+    OptimizeUmatanBettor,
+    OptimizeWideBettor,
+)
+from src.solution_cache import SolutionCache
+from src.ticket_matrix import (
+    hit_matrix,
+    outcome_probabilities,
+    ticket_combinations,
+    ticket_labels,
+    ticket_odds,
+)
 
-from src.bettor import OptimizeTansyoBettor
+# 18頭立ての select_bet 1回で確保するメモリの上限. SLSQPの作業領域が大半を占める
+SELECT_BET_PEAK_BYTES = 80_000
 
 
 # クラス初期化のためのフィクスチャ
@@ -39,14 +62,361 @@ def test_correct_not_exceed_bet(bettor):
     assert np.all(np.equal(result["bet"].values, np.array([0, 500, 500])))
 
 
-def test_optimize(bettor):
-    # odds, predictions などのモックデータを準備
-    # _optimize メソッドを呼び出し
-    # メソッドの期待される動作に基づいてアサーションを行う
+def test_correct_not_exceed_bet_array(bettor):
+    bet = np.array([100.0, 500.0, 400.0])
+    result = bettor._correct_not_exceed_bet_array(bet, np.array([2.0, 3.0, 1.0]), 1000)
 
+    assert np.array_equal(result, [0, 500, 500])
+    # 元の配列は変更しない
+    assert np.array_equal(bet, [100, 500, 400])
+
+
+def test_optimize(bettor):
+    odds = pd.Series([2.0, 3.0], index=["1", "2"])
     result = bettor.select_bet(
         pred=pd.Series([0.1, 0.5], index=["1", "2"]),
-        odds=pd.Series([2.0, 3.0], index=["1", "2"]),
+        odds=odds,
+    )
+
+    assert list(result.index) == ["1", "2", "not_bet"]
+    assert result.sum() == 1000, "掛け金の合計は予算と一致するべきです"
+    assert (result % 100 == 0).all(), "掛け金は100円単位であるべきです"
+    assert (result >= 0).all()
+
+    # どちらが的中しても予算の exceed_profit_rate 倍以上の払い戻しになる
+    assert list(result[["1", "2"]]) == [600, 400]
+    assert ((result[["1", "2"]] * odds) >= 1000 * 1.1).all()
+
+
+def finite_difference_bet(bettor, pred, odds, budget=1000):
+    """勾配を差分近似していた従来の目的関数で最適化した掛け金"""
+
+    def problem_func(weights, odds_matrix, pred):
+        return -(pred * np.dot(odds_matrix, weights)).mean() / np.sqrt(
+            np.cov(pred * np.dot(odds_matrix, weights))
+        )
+
+    index = list(pred.index)
+    odds_matrix = bettor._generate_odds_matrix(odds.values, index, index) - 1
+    x0 = np.ones(len(index) + 1) / (len(index) + 1)
+    opts = sco.minimize(
+        fun=problem_func,
+        x0=x0,
+        args=(odds_matrix, pred.values),
+        method="SLSQP",
+        bounds=[(0, 1)] * len(x0),
+        constraints=[{"type": "ineq", "fun": lambda x: -np.sum(x) + 1}],
+    )
+    return np.round(opts["x"] * budget / 100) * 100
+
+
+def test_objective_gradient(bettor):
+    """解析的な勾配が差分近似と一致するか"""
+    pred, odds = make_race(12, 0)
+    index = list(pred.index)
+    odds_matrix = bettor._generate_odds_matrix(odds.values, index, index) - 1
+    pred_odds_matrix = pred.values[:, np.newaxis] * odds_matrix
+
+    weights = np.random.default_rng(0).uniform(0, 0.2, len(index) + 1)
+    error = sco.check_grad(
+        lambda w: bettor._objective(w, pred_odds_matrix)[0],
+        lambda w: bettor._objective(w, pred_odds_matrix)[1],
+        weights,
+    )
+    assert error < 1e-6
+
+
+@pytest.mark.parametrize("n", [5, 8, 12, 18])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_same_allocation_as_finite_difference(bettor, n, seed):
+    """解析的な勾配を使っても従来と同じ配分になるか"""
+    pred, odds = make_race(n, seed)
+    index = list(pred.index)
+
+    bet = bettor.select_bet(pred, odds)
+    expected = finite_difference_bet(bettor, pred, odds)
+    expected = bettor._correct_not_exceed_bet(
+        pd.DataFrame(
+            {"bet": expected, "odds": list(odds.values) + [1.0]},
+            index=index + ["not_bet"],
+        ),
+        1000,
+    )["bet"]
+
+    # 見送る金額は丸めずに予算の残りにする
+    assert np.array_equal(bet.values[:-1], expected.values[:-1])
+    assert bet.sum() == 1000
+
+
+def test_select_bet_profit_target():
+    """買う馬券はどれも的中時の払戻が合計掛け金の目標回収率倍以上"""
+    for n, seed in [(8, 0), (12, 1), (18, 2)]:
+        pred, odds = make_race(n, seed)
+        bettor = OptimizeTansyoBettor(budget=10000, exceed_profit_rate=1.2)
+
+        bet = bettor.select_bet(pred, odds)
+
+        tickets = bet.drop("not_bet")
+        on = tickets > 0
+        assert bet.sum() == 10000
+        assert np.all(tickets[on] * odds[tickets.index][on] >= 1.2 * tickets.sum())
+
+
+def test_select_bet_missing_odds(bettor):
+    """オッズが無い馬 (取消など) は対象にしない"""
+    pred = pd.Series([0.1, 0.5, 0.4], index=["1", "2", "3"])
+    odds = pd.Series([2.0, 3.0], index=["1", "2"])
+
+    bet = bettor.select_bet(pred, odds)
+
+    assert list(bet.index) == ["1", "2", "not_bet"]
+    assert bet.name == "bet"
+    assert bet.dtype == int
+
+
+def test_select_bet_single_runner(bettor):
+    """対象が1頭だけなら分散が定義できないので見送る"""
+    pred = pd.Series([0.9, 0.1], index=["1", "2"])
+    odds = pd.Series([1.5], index=["1"])
+
+    with np.errstate(all="raise"):
+        bet = bettor.select_bet(pred, odds)
+
+    assert bet.to_dict() == {"1": 0, "not_bet": 1000}
+    assert bet.name == "bet"
+
+
+def test_select_bet_allocation(bettor):
+    """select_bet で確保するメモリが上限以内か"""
+    pred, odds = make_race(18, 0)
+    bettor.select_bet(pred, odds)
+
+    tracemalloc.start()
+    try:
+        bettor.select_bet(pred, odds)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < SELECT_BET_PEAK_BYTES
+
+
+def test_select_bets(bettor):
+    """まとめて最適化した結果がレースごとの最適化と同等か"""
+    races = [make_race(n, seed) for seed, n in enumerate([5, 8, 12, 18, 8, 16])]
+    preds = [pred for pred, _ in races]
+    odds = [race_odds for _, race_odds in races]
+
+    bets = bettor.select_bets(preds, odds)
+
+    assert len(bets) == len(races)
+    for (pred, race_odds), bet in zip(races, bets):
+        index = list(pred.index)
+        assert list(bet.index) == index + ["not_bet"]
+        assert bet.dtype == int
+        assert bet.sum() <= bettor._budget + 50 * len(index)
+
+        # 目的関数の値が select_bet と同等以上か
+        odds_matrix = bettor._generate_odds_matrix(race_odds.values, index, index) - 1
+        pred_odds_matrix = pred.values[:, np.newaxis] * odds_matrix
+        single = bettor.select_bet(pred, race_odds)
+        if single.drop("not_bet").sum() > 0 and bet.drop("not_bet").sum() > 0:
+            loss_single, _ = bettor._objective(single.values, pred_odds_matrix)
+            loss_batch, _ = bettor._objective(bet.values, pred_odds_matrix)
+            assert loss_batch <= loss_single + 0.05
+
+
+def test_select_bets_threshold():
+    bettor = OptimizeTansyoBettor(pred_threshold=0.2)
+    pred = pd.Series([0.1, 0.5, 0.4], index=["1", "2", "3"])
+    odds = pd.Series([2.0, 3.0, 4.0], index=["1", "2", "3"])
+
+    bets = bettor.select_bets([pred, pred * 0], [odds, odds])
+
+    assert list(bets[0].index) == ["2", "3", "not_bet"]
+    # 対象の馬がいないレースは全額見送る
+    assert bets[1].to_dict() == {"not_bet": 1000}
+
+
+@pytest.mark.parametrize(
+    "bettor_class, separator",
+    [
+        (OptimizeUmarenBettor, "-"),
+        (OptimizeWideBettor, "-"),
+        (OptimizeUmatanBettor, ">"),
+        (OptimizeSanrentanBettor, ">"),
+    ],
+)
+def test_ticket_bettor(bettor_class, separator):
+    pred, _ = make_race(8, 0)
+    labels = ticket_labels(bettor_class._bet_type, list(pred.index))
+    ticket_prob = hit_matrix(bettor_class._bet_type, 8).T @ outcome_probabilities(
+        bettor_class._bet_type, pred.values
     )
+    odds = pd.Series(np.maximum(np.round(0.8 / ticket_prob, 1), 1.1), index=labels)
+
+    bet = bettor_class(budget=10000).select_bet(pred, odds)
+
+    assert list(bet.index) == labels + ["not_bet"]
+    assert all(separator in label for label in bet.index[:-1])
+    assert bet.dtype == int
+    assert np.all(bet.values % 100 == 0)
+    assert bet.drop("not_bet").sum() > 0
+
+
+def test_ticket_bettor_dense_odds():
+    """馬番を添字とするオッズの配列を ticket_odds で変換して渡せるか"""
+    pred, _ = make_race(8, 0)
+    ticket_prob = hit_matrix("umatan", 8).T @ outcome_probabilities(
+        "umatan", pred.values
+    )
+    values = np.maximum(np.round(0.8 / ticket_prob, 1), 1.1)
+    matrix = np.full((8, 8), np.nan)
+    matrix[tuple(ticket_combinations("umatan", 8).T)] = values
+    odds = pd.Series(values, index=ticket_labels("umatan", list(pred.index)))
+
+    bettor = OptimizeUmatanBettor(budget=10000)
+    pd.testing.assert_series_equal(
+        bettor.select_bet(pred, ticket_odds("umatan", matrix, list(pred.index))),
+        bettor.select_bet(pred, odds),
+    )
+
+
+def test_ticket_generate_odds_matrix():
+    """馬券種の収支行列は着順の結果ごとに1行で, 最後の列は見送り"""
+    odds = np.array([3.0, 5.0, 8.0])
+    index = ["1-2", "1-3", "2-3"]
+    result = OptimizeUmarenBettor()._generate_odds_matrix(odds, index, ["1", "2", "3"])
+
+    assert result.shape == (6, 4)
+    np.testing.assert_array_equal(result[:, -1], 1.0)
+    # 1着2着が 2, 1 の結果は "1-2" だけが的中
+    np.testing.assert_array_equal(result[2], [3.0, 0, 0, 1.0])
+
+
+def test_ticket_bettor_solution_cache():
+    """notify_bet と同じ (pred, odds, race_id) で呼べて, 同じ入力では前回の結果を使う"""
+    pred, _ = make_race(8, 0)
+    labels = ticket_labels("umaren", list(pred.index))
+    ticket_prob = hit_matrix("umaren", 8).T @ outcome_probabilities(
+        "umaren", pred.values
+    )
+    odds = pd.Series(np.maximum(np.round(0.8 / ticket_prob, 1), 1.1), index=labels)
+    cache = SolutionCache()
+    bettor = OptimizeUmarenBettor(budget=10000, solution_cache=cache)
+
+    bet = bettor.select_bet(pred, odds, "2305020811")
+    assert len(cache) == 1
+    pd.testing.assert_series_equal(bettor.select_bet(pred, odds, "2305020811"), bet)
+    assert cache.stats["hits"] == 1
+    pd.testing.assert_series_equal(
+        OptimizeUmarenBettor(budget=10000).select_bet(pred, odds), bet
+    )
+
+
+def test_ticket_bettor_missing_odds():
+    """オッズが無い馬券は対象にしない"""
+    pred = pd.Series([0.5, 0.3, 0.2], index=["1", "2", "3"])
+    odds = pd.Series([3.0, 5.0], index=["1-2", "1-3"])
+
+    bet = OptimizeUmarenBettor().select_bet(pred, odds)
+
+    assert list(bet.index) == ["1-2", "1-3", "not_bet"]
+
+
+def test_ticket_bettor_same_as_tansyo_batch(bettor):
+    """単勝の場合は select_bets と同じ配分になるか"""
+    pred, odds = make_race(12, 0)
+
+    class TansyoTicketBettor(OptimizeTicketBettor):
+        _bet_type = "tansyo"
+
+    bet = TansyoTicketBettor().select_bet(pred, odds)
+    expected = bettor.select_bets([pred], [odds])[0]
+
+    assert (bet - expected).abs().max() <= 100
+
+
+def log_growth_fractions(pred, odds):
+    """期待対数収益を数値的に最大化した配分"""
+    n = len(pred)
+
+    def loss(f):
+        return -np.sum(pred * np.log(1 - f.sum() + f * odds))
+
+    opts = sco.minimize(
+        loss,
+        np.full(n, 0.01),
+        method="SLSQP",
+        bounds=[(0, 1)] * n,
+        constraints=[{"type": "ineq", "fun": lambda f: 0.999 - f.sum()}],
+        options={"ftol": 1e-12, "maxiter": 500},
+    )
+    return opts["x"]
+
+
+@pytest.mark.parametrize("n", [5, 8, 12, 18])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_kelly_fractions(n, seed):
+    """式で求めた配分が期待対数収益の最大化の解と一致するか"""
+    pred, odds = make_race(n, seed)
+    # 予測と市場の見方がずれて期待値が1を超える馬を作る. 控除率は20%
+    odds = odds * np.random.default_rng(seed).uniform(0.7, 1.5, n)
+    odds = odds * np.sum(1 / odds) / 1.25
+
+    fraction = KellyTansyoBettor.kelly_fractions(pred.values, odds.values)
+
+    assert np.all(fraction >= 0)
+    assert fraction.sum() < 1
+    expected = log_growth_fractions(pred.values, odds.values)
+    assert fraction == pytest.approx(expected, abs=1e-4)
+
+
+def test_kelly_fractions_no_edge():
+    """期待値が1を超える馬がいなければ買わない"""
+    pred = np.array([0.5, 0.3, 0.2])
+    odds = np.array([1.8, 3.0, 4.5])
+    assert np.all(KellyTansyoBettor.kelly_fractions(pred, odds) == 0)
+
+
+def test_kelly_select_bet():
+    pred = pd.Series([0.5, 0.3, 0.15, 0.05], index=["1", "2", "3", "4"])
+    odds = pd.Series([2.4, 3.5, 5.0, 30.0], index=["1", "2", "3", "4"])
+    fraction = KellyTansyoBettor.kelly_fractions(pred.values, odds.values)
+
+    bet = KellyTansyoBettor(budget=10000).select_bet(pred, odds)
+
+    assert list(bet.index) == ["1", "2", "3", "4", "not_bet"]
+    assert bet.dtype == int
+    assert np.all(bet.values % 100 == 0)
+    assert bet.sum() == 10000
+    assert np.abs(bet.values[:-1] - fraction * 10000).max() <= 50
+
+    # ハーフケリーは配分が半分になる
+    half = KellyTansyoBettor(budget=10000, kelly_fraction=0.5).select_bet(pred, odds)
+    assert np.abs(half.values[:-1] - fraction * 5000).max() <= 50
+    assert half.sum() == 10000
+
+
+def test_kelly_select_bet_threshold():
+    """閾値を満たさない馬とオッズが無い馬は対象にしない"""
+    bettor = KellyTansyoBettor(pred_threshold=0.2, odds_threshold=2.0)
+    pred = pd.Series([0.1, 0.5, 0.3, 0.1], index=["1", "2", "3", "4"])
+    odds = pd.Series([12.0, 3.0, 1.5], index=["1", "2", "3"])
+
+    bet = bettor.select_bet(pred, odds)
+
+    assert list(bet.index) == ["2", "not_bet"]
+    assert bet["2"] > 0
+    assert bettor.select_bet(pred * 0, odds).to_dict() == {"not_bet": 1000}
+
+
+def test_kelly_round_to_units():
+    """丸めた合計が予算を超えない"""
+    bet = KellyTansyoBettor._round_to_units(np.array([350.0, 350.0, 300.0]), 1000)
+    assert bet.sum() == 1000
+    assert sorted(bet) == [300, 300, 400]
+
 
-    print(result)
+def test_kelly_fraction_range():
+    with pytest.raises(ValueError):
+        KellyTansyoBettor(kelly_fraction=0)
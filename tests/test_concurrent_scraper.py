@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from src.concurrent_scraper import ConcurrentOddsScraper, HostLimiter
+
+
+class FakeScraper:
+    """待ち時間を指定できるスクレイパー"""
+
+    base_url = "https://race.netkeiba.com/odds/index.html?type=b1&"
+
+    def __init__(self, delays):
+        self._delays = delays
+        self._lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def get_odds_by_race(self, year, jyo, kaiji, nichiji, race_num):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            delay = self._delays[race_num]
+            if delay is None:
+                raise ValueError("オッズ表が見つかりません")
+            time.sleep(delay)
+            return pd.Series({"1": float(race_num)})
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def make_races(race_nums):
+    return [
+        {"JyoCD": "05", "Kaiji": "02", "Nichiji": "12", "RaceNum": race_num}
+        for race_num in race_nums
+    ]
+
+
+def test_fetch_concurrently():
+    """複数レースを並行して取得し、取得できた順に返すか"""
+    scraper = FakeScraper({"10": 0.3, "11": 0.05, "12": 0.3})
+    concurrent_scraper = ConcurrentOddsScraper(scraper, max_workers=3, per_host_limit=3)
+
+    start = time.monotonic()
+    results = list(concurrent_scraper.fetch_all("2023", make_races(["10", "11", "12"])))
+    elapsed = time.monotonic() - start
+
+    assert results[0].race["RaceNum"] == "11"
+    assert {result.odds["1"] for result in results} == {10.0, 11.0, 12.0}
+    assert elapsed < 0.55
+
+
+def test_per_host_limit():
+    scraper = FakeScraper({str(i): 0.05 for i in range(6)})
+    concurrent_scraper = ConcurrentOddsScraper(scraper, max_workers=6, per_host_limit=2)
+
+    results = list(concurrent_scraper.fetch_all("2023", make_races(map(str, range(6)))))
+
+    assert len(results) == 6
+    assert scraper.max_active == 2
+
+
+def test_error_does_not_stop_others():
+    scraper = FakeScraper({"10": None, "11": 0.01})
+    concurrent_scraper = ConcurrentOddsScraper(scraper)
+
+    results = {
+        result.race["RaceNum"]: result
+        for result in concurrent_scraper.fetch_all("2023", make_races(["10", "11"]))
+    }
+
+    assert isinstance(results["10"].error, ValueError)
+    assert results["11"].odds["1"] == 11.0
+
+
+def test_timeout():
+    scraper = FakeScraper({"10": 1.0, "11": 0.01})
+    concurrent_scraper = ConcurrentOddsScraper(scraper, timeout=0.2)
+
+    results = {
+        result.race["RaceNum"]: result
+        for result in concurrent_scraper.fetch_all("2023", make_races(["10", "11"]))
+    }
+
+    assert isinstance(results["10"].error, TimeoutError)
+    assert results["11"].error is None
+
+
+def test_no_races():
+    concurrent_scraper = ConcurrentOddsScraper(FakeScraper({}))
+    assert list(concurrent_scraper.fetch_all("2023", [])) == []
+
+
+def test_host_limiter_timeout():
+    limiter = HostLimiter(1)
+    with limiter.limit("race.netkeiba.com"):
+        with pytest.raises(TimeoutError):
+            with limiter.limit("race.netkeiba.com", timeout=0.01):
+                pass
+        # 別ホストは制限されない
+        with limiter.limit("db.netkeiba.com", timeout=0.01):
+            pass
@@ -0,0 +1,109 @@
+import pytest
+from selenium.common.exceptions import WebDriverException
+
+from src.driver_pool import ChromeDriverPool
+
+
+class FakeDriver:
+    """テスト用のドライバー"""
+
+    def __init__(self):
+        self.crashed = False
+        self.quitted = False
+
+    @property
+    def current_url(self):
+        if self.crashed:
+            raise WebDriverException("crashed")
+        return "about:blank"
+
+    def quit(self):
+        self.quitted = True
+
+
+@pytest.fixture
+def created():
+    return []
+
+
+@pytest.fixture
+def pool(created):
+    def factory():
+        driver = FakeDriver()
+        created.append(driver)
+        return driver
+
+    driver_pool = ChromeDriverPool(size=2, driver_factory=factory, checkout_timeout=0.1)
+    yield driver_pool
+    driver_pool.close()
+
+
+def test_reuse_driver(pool: ChromeDriverPool, created):
+    """返却したドライバーが再利用されるか"""
+    with pool.driver() as driver1:
+        pass
+    with pool.driver() as driver2:
+        pass
+    assert driver1 is driver2
+    assert len(created) == 1
+
+
+def test_size_limit(pool: ChromeDriverPool):
+    """上限数を超えて貸し出さないか"""
+    entry1 = pool.checkout()
+    entry2 = pool.checkout()
+    with pytest.raises(TimeoutError):
+        pool.checkout()
+    pool.checkin(entry1)
+    pool.checkin(entry2)
+
+
+def test_warm_up(pool: ChromeDriverPool, created):
+    pool.warm_up()
+    assert len(created) == 2
+    assert pool.num_drivers == 2
+
+
+def test_recycle_crashed_driver(pool: ChromeDriverPool, created):
+    """クラッシュしたドライバーは作り直すか"""
+    with pool.driver() as driver:
+        pass
+    driver.crashed = True
+
+    with pool.driver() as new_driver:
+        pass
+    assert new_driver is not driver
+    assert driver.quitted
+    assert pool.num_drivers == 1
+
+
+def test_discard_on_webdriver_exception(pool: ChromeDriverPool):
+    with pytest.raises(WebDriverException):
+        with pool.driver() as driver:
+            raise WebDriverException("page load failed")
+    assert driver.quitted
+    assert pool.num_drivers == 0
+
+
+def test_recycle_old_driver(created):
+    driver_pool = ChromeDriverPool(size=1, max_uses=2, driver_factory=FakeDriver)
+    drivers = []
+    for _ in range(3):
+        with driver_pool.driver() as driver:
+            drivers.append(driver)
+    assert drivers[0] is drivers[1]
+    assert drivers[2] is not drivers[0]
+    assert drivers[0].quitted
+    driver_pool.close()
+
+
+def test_close(pool: ChromeDriverPool, created):
+    pool.warm_up()
+    entry = pool.checkout()
+    pool.close()
+    assert created[0].quitted or created[1].quitted
+    # 貸し出し中のドライバーは返却時に終了する
+    pool.checkin(entry)
+    assert all(driver.quitted for driver in created)
+    with pytest.raises(RuntimeError):
+        pool.checkout()
@@ -51,3 +51,17 @@ def test_not_found_json_file():
 
 def test_load_data(pred_loader: PredLoader):
     assert pred_loader.data == json_pred_data
+
+
+def test_store(pred_loader: PredLoader):
+    races = pred_loader.store.races_between("2023", "1224", 15 * 60, 16 * 60)
+    assert races == [json_pred_data["2023"]["1224"]["15:40"]]
+    assert pred_loader.store is pred_loader.store
+
+
+def test_load_day(test_json_file):
+    loader = PredLoader(test_json_file, "2023", "1224")
+    assert loader.data == json_pred_data
+
+    loader = PredLoader(test_json_file, "2023", "1225")
+    assert loader.data == {"2023": {"1225": {}}}
@@ -0,0 +1,206 @@
+import datetime
+import json
+from pathlib import Path
+
+import pytest
+
+import main
+from tests.helpers import measure_import
+from src.bettor import KellyTansyoBettor, OptimizeTansyoBettor
+from src.portfolio import DayPortfolio
+from src.prefetch import OddsPrefetcher
+from src.pred_store import PredStore
+from src.scraper import OddsScraper
+
+DATA_DIR = Path(__file__).parent / "data"
+
+# 新しいプロセスで main を読み込む時間の上限
+IMPORT_BUDGET_SECONDS = 0.3
+
+
+class FakeReader:
+    def __init__(self, pred):
+        self._pred = pred
+        self.refreshes = 0
+
+    def day_store(self, year, month_day):
+        return PredStore(self._pred)
+
+
+class FakeFetcher:
+    """記録済みのオッズAPIのレスポンスを返す"""
+
+    def fetch_odds_api(self, race_id, odds_type=1):
+        return json.loads((DATA_DIR / "odds_api_b1_202305050812.json").read_text())
+
+    def fetch_odds_page(self, race_id):
+        raise ValueError("ページは記録していません")
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.messages = []
+        self.flushed = False
+
+    def notify(self, title, bet, expires_at=None, on_sent=None):
+        self.messages.append((title, bet))
+        self.expires_at = expires_at
+        if on_sent is not None:
+            on_sent()
+
+    def flush(self, timeout=None):
+        self.flushed = True
+        return True
+
+
+class FakeRuntime:
+    def __init__(self, pred):
+        self.reader = FakeReader(pred)
+        self.http_fetcher = FakeFetcher()
+        self.bettor = OptimizeTansyoBettor()
+        self.dispatcher = FakeDispatcher()
+        self.recorder = None
+
+    def pred_reader(self):
+        self.reader.refreshes += 1
+        return self.reader
+
+
+def make_pred(minutes_ahead, later_races=0):
+    """minutes_ahead 分後に発走するレースと, その後1時間ごとに発走する later_races レースの予測"""
+    post_time = datetime.datetime.now() + datetime.timedelta(minutes=minutes_ahead)
+    last_post_time = post_time + datetime.timedelta(hours=later_races)
+    if last_post_time.date() != datetime.date.today():
+        pytest.skip("日付をまたぐ時刻では実行しない")
+    race = {
+        "Jyo": "東京",
+        "JyoCD": "05",
+        "Kaiji": "02",
+        "Nichiji": "08",
+        "RaceNum": "12",
+        "Kyori": "1400",
+        "Syubetu": "サラ系4歳以上",
+        "Jyoken": "2勝クラス",
+        "Title": "nan",
+        # 記録済みのオッズの取消馬 (4, 7番) を除く
+        "pred": {umaban: 1 / 6 for umaban in ["1", "2", "3", "5", "6", "8"]},
+    }
+    races = {post_time.strftime("%H%M"): race}
+    for i in range(1, later_races + 1):
+        later = post_time + datetime.timedelta(hours=i)
+        races[later.strftime("%H%M")] = {**race, "RaceNum": f"{12 - i:02}"}
+    return {post_time.strftime("%y"): {post_time.strftime("%m%d"): races}}
+
+
+@pytest.fixture
+def runtime(monkeypatch):
+    """設定と実行環境を差し替える"""
+
+    def install(pred):
+        runtime = FakeRuntime(pred)
+        monkeypatch.setattr(main, "_config", {})
+        monkeypatch.setattr(main, "_runtime", runtime)
+        return runtime
+
+    return install
+
+
+def test_cold_start_import():
+    """main の読み込みでは重いモジュールを読み込まない"""
+    seconds, loaded = measure_import("main")
+    assert loaded == []
+    assert seconds < IMPORT_BUDGET_SECONDS
+
+
+def test_run_once(runtime):
+    runtime = runtime(make_pred(7))
+    assert main.run_once() == {"races": 1}
+    assert len(runtime.dispatcher.messages) == 1
+    assert runtime.dispatcher.flushed
+
+    # 2回目は同じ実行環境を使い回す
+    main.run_once()
+    assert runtime.reader.refreshes == 2
+
+
+def test_run_once_portfolio(runtime, tmp_path):
+    """日単位の配分では当日の全レースを読み込み, 後のレースの分を残して掛け金を固定する"""
+    alone = runtime(make_pred(7))
+    # 1レースでは資金の半分以上を配分するので, 3レースあれば配分を縮める
+    alone.bettor = DayPortfolio(bankroll=10000, kelly_fraction=1.0)
+    assert main.run_once() == {"races": 1}
+    (stake_alone,) = [int(bet.sum()) for bet in alone.bettor._fixed.values()]
+
+    pred = make_pred(7, later_races=2)
+    card = runtime(pred)
+    card.bettor = DayPortfolio(
+        bankroll=10000, kelly_fraction=1.0, state_dir=str(tmp_path)
+    )
+    assert main.run_once() == {"races": 1}
+
+    now = datetime.datetime.now()
+    assert set(card.bettor._preds) == set(main._post_times(PredStore(pred), now))
+    assert len(card.bettor._preds) == 3
+    (stake,) = [int(bet.sum()) for bet in card.bettor._fixed.values()]
+    assert 0 < stake < stake_alone
+    assert card.bettor.remaining == 10000 - stake
+
+    # 次の実行 (別のプロセス) でも固定した掛け金を資金から除く
+    restarted = DayPortfolio(bankroll=10000, state_dir=str(tmp_path))
+    restarted.load_day(PredStore(pred), now.strftime("%y"), now.strftime("%m%d"))
+    assert restarted.remaining == 10000 - stake
+
+
+def test_run_once_no_races(runtime):
+    runtime = runtime(make_pred(30))
+    assert main.run_once() == {"races": 0}
+    assert runtime.dispatcher.messages == []
+
+
+def test_http_handler(runtime, monkeypatch):
+    runtime(make_pred(7))
+    assert main.http_handler(None) == ({"status": "ok", "races": 1}, 200)
+
+    def fail():
+        raise RuntimeError("Driveに接続できません")
+
+    monkeypatch.setattr(main, "run_once", fail)
+    assert main.http_handler(None) == ({"status": "error"}, 500)
+
+
+def test_get_config(monkeypatch):
+    calls = []
+
+    def load_config():
+        calls.append(1)
+        return {"pred_json_path": "pred.json"}
+
+    monkeypatch.setattr(main, "_config", None)
+    monkeypatch.setattr(main, "load_config", load_config)
+    assert main.get_config() is main.get_config()
+    assert len(calls) == 1
+
+
+def test_create_bettor():
+    assert isinstance(main.create_bettor({}), OptimizeTansyoBettor)
+    assert main.create_bettor({}).solution_cache is not None
+
+    bettor = main.create_bettor({"bettor_engine": "kelly", "kelly_fraction": 0.5})
+    assert isinstance(bettor, KellyTansyoBettor)
+    assert bettor.solution_cache is None
+
+    bettor = main.create_bettor({"bettor_engine": "portfolio", "day_bankroll": 20000})
+    assert isinstance(bettor, DayPortfolio)
+    assert bettor.bankroll == 20000
+
+    with pytest.raises(ValueError):
+        main.create_bettor({"bettor_engine": "unknown"})
+
+
+def test_create_prefetcher():
+    scraper = OddsScraper(main.ODDS_PAGE_URL)
+    assert main.create_prefetcher({"odds_prefetch_minutes": None}, scraper) is None
+
+    with main.create_prefetcher({"odds_prefetch_minutes": 15}, scraper) as prefetcher:
+        assert isinstance(prefetcher, OddsPrefetcher)
+        assert prefetcher.base_url == main.ODDS_PAGE_URL
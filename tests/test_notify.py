@@ -1,3 +1,4 @@
+import pandas as pd
 import pytest
 from src.notify import Notifier
 
@@ -14,3 +15,15 @@ def test_has_message():
 def test_has_message_2():
     message = "burabura"
     assert Notifier(message).message == message
+
+
+def test_notify_sends_synchronously(notify_server, tmp_path):
+    token_path = tmp_path / "token"
+    token_path.write_text("token\n")
+    notifier = Notifier(str(token_path), url=notify_server.url)
+    notifier.notify("東京 11R", pd.Series([100], index=["1"]))
+
+    # 戻った時には送り終えている
+    assert notify_server.messages == ["\n東京 11R\n1 100円"]
+    assert notifier.message == "\n東京 11R\n1 100円"
+    notifier.close()
@@ -0,0 +1,220 @@
+import time
+
+import pandas as pd
+import pytest
+
+from src.notify import (
+    LineNotifyDestination,
+    NotifyDispatcher,
+    format_bet_message,
+)
+
+
+class RecordingSleep:
+    """待ち時間を記録するだけのsleep"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, seconds):
+        self.calls.append(seconds)
+
+
+@pytest.fixture
+def sleep():
+    return RecordingSleep()
+
+
+@pytest.fixture
+def destination(notify_server):
+    return LineNotifyDestination("token\n", url=notify_server.url)
+
+
+def make_dispatcher(destination, sleep, **kwargs):
+    kwargs.setdefault("coalesce_window", 0.0)
+    kwargs.setdefault("clock", lambda: 1000.0)
+    return NotifyDispatcher([destination], sleep=sleep, **kwargs)
+
+
+def test_format_bet_message():
+    bet = pd.Series([100, 200], index=["1", "5"])
+    assert format_bet_message("東京 11R", bet) == "\n東京 11R\n1 100円\n5 200円"
+
+
+def test_notify(notify_server, destination, sleep):
+    with make_dispatcher(destination, sleep) as dispatcher:
+        dispatcher.notify("東京 11R", pd.Series([100], index=["1"]))
+        dispatcher.notify("京都 11R", pd.Series([200], index=["3"]))
+
+    assert sorted(notify_server.messages) == [
+        "\n京都 11R\n3 200円",
+        "\n東京 11R\n1 100円",
+    ]
+    assert notify_server.authorizations == ["Bearer token"] * 2
+    assert dispatcher.stats["sent"] == 2
+    # 接続を使い回す
+    assert len(notify_server.connections) == 1
+
+
+def test_notify_does_not_block(notify_server, destination, sleep):
+    notify_server.responses = [(503, {})]
+    slow_sleep = lambda seconds: time.sleep(0.2)
+    with make_dispatcher(destination, slow_sleep) as dispatcher:
+        start = time.perf_counter()
+        dispatcher.notify("東京 11R", pd.Series([100], index=["1"]))
+        assert time.perf_counter() - start < 0.1
+    assert len(notify_server.messages) == 1
+
+
+def test_coalesce(notify_server, destination, sleep):
+    with make_dispatcher(destination, sleep, coalesce_window=0.5) as dispatcher:
+        dispatcher.notify("東京 11R", pd.Series([100], index=["1"]))
+        dispatcher.notify("京都 11R", pd.Series([200], index=["3"]))
+        dispatcher.flush()
+
+    assert notify_server.messages == ["\n東京 11R\n1 100円\n京都 11R\n3 200円"]
+
+
+def test_coalesce_max_length(notify_server, destination, sleep):
+    destination.max_message_length = 30
+    with make_dispatcher(destination, sleep, coalesce_window=0.5) as dispatcher:
+        dispatcher.notify("東京 11R", pd.Series([100], index=["1"]))
+        dispatcher.notify("京都 11R", pd.Series([200], index=["3"]))
+        dispatcher.notify("新潟 11R", pd.Series([300], index=["5"]))
+
+    assert len(notify_server.messages) == 2
+
+
+def test_retry_with_backoff(notify_server, destination, sleep):
+    notify_server.responses = [(500, {}), (503, {})]
+    with make_dispatcher(destination, sleep, backoff=1.0) as dispatcher:
+        dispatcher.notify_message("hello")
+
+    assert notify_server.messages == ["hello"]
+    assert sleep.calls == [1.0, 2.0]
+    assert dispatcher.stats == {
+        "messages": 1,
+        "sent": 1,
+        "failed": 0,
+        "retries": 2,
+        "expired": 0,
+    }
+
+
+def test_retry_after(notify_server, destination, sleep):
+    notify_server.responses = [(429, {"Retry-After": "30"})]
+    with make_dispatcher(destination, sleep) as dispatcher:
+        dispatcher.notify_message("hello")
+
+    assert notify_server.messages == ["hello"]
+    assert sleep.calls == [30.0]
+
+
+def test_rate_limit_reset(notify_server, destination, sleep):
+    """送信数を使い切ったら次の送信は max_backoff より先でもリセット時刻まで待つ"""
+    notify_server.responses = [
+        (200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1120"})
+    ]
+    with make_dispatcher(destination, sleep) as dispatcher:
+        dispatcher.notify_message("first")
+        dispatcher.flush()
+        assert sleep.calls == []
+        dispatcher.notify_message("second")
+
+    assert notify_server.messages == ["first", "second"]
+    assert sleep.calls == [120.0]
+    assert dispatcher.stats["retries"] == 0
+
+
+def test_drop_expired(notify_server, destination, sleep):
+    """発走までに送れない通知は待たずに捨て, 後の通知を待たせない"""
+    notify_server.responses = [
+        (200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1030"})
+    ]
+    with make_dispatcher(destination, sleep) as dispatcher:
+        dispatcher.notify_message("first")
+        dispatcher.flush()
+        # 1030 まで送れないので 1020 に発走するレースの通知は捨てる
+        dispatcher.notify_message("expired", expires_at=1020.0)
+        dispatcher.notify_message("later", expires_at=1100.0)
+
+    assert notify_server.messages == ["first", "later"]
+    assert sleep.calls == [30.0]
+    assert dispatcher.stats["expired"] == 1
+
+
+def test_coalesce_drops_only_expired(notify_server, destination, sleep):
+    """まとめる間隔の中で期限を過ぎた通知だけを捨て, まだ送れる通知は送る"""
+    notify_server.responses = [
+        (200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1030"})
+    ]
+    with make_dispatcher(destination, sleep, coalesce_window=0.5) as dispatcher:
+        dispatcher.notify_message("first")
+        dispatcher.flush()
+        dispatcher.notify_message("expired", expires_at=1020.0)
+        dispatcher.notify_message("later", expires_at=1100.0)
+        dispatcher.notify_message("same", expires_at=1100.0)
+
+    assert notify_server.messages == ["first", "latersame"]
+    assert dispatcher.stats["expired"] == 1
+
+
+def test_on_sent(notify_server, destination, sleep):
+    """送れた通知だけ, まとめて送った場合も通知ごとに1回ずつ呼ぶ"""
+    sent = []
+    with make_dispatcher(destination, sleep, coalesce_window=0.5) as dispatcher:
+        dispatcher.notify_message("a", on_sent=lambda: sent.append("a"))
+        dispatcher.notify_message("b", on_sent=lambda: sent.append("b"))
+        dispatcher.flush()
+        assert notify_server.messages == ["ab"]
+        assert sent == ["a", "b"]
+
+        notify_server.responses = [(401, {})]
+        dispatcher.notify_message("c", on_sent=lambda: sent.append("c"))
+
+    assert sent == ["a", "b"]
+
+
+def test_flush_timeout(notify_server, destination):
+    slow_sleep = lambda seconds: time.sleep(0.5)
+    notify_server.responses = [(503, {})]
+    dispatcher = make_dispatcher(destination, slow_sleep)
+    dispatcher.notify_message("hello")
+    start = time.perf_counter()
+    assert not dispatcher.flush(timeout=0.1)
+    assert time.perf_counter() - start < 0.3
+    assert dispatcher.flush(timeout=5.0)
+    dispatcher.close()
+
+
+def test_give_up(notify_server, destination, sleep):
+    notify_server.responses = [(500, {})] * 3
+    with make_dispatcher(destination, sleep, max_retries=2) as dispatcher:
+        dispatcher.notify_message("hello")
+
+    assert notify_server.messages == []
+    assert dispatcher.stats["failed"] == 1
+
+
+def test_no_retry_on_client_error(notify_server, destination, sleep):
+    notify_server.responses = [(401, {})]
+    with make_dispatcher(destination, sleep) as dispatcher:
+        dispatcher.notify_message("hello")
+
+    assert sleep.calls == []
+    assert dispatcher.stats["failed"] == 1
+
+
+def test_connection_error(sleep):
+    destination = LineNotifyDestination("token", url="http://127.0.0.1:9/api/notify")
+    with make_dispatcher(destination, sleep, max_retries=1, timeout=1.0) as dispatcher:
+        dispatcher.notify_message("hello")
+    assert dispatcher.stats["failed"] == 1
+    assert sleep.calls == [1.0]
+
+
+def test_closed(destination, sleep):
+    dispatcher = make_dispatcher(destination, sleep)
+    dispatcher.close()
+    with pytest.raises(RuntimeError):
+        dispatcher.notify_message("hello")
@@ -0,0 +1,41 @@
+import pytest
+import requests
+
+from src.odds_client import HttpOddsFetcher
+
+
+@pytest.fixture
+def fetcher(odds_server):
+    odds_fetcher = HttpOddsFetcher(
+        page_url=f"{odds_server.url}/odds/index.html?type=b1&",
+        api_url=f"{odds_server.url}/api/api_get_jra_odds.html?",
+        timeout=2.0,
+    )
+    yield odds_fetcher
+    odds_fetcher.close()
+
+
+def test_fetch_odds_api(fetcher: HttpOddsFetcher):
+    response = fetcher.fetch_odds_api("202305021211")
+    assert response["status"] == "result"
+    assert response["data"]["odds"]["1"]["01"][0] == "54.9"
+
+
+def test_fetch_odds_page(fetcher: HttpOddsFetcher):
+    """EUC-JPのページをデコードできるか"""
+    html = fetcher.fetch_odds_page("202305021211")
+    assert "日本ダービー" in html
+    assert 'id="odds-1_12">8.3<' in html
+
+
+def test_gzip_and_keep_alive(fetcher: HttpOddsFetcher, odds_server):
+    """gzipで要求し、接続を使い回すか"""
+    fetcher.fetch_odds_api("202305021211")
+    fetcher.fetch_odds_page("202305021211")
+    assert all("gzip" in r.headers["Accept-Encoding"] for r in odds_server.requests)
+    assert len(odds_server.connections) == 1
+
+
+def test_not_found(fetcher: HttpOddsFetcher):
+    with pytest.raises(requests.HTTPError):
+        fetcher.fetch_odds_page("209999999999")
@@ -0,0 +1,147 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.helpers import make_ticket_odds_response
+from src.odds_parser import (
+    available_backends,
+    parse_tansyo_odds,
+    parse_tansyo_odds_api,
+    parse_ticket_odds_api,
+)
+
+DATA_DIR = Path(__file__).parent / "data"
+
+
+def read_page(race_id):
+    return (DATA_DIR / f"odds_b1_{race_id}.html").read_text("euc_jp")
+
+
+def read_api(race_id):
+    with open(DATA_DIR / f"odds_api_b1_{race_id}.json") as f:
+        return json.load(f)
+
+
+@pytest.fixture(params=available_backends())
+def backend(request):
+    return request.param
+
+
+def test_parse_odds(backend):
+    odds = parse_tansyo_odds(read_page("202305021211"), backend)
+    assert list(odds.index) == [str(i) for i in range(1, 19)]
+    assert odds["1"] == 54.9
+    assert odds["12"] == 8.3
+    assert odds.dtype == "float64"
+
+
+def test_parse_bytes(backend):
+    """ブラウザのpage_sourceと同じUTF-8のbytesも扱えるか"""
+    html = read_page("202305021211").encode("utf-8")
+    assert parse_tansyo_odds(html, backend)["12"] == 8.3
+
+
+def test_skip_unavailable_odds(backend):
+    """取消馬・発売前のオッズは含めない"""
+    odds = parse_tansyo_odds(read_page("202305050812"), backend)
+    assert odds["1"] == 3.7
+    assert odds["2"] == 1.3
+    assert list(odds.index) == ["1", "2", "3", "5", "6", "8"]
+
+
+def test_not_odds_page(backend):
+    with pytest.raises(ValueError):
+        parse_tansyo_odds("<html><body><p>メンテナンス中</p></body></html>", backend)
+
+
+def test_backends_agree():
+    html = read_page("202305021211")
+    results = [parse_tansyo_odds(html, backend) for backend in available_backends()]
+    for result in results[1:]:
+        pd.testing.assert_series_equal(results[0], result)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        parse_tansyo_odds(read_page("202305021211"), "unknown")
+
+
+def test_parse_api():
+    odds = parse_tansyo_odds_api(read_api("202305021211"))
+    pd.testing.assert_series_equal(odds, parse_tansyo_odds(read_page("202305021211")))
+
+
+def test_parse_api_skip_unavailable_odds():
+    odds = parse_tansyo_odds_api(read_api("202305050812"))
+    assert list(odds.index) == ["1", "2", "3", "5", "6", "8"]
+
+
+def test_parse_api_not_published():
+    with pytest.raises(ValueError):
+        parse_tansyo_odds_api({"status": "yoso", "data": {}})
+
+
+@pytest.mark.parametrize(
+    "bet_type, shape",
+    [
+        ("tansyo", (18,)),
+        ("umaren", (18, 18)),
+        ("wide", (18, 18)),
+        ("umatan", (18, 18)),
+        ("sanrentan", (18, 18, 18)),
+    ],
+)
+def test_parse_ticket_odds_api(bet_type, shape):
+    """馬券ごとのオッズが馬番 - 1 の位置に入るか"""
+    response = make_ticket_odds_response(bet_type, 18, scratched=[7])
+    matrix = parse_ticket_odds_api(response, bet_type)
+    assert matrix.shape == shape
+
+    table = next(iter(response["data"]["odds"].values()))
+    for key, values in table.items():
+        horses = tuple(int(key[i : i + 2]) - 1 for i in range(0, len(key), 2))
+        if 6 in horses:
+            assert np.isnan(matrix[horses])
+        else:
+            assert matrix[horses] == float(values[0])
+            if bet_type in ("umaren", "wide"):
+                assert matrix[horses[::-1]] == float(values[0])
+
+    # 同じ馬を含む組はオッズ無し
+    if matrix.ndim > 1:
+        assert np.isnan(matrix[0, 0]).all()
+
+
+def test_parse_ticket_odds_api_unavailable():
+    """発売前のオッズはNaNになり, 頭数を指定すればその大きさの配列になる"""
+    response = {
+        "status": "middle",
+        "data": {
+            "odds": {
+                "4": {
+                    "0102": ["---.-", "", ""],
+                    "0103": ["12.5", "", "1"],
+                    "0203": ["1,234.5", "", "2"],
+                }
+            }
+        },
+    }
+    matrix = parse_ticket_odds_api(response, "umaren", num_horses=5)
+    assert matrix.shape == (5, 5)
+    assert np.isnan(matrix[0, 1])
+    assert matrix[2, 0] == 12.5
+    assert matrix[1, 2] == 1234.5
+    assert np.isnan(matrix[3:]).all()
+
+
+def test_parse_ticket_odds_api_errors():
+    with pytest.raises(ValueError):
+        parse_ticket_odds_api({"status": "yoso", "data": {}}, "umaren")
+    # 別の馬券種のレスポンス
+    with pytest.raises(ValueError):
+        parse_ticket_odds_api(make_ticket_odds_response("umaren", 5), "sanrentan")
+    with pytest.raises(ValueError):
+        parse_ticket_odds_api(make_ticket_odds_response("umaren", 5), "sanrenpuku")
@@ -0,0 +1,178 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.odds_recorder import OddsArchive, OddsRecorder
+
+
+def make_odds(values):
+    return pd.Series(values, index=[str(i + 1) for i in range(len(values))])
+
+
+@pytest.fixture
+def recorder(tmp_path):
+    # バックグラウンドの書き込みは待たずに flush() で書き込む
+    recorder = OddsRecorder(tmp_path / "odds", flush_interval=60)
+    yield recorder
+    recorder.close()
+
+
+def test_history(recorder):
+    recorder.record("202305021211", make_odds([5.0, 2.0, 8.0]), timestamp=100.0)
+    recorder.record("202305021210", make_odds([1.5, 3.0]), timestamp=101.0)
+    recorder.flush()
+    recorder.record("202305021211", make_odds([4.5, 2.2, 9.0]), timestamp=160.0)
+    recorder.flush()
+
+    archive = recorder.archive()
+    assert sorted(archive.race_ids) == ["202305021210", "202305021211"]
+
+    history = archive.history("202305021211")
+    assert list(history.columns) == ["1", "2", "3"]
+    assert list(history.index) == list(pd.to_datetime([100.0, 160.0], unit="s"))
+    assert history["1"].tolist() == [5.0, 4.5]
+    assert history["2"].tolist() == pytest.approx([2.0, 2.2])
+
+
+def test_records_are_memory_mapped(recorder):
+    # 過去の日の記録は書き込んだ時点で1日分の配列にまとめる
+    recorder.record("202305021211", make_odds([5.0, 2.0]), timestamp=100.0)
+    recorder.flush()
+
+    archive = recorder.archive()
+    records = archive._day(archive._ranges["202305021211"][0][0])
+    assert isinstance(records, np.memmap)
+    assert records["odds"].dtype == np.float32
+
+
+def test_odds_at(recorder):
+    recorder.record("202305021211", make_odds([5.0, 2.0]), timestamp=100.0)
+    recorder.record("202305021211", make_odds([4.0, 2.5]), timestamp=200.0)
+    recorder.flush()
+
+    archive = recorder.archive()
+    pd.testing.assert_series_equal(
+        archive.odds_at("202305021211", 150.0), make_odds([5.0, 2.0])
+    )
+    assert archive.odds_at("202305021211", 200.0)["1"] == 4.0
+    assert archive.odds_at("202305021211", 50.0).empty
+    assert archive.odds_at("202305021299", 150.0).empty
+
+
+def test_unknown_race(recorder):
+    archive = recorder.archive()
+    assert "202305021211" not in archive
+    assert archive.history("202305021211").empty
+
+
+def test_background_flush(tmp_path):
+    """max_buffer 行を超えたら間隔を待たずにバックグラウンドで書き込む"""
+    with OddsRecorder(tmp_path, flush_interval=60, max_buffer=4) as recorder:
+        recorder.record("202305021211", make_odds([5.0, 2.0, 8.0, 3.0]))
+        deadline = time.monotonic() + 5
+        while "202305021211" not in OddsArchive(tmp_path):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+
+def test_close_flushes(tmp_path):
+    recorder = OddsRecorder(tmp_path)
+    recorder.record("202305021211", make_odds([5.0, 2.0]))
+    recorder.close()
+    assert len(OddsArchive(tmp_path).records("202305021211")) == 2
+
+    with pytest.raises(RuntimeError):
+        recorder.record("202305021211", make_odds([5.0, 2.0]))
+
+
+class FakeClock:
+    """指定した時刻を返す時計"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+# 2023-05-14 12:00 (ローカル時刻)
+NOON = time.mktime((2023, 5, 14, 12, 0, 0, 0, 0, -1))
+DAY = 24 * 60 * 60
+
+
+def test_reopen_appends(tmp_path):
+    """再起動後は記録中の日のジャーナルに追記し, 書きかけの最後の行は捨てる"""
+    clock = FakeClock(NOON)
+    with OddsRecorder(tmp_path, clock=clock) as recorder:
+        recorder.record("202305021211", make_odds([5.0, 2.0]), timestamp=NOON)
+    with open(tmp_path / "day_20230514.journal", "ab") as f:
+        f.write(b"\0" * 5)
+
+    with OddsRecorder(tmp_path, clock=clock) as recorder:
+        recorder.record("202305021211", make_odds([4.0, 2.5]), timestamp=NOON + 60)
+
+    assert os.listdir(tmp_path) == ["day_20230514.journal"]
+    assert OddsArchive(tmp_path).history("202305021211")["1"].tolist() == [5.0, 4.0]
+
+
+def test_compact_on_next_day(tmp_path):
+    """日付が変わったら前日のジャーナルを1つの配列にまとめる"""
+    clock = FakeClock(NOON)
+    with OddsRecorder(tmp_path, flush_interval=60, clock=clock) as recorder:
+        recorder.record("202305021211", make_odds([5.0, 2.0]), timestamp=NOON)
+        recorder.record("202305021210", make_odds([3.0]), timestamp=NOON + 60)
+        recorder.flush()
+        clock.now += DAY
+        recorder.record("202305021311", make_odds([6.0, 7.0]), timestamp=clock.now)
+        recorder.flush()
+
+        assert sorted(os.listdir(tmp_path)) == [
+            "day_20230514.npy",
+            "day_20230515.journal",
+            "index.json",
+        ]
+        archive = recorder.archive()
+        assert archive.race_ids == ["202305021210", "202305021211", "202305021311"]
+        assert archive.history("202305021211")["1"].tolist() == [5.0]
+        assert archive.odds_at("202305021311", clock.now)["2"] == 7.0
+
+    # 前回の実行で残った前日のジャーナルは起動時にまとめる
+    clock.now += DAY
+    OddsRecorder(tmp_path, clock=clock).close()
+    assert sorted(os.listdir(tmp_path)) == [
+        "day_20230514.npy",
+        "day_20230515.npy",
+        "index.json",
+    ]
+    assert len(OddsArchive(tmp_path).records("202305021311")) == 2
+
+
+def test_many_flushes_are_bounded(tmp_path):
+    """書き込みの回数によらずファイルの数と索引の大きさは増えない"""
+    clock = FakeClock(NOON)
+    with OddsRecorder(tmp_path, flush_interval=60, clock=clock) as recorder:
+        recorder.record("202305021211", make_odds([5.0]), timestamp=NOON - DAY)
+        recorder.flush()
+        index_size = os.path.getsize(tmp_path / "index.json")
+
+        for i in range(200):
+            recorder.record(f"2023050212{i % 12:02}", make_odds([5.0, 2.0]), NOON + i)
+            recorder.flush()
+        assert len(os.listdir(tmp_path)) == 3
+        assert os.path.getsize(tmp_path / "index.json") == index_size
+
+    archive = OddsArchive(tmp_path)
+    assert len(archive.race_ids) == 12
+    assert len(archive.records("202305021200")) == 2 * 17
+
+
+def test_reload(recorder):
+    archive = recorder.archive()
+    recorder.record("202305021211", make_odds([5.0, 2.0]))
+    recorder.flush()
+    assert "202305021211" not in archive
+    archive.reload()
+    assert "202305021211" in archive
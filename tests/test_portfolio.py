@@ -0,0 +1,183 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.helpers import make_card
+from src.portfolio import DayPortfolio
+from src.pred_store import PredStore
+from src.race_id import make_race_id
+
+
+@pytest.fixture
+def card():
+    return make_card(6)
+
+
+@pytest.fixture
+def portfolio(card):
+    store, _ = card
+    portfolio = DayPortfolio(bankroll=10000, kelly_fraction=0.5)
+    portfolio.load_day(store, "23", "0505")
+    return portfolio
+
+
+def total(stakes):
+    return sum(int(bet.sum()) for bet in stakes.values())
+
+
+def test_stakes_within_bankroll(portfolio, card):
+    _, odds = card
+    for race_id, race_odds in odds.items():
+        portfolio.update_odds(race_id, race_odds)
+
+    stakes = portfolio.stakes()
+
+    assert list(stakes) == list(odds)
+    assert 0 < total(stakes) <= 10000
+    for bet in stakes.values():
+        assert bet.dtype == int
+        assert np.all(bet.values % 100 == 0)
+
+
+def test_stakes_follow_edge(portfolio, card):
+    """期待値が1を超える馬がいないレースには賭けず, 優位の大きいレースに多く賭ける"""
+    store, odds = card
+    race_ids = list(odds)
+    no_edge = race_ids[0]
+    pred = pd.Series(store.races_on("23", "0505")[0][1]["pred"])
+    portfolio.update_odds(no_edge, 0.8 / pred)
+    for race_id in race_ids[1:]:
+        portfolio.update_odds(race_id, odds[race_id])
+
+    stakes = portfolio.stakes()
+
+    assert stakes[no_edge].sum() == 0
+    exposure = {
+        race_id: portfolio._positions[race_id].fraction.sum()
+        for race_id in race_ids[1:]
+    }
+    most = max(exposure, key=exposure.get)
+    least = min(exposure, key=exposure.get)
+    assert stakes[most].sum() >= stakes[least].sum()
+
+
+def test_reserve_for_unpriced_races(portfolio, card):
+    """オッズが届いていないレースにも届いたレースと同じだけの資金を確保する"""
+    _, odds = card
+    race_id = list(odds)[2]
+    portfolio.update_odds(race_id, odds[race_id])
+    exposure = portfolio._positions[race_id].fraction.sum()
+
+    stake = portfolio.stakes()[race_id]
+
+    # 6レース分の配分の合計が資金を超えないように縮める
+    expected = 10000 * min(0.5, 1 / (6 * exposure)) * exposure
+    assert exposure > 0
+    assert abs(stake.sum() - expected) <= 50 * len(stake)
+
+
+def test_select_bet_fixes_stakes(portfolio, card):
+    store, odds = card
+    race_ids = list(odds)
+    pred = pd.Series(store.races_on("23", "0505")[0][1]["pred"])
+
+    bet = portfolio.select_bet(pred, odds[race_ids[0]], race_ids[0])
+
+    assert list(bet.index)[-1] == "not_bet"
+    assert bet["not_bet"] == 0
+    assert portfolio.remaining == 10000 - bet.sum()
+    # 発走したレースは以降の配分に含めず, オッズが変わっても掛け金を変えない
+    portfolio.update_odds(race_ids[0], odds[race_ids[0]] * 2)
+    assert race_ids[0] not in portfolio.stakes()
+    again = portfolio.select_bet(pred, odds[race_ids[0]] * 2, race_ids[0])
+    pd.testing.assert_series_equal(again, bet)
+
+
+def test_whole_day(portfolio, card):
+    """当日の全レースを順に決めても資金を超えない"""
+    store, odds = card
+    for _, race in store.races_on("23", "0505"):
+        race_id = make_race_id(
+            "23", race["JyoCD"], race["Kaiji"], race["Nichiji"], race["RaceNum"]
+        )
+        portfolio.select_bet(pd.Series(race["pred"]), odds[race_id], race_id)
+        assert portfolio.remaining >= 0
+    assert portfolio.stakes() == {}
+
+
+def test_update_odds_is_incremental(portfolio, card):
+    _, odds = card
+    race_ids = list(odds)
+    for race_id in race_ids:
+        portfolio.update_odds(race_id, odds[race_id])
+    before = dict(portfolio._positions)
+
+    portfolio.update_odds(race_ids[2], odds[race_ids[2]] * 1.1)
+
+    for race_id in race_ids:
+        assert (portfolio._positions[race_id] is before[race_id]) == (
+            race_id != race_ids[2]
+        )
+
+
+def test_unknown_race(portfolio):
+    with pytest.raises(KeyError):
+        portfolio.update_odds("230999999999", pd.Series({"1": 2.0}))
+    # 予測を渡せば追加する
+    portfolio.update_odds(
+        "230999999999", pd.Series({"1": 2.5, "2": 2.0}), pd.Series({"1": 0.6, "2": 0.4})
+    )
+    assert "230999999999" in portfolio.stakes()
+
+
+def test_load_day(portfolio, card):
+    store, odds = card
+    race_id = list(odds)[0]
+    portfolio.update_odds(race_id, odds[race_id])
+
+    # 同じ日の読み直しではオッズを残す
+    portfolio.load_day(store, "23", "0505")
+    assert race_id in portfolio.stakes()
+
+    # 日付が変わったら前日の配分を捨てる
+    portfolio.load_day(store, "23", "0506")
+    assert portfolio.stakes() == {}
+    assert portfolio.remaining == 10000
+
+
+def test_state_dir(card, tmp_path):
+    """固定した掛け金は日ごとのファイルに残り, 別のインスタンスでも同じ日なら資金から除く"""
+    store, odds = card
+    race_id = list(odds)[0]
+    pred = pd.Series(store.races_on("23", "0505")[0][1]["pred"])
+    portfolio = DayPortfolio(bankroll=10000, state_dir=str(tmp_path))
+    portfolio.load_day(store, "23", "0505")
+    bet = portfolio.select_bet(pred, odds[race_id], race_id)
+
+    restarted = DayPortfolio(bankroll=10000, state_dir=str(tmp_path))
+    restarted.load_day(store, "23", "0505")
+    assert restarted.remaining == 10000 - bet.sum()
+    assert race_id not in restarted.stakes()
+    pd.testing.assert_series_equal(
+        restarted.select_bet(pred, odds[race_id] * 2, race_id), bet
+    )
+
+    restarted.load_day(store, "23", "0506")
+    assert restarted.remaining == 10000
+
+
+def test_full_card_speed():
+    """3場36レースの再計算が1秒を大きく下回る"""
+    store, odds = make_card(36)
+    portfolio = DayPortfolio(bankroll=100000)
+    portfolio.load_day(store, "23", "0505")
+    for race_id, race_odds in odds.items():
+        portfolio.update_odds(race_id, race_odds)
+
+    start = time.perf_counter()
+    portfolio.update_odds(list(odds)[10], odds[list(odds)[10]] * 1.05)
+    stakes = portfolio.stakes()
+    assert time.perf_counter() - start < 0.5
+    assert total(stakes) <= 100000
@@ -0,0 +1,138 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.load_pred import PredLoader
+from src.pred_archive import (
+    PredArchive,
+    convert_json_to_archive,
+    is_pred_archive,
+    write_pred_archive,
+)
+
+pred_json = {
+    "23": {
+        "0514": {
+            "1540": {
+                "JyoCD": "05",
+                "RaceNum": "11",
+                "Title": "ヴィクトリアマイル",
+                "pred": {"1": 0.25, "2": 0.5, "10": 0.25},
+            },
+            "10:10": {"JyoCD": "05", "RaceNum": "3", "pred": {"1": 0.5, "2": 0.5}},
+        },
+        "0513": {"1000": {"JyoCD": "08", "RaceNum": "1", "pred": {"3": 1.0}}},
+    }
+}
+
+
+@pytest.fixture
+def archive_path(tmp_path):
+    path = tmp_path / "archive"
+    write_pred_archive(pred_json, path)
+    return path
+
+
+def test_round_trip(archive_path):
+    assert PredArchive(archive_path).to_json() == pred_json
+
+
+def test_round_trip_types(tmp_path):
+    """予測確率はfloat32で表せない値も, メタデータは型もそのまま戻す"""
+    pred = {
+        "23": {
+            "0514": {
+                "1540": {
+                    "JyoCD": "05",
+                    "Kyori": 1600,
+                    "Odds": 2.5,
+                    "Handicap": True,
+                    "Grade": None,
+                    "Mixed": 1,
+                    "pred": {"1": 0.05277636572, "2": 0.94722363428},
+                },
+                "1620": {
+                    "JyoCD": "05",
+                    "Kyori": 2400,
+                    "Mixed": "A",
+                    "pred": {"1": 1 / 3, "2": 2 / 3},
+                },
+            }
+        }
+    }
+    write_pred_archive(pred, tmp_path)
+    archive = PredArchive(tmp_path)
+
+    restored = archive.to_json()
+    assert restored == pred
+    race = restored["23"]["0514"]["1540"]
+    assert [type(race[key]) for key in ("Kyori", "Odds", "Handicap", "Mixed")] == [
+        int,
+        float,
+        bool,
+        int,
+    ]
+    assert "Odds" not in restored["23"]["0514"]["1620"]
+    assert archive.races_on("23", "0514") == pred["23"]["0514"]
+    assert archive.meta_column("Kyori") == [1600, 2400]
+    assert archive.meta_column("Grade") == [None, None]
+
+
+def test_columns(archive_path):
+    archive = PredArchive(archive_path)
+    assert len(archive) == 3
+    assert archive.meta_columns == ["JyoCD", "RaceNum", "Title"]
+
+    # 日付・発走時刻の順に並ぶ
+    assert list(archive.races["month_day"]) == ["0513", "0514", "0514"]
+    assert list(archive.races["minutes"]) == [600, 610, 940]
+    assert archive.pred.dtype == np.float64
+    assert len(archive.pred) == 6
+
+
+def test_memory_map(archive_path):
+    archive = PredArchive(archive_path)
+    assert isinstance(archive.pred, np.memmap)
+    assert isinstance(archive.races, np.memmap)
+
+    umaban, pred = archive.race_pred(2)
+    assert list(umaban) == [1, 2, 10]
+    assert np.shares_memory(pred, archive.pred)
+
+
+def test_races_on(archive_path):
+    archive = PredArchive(archive_path)
+    races = archive.races_on("23", "0514")
+    assert list(races) == ["10:10", "1540"]
+    assert races == pred_json["23"]["0514"]
+    assert archive.races_on("23", "0101") == {}
+
+
+def test_convert(tmp_path):
+    json_path = tmp_path / "pred.json"
+    json_path.write_text(json.dumps(pred_json))
+    convert_json_to_archive(json_path, tmp_path / "archive")
+    assert is_pred_archive(tmp_path / "archive")
+    assert not is_pred_archive(json_path)
+
+
+def test_reserved_column(tmp_path):
+    with pytest.raises(ValueError):
+        write_pred_archive({"23": {"0514": {"1000": {"count": "1"}}}}, tmp_path)
+
+
+def test_not_archive(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        PredArchive(tmp_path)
+
+
+def test_loader(archive_path):
+    """PredLoaderは予測JSONと同じように予測アーカイブを読み込む"""
+    loader = PredLoader(archive_path)
+    assert loader.data == pred_json
+    assert loader.archive is not None
+
+    loader = PredLoader(archive_path, "23", "0513")
+    assert loader.data == {"23": {"0513": pred_json["23"]["0513"]}}
+    assert len(loader.store) == 1
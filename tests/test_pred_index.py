@@ -0,0 +1,63 @@
+import io
+import json
+import os
+
+import pytest
+
+from src.pred_index import build_day_index, load_day, read_day_index
+
+pred_json = {
+    "23": {
+        "0513": {"1010": {"Title": 'カッコ "{" を含む\\', "pred": {"1": 0.4}}},
+        "0514": {
+            "1540": {"JyoCD": "05", "pred": {"1": 0.25, "2": 0.75}},
+            "1610": {"JyoCD": "05", "pred": {"1": 0.5, "2": 0.5}},
+        },
+        "0515": {},
+    },
+    "24": {"0101": {"1000": {"JyoCD": "06", "pred": {}}}},
+}
+
+
+@pytest.fixture(params=[None, 2])
+def content(request):
+    return json.dumps(pred_json, indent=request.param, ensure_ascii=False).encode()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64, 1 << 20])
+def test_build_day_index(content, chunk_size):
+    index = build_day_index(io.BytesIO(content), chunk_size)
+    assert {year: set(days) for year, days in index.items()} == {
+        "23": {"0513", "0514", "0515"},
+        "24": {"0101"},
+    }
+    for year, days in pred_json.items():
+        for month_day, races in days.items():
+            start, end = index[year][month_day]
+            assert json.loads(content[start:end]) == races
+
+
+def test_load_day_from_stream(content):
+    stream = io.BytesIO(content)
+    assert load_day(stream, "23", "0514") == pred_json["23"]["0514"]
+    assert load_day(content, "24", "0101") == pred_json["24"]["0101"]
+    assert load_day(content, "23", "0101") == {}
+
+
+def test_load_day_from_file(content, tmp_path):
+    path = tmp_path / "pred.json"
+    path.write_bytes(content)
+
+    assert load_day(path, "23", "0513") == pred_json["23"]["0513"]
+    assert os.path.exists(f"{path}.idx.json")
+
+    # ファイルが変わったら索引を作り直す
+    updated = {"23": {"0514": {"0950": {"pred": {"3": 1.0}}}}}
+    path.write_bytes(json.dumps(updated).encode())
+    assert read_day_index(path)["23"].keys() == {"0514"}
+    assert load_day(path, "23", "0514") == updated["23"]["0514"]
+
+
+def test_truncated(content):
+    with pytest.raises(ValueError):
+        build_day_index(io.BytesIO(content[:-10]))
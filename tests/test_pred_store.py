@@ -0,0 +1,85 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from main import is_time_difference_within_5_to_10_minutes
+from src.pred_store import PredStore, parse_race_time, to_minutes
+
+
+def make_race(race_time):
+    return {"RaceTime": race_time}
+
+
+@pytest.fixture
+def store():
+    return PredStore(
+        {
+            "23": {
+                "0514": {
+                    "1540": make_race("1540"),
+                    "0950": make_race("0950"),
+                    "10:25": make_race("1025"),
+                    "1025": make_race("1025b"),
+                    "1100": make_race("1100"),
+                },
+                "0513": {"1000": make_race("0513")},
+            }
+        }
+    )
+
+
+def test_parse_race_time():
+    assert parse_race_time("0950") == datetime.time(9, 50)
+    assert parse_race_time("15:40") == datetime.time(15, 40)
+    assert to_minutes("15:40") == 940
+    with pytest.raises(ValueError):
+        parse_race_time("9:5")
+
+
+def test_races_on(store):
+    assert [minutes for minutes, _ in store.races_on("23", "0514")] == [
+        590,
+        625,
+        625,
+        660,
+        940,
+    ]
+    assert store.races_on("23", "0101") == []
+    assert len(store) == 6
+
+
+def test_races_between(store):
+    races = store.races_between("23", "0514", 625, 660)
+    assert races == [make_race("1025"), make_race("1025b"), make_race("1100")]
+    assert store.races_between("23", "0514", 626, 659) == []
+    assert store.races_between("24", "0514", 0, 1440) == []
+
+
+def test_races_starting_within(store):
+    races = store.races_starting_within("23", "0514", "1015", 5, 10)
+    assert races == [make_race("1025"), make_race("1025b")]
+
+
+def test_skip_invalid_race_time():
+    store = PredStore({"23": {"0514": {"1000": make_race("1000"), "x": {}}}})
+    assert len(store) == 1
+
+
+def test_same_as_linear_scan():
+    """全レースをstrptimeで比較する従来の方法と同じレースを返す"""
+    rng = np.random.default_rng(0)
+    times = sorted(
+        {f"{h:02}{m:02}" for h, m in rng.integers([9, 0], [17, 60], (200, 2))}
+    )
+    json = {"23": {"0514": {t: make_race(t) for t in times}}}
+    store = PredStore(json)
+
+    for now_minutes in range(8 * 60, 17 * 60, 7):
+        now_time = f"{now_minutes // 60:02}{now_minutes % 60:02}"
+        expected = [
+            race
+            for race_time, race in json["23"]["0514"].items()
+            if is_time_difference_within_5_to_10_minutes(race_time, now_time)
+        ]
+        assert store.races_starting_within("23", "0514", now_time, 5, 10) == expected
@@ -0,0 +1,209 @@
+import datetime
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+from src.concurrent_scraper import ConcurrentOddsScraper
+from src.prefetch import OddsPrefetcher
+from src.pred_store import PredStore
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeScraper:
+    """呼び出しごとにオッズの値が増え, 待ち時間や失敗を指定できるスクレイパー"""
+
+    base_url = "https://race.netkeiba.com/odds/index.html?type=b1&"
+
+    def __init__(self):
+        self.calls = []
+        self.delay = 0.0
+        self.error = None
+        self._lock = threading.Lock()
+
+    def get_odds_by_race(self, year, jyo, kaiji, nichiji, race_num):
+        with self._lock:
+            self.calls.append((year, jyo, kaiji, nichiji, race_num))
+            value = float(len(self.calls))
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return pd.Series({"1": value, "2": value + 1})
+
+
+def make_pred(race_nums):
+    # 10時から10分おきに発走する
+    return {
+        "23": {
+            "0505": {
+                f"{10 + i // 6:02}{i % 6 * 10:02}": {
+                    "JyoCD": "05",
+                    "Kaiji": "02",
+                    "Nichiji": "08",
+                    "RaceNum": race_num,
+                }
+                for i, race_num in enumerate(race_nums)
+            }
+        }
+    }
+
+
+def race_id(race_num):
+    return f"23050208{race_num}"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(datetime.datetime(2023, 5, 5, 9, 56))
+
+
+@pytest.fixture
+def scraper():
+    return FakeScraper()
+
+
+@pytest.fixture
+def prefetcher(scraper, clock):
+    prefetcher = OddsPrefetcher(
+        scraper,
+        lead_time=datetime.timedelta(minutes=15),
+        decision_lead_time=datetime.timedelta(minutes=2),
+        max_staleness=datetime.timedelta(minutes=2),
+        refresh_timeout=0.2,
+        clock=clock,
+    )
+    prefetcher.load(PredStore(make_pred(["10", "11", "12"])), datetime.date(2023, 5, 5))
+    yield prefetcher
+    prefetcher.close()
+
+
+def wait_idle(prefetcher):
+    while prefetcher._inflight:
+        time.sleep(0.01)
+
+
+def test_load(prefetcher, clock):
+    assert len(prefetcher) == 3
+    # 読み直しでは追加のレースだけを加える. 発走済みのレースは加えない
+    clock.now = datetime.datetime(2023, 5, 5, 10, 5)
+    pred = PredStore(make_pred(["10", "11", "12", "01", "02"]))
+    assert prefetcher.load(pred) == 2
+    pred = PredStore(make_pred(["09", "10", "11", "12"]))
+    assert prefetcher.load(pred) == 0
+
+
+def test_refresh_due(prefetcher, scraper, clock):
+    """発走の lead_time 前に入ったレースだけを先読みする"""
+    # 9:56 には 10:00, 10:10 発走が対象
+    assert prefetcher.refresh_due() == 2
+    wait_idle(prefetcher)
+    assert prefetcher.latest(race_id("10")).fetched_at == clock.now
+    assert prefetcher.latest(race_id("12")) is None
+
+    # 発走したレースは対象から外れる
+    clock.now = datetime.datetime(2023, 5, 5, 10, 6)
+    assert prefetcher.refresh_due() == 2
+    wait_idle(prefetcher)
+    assert prefetcher.latest(race_id("10")) is None
+    assert len(prefetcher) == 2
+    assert len(scraper.calls) == 4
+
+
+def test_no_prefetch_after_decision(prefetcher, scraper, clock):
+    """判断時刻を過ぎたレースは発走前でも先読みしない"""
+    # 10:00 発走の判断時刻は 9:58
+    clock.now = datetime.datetime(2023, 5, 5, 9, 58)
+    assert prefetcher.refresh_due() == 1
+    wait_idle(prefetcher)
+    assert [call[-1] for call in scraper.calls] == ["11"]
+    assert prefetcher.latest(race_id("10")) is None
+    assert len(prefetcher) == 3
+
+
+def test_refresh_due_skips_inflight(prefetcher, scraper):
+    scraper.delay = 0.1
+    assert prefetcher.refresh_due() == 2
+    assert prefetcher.refresh_due() == 0
+    wait_idle(prefetcher)
+    assert prefetcher.refresh_due() == 2
+
+
+def test_final_refresh(prefetcher, scraper):
+    """判断時刻には先読みがあっても取得し直す"""
+    prefetcher.refresh_due()
+    wait_idle(prefetcher)
+    prefetched = prefetcher.latest(race_id("10")).odds
+
+    odds = prefetcher.get_odds_by_race("23", "05", "02", "08", "10")
+    assert odds["1"] > prefetched["1"]
+    assert prefetcher.latest(race_id("10")).odds.equals(odds)
+
+
+def test_late_refresh_uses_snapshot(prefetcher, scraper, clock):
+    """取得が間に合わない場合は古さの上限以内の先読みしたオッズを使う"""
+    prefetcher.refresh_due()
+    wait_idle(prefetcher)
+    prefetched = prefetcher.latest(race_id("10")).odds
+
+    scraper.delay = 1.0
+    clock.now += datetime.timedelta(minutes=1)
+    start = time.monotonic()
+    odds = prefetcher.get_odds_by_race("23", "05", "02", "08", "10")
+    assert time.monotonic() - start < 0.5
+    assert odds.equals(prefetched)
+
+
+def test_stale_snapshot(prefetcher, scraper, clock):
+    prefetcher.refresh_due()
+    wait_idle(prefetcher)
+
+    scraper.delay = 1.0
+    clock.now += datetime.timedelta(minutes=3)
+    with pytest.raises(TimeoutError):
+        prefetcher.get_odds_by_race("23", "05", "02", "08", "10")
+
+
+def test_failed_refresh(prefetcher, scraper):
+    # 先読みが無ければ取得の例外をそのまま返す
+    scraper.error = ValueError("オッズ表が見つかりません")
+    with pytest.raises(ValueError):
+        prefetcher.get_odds_by_race("23", "05", "02", "08", "10")
+
+    scraper.error = None
+    prefetcher.refresh_due()
+    wait_idle(prefetcher)
+    scraper.error = ValueError("オッズ表が見つかりません")
+    assert prefetcher.get_odds_by_race("23", "05", "02", "08", "10")["1"] > 0
+
+
+def test_concurrent_scraper(prefetcher, scraper):
+    """ConcurrentOddsScraper にスクレイパーの代わりに渡せる"""
+    prefetcher.refresh_due()
+    wait_idle(prefetcher)
+    scraper.delay = 1.0
+
+    races = [
+        {"JyoCD": "05", "Kaiji": "02", "Nichiji": "08", "RaceNum": race_num}
+        for race_num in ["10", "11"]
+    ]
+    start = time.monotonic()
+    results = list(ConcurrentOddsScraper(prefetcher).fetch_all("23", races))
+    assert time.monotonic() - start < 0.5
+    assert all(result.error is None for result in results)
+
+
+def test_background(scraper, clock):
+    with OddsPrefetcher(scraper, interval=0.05, clock=clock) as prefetcher:
+        # 10:10 発走は 9:55 から 10:03 まで先読みする
+        prefetcher.load(PredStore(make_pred(["09", "10"])), datetime.date(2023, 5, 5))
+        prefetcher.start()
+        time.sleep(0.3)
+    assert len(scraper.calls) >= 2
@@ -0,0 +1,203 @@
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from src.read_google_drive_json import GoogleDriveJsonReader
+
+pred_json = {"23": {"0514": {"1540": {"JyoCD": "05", "RaceNum": "11"}}}}
+
+
+class FakeRequest:
+    def __init__(self, func):
+        self._func = func
+
+    def execute(self):
+        return self._func()
+
+
+class FakeMediaRequest:
+    """MediaIoBaseDownload が使う uri / headers / http だけを持つ get_media のリクエスト"""
+
+    def __init__(self, func):
+        self.uri = "https://www.googleapis.com/drive/v3/files/id?alt=media"
+        self.headers = {}
+        self.http = self
+        self.ranges = []
+        self._func = func
+
+    def request(self, uri, method, headers):
+        content = self._func()
+        start, end = map(int, headers["range"].split("=")[1].split("-"))
+        self.ranges.append((start, end))
+        chunk = content[start : end + 1]
+        response = httplib2.Response(
+            {
+                "status": 206,
+                "content-range": f"bytes {start}-{start + len(chunk) - 1}/{len(content)}",
+            }
+        )
+        return response, chunk
+
+
+class FakeDriveService:
+    """files().list / get / get_media だけを持つDrive APIの代わり"""
+
+    def __init__(self):
+        self.files_by_id = {}
+        self.calls = []
+
+    def put(self, file_id, name, content, modified_time):
+        data = json.dumps(content).encode()
+        self.files_by_id[file_id] = {
+            "name": name,
+            "content": data,
+            "metadata": {
+                "id": file_id,
+                "modifiedTime": modified_time,
+                "md5Checksum": str(hash(data)),
+                "size": str(len(data)),
+            },
+        }
+
+    def files(self):
+        return self
+
+    def list(self, q):
+        self.calls.append("list")
+        name = q.split("'")[1]
+        return FakeRequest(
+            lambda: {
+                "files": [
+                    {"id": file_id}
+                    for file_id, file in self.files_by_id.items()
+                    if file["name"] == name
+                ]
+            }
+        )
+
+    def get(self, fileId, fields):
+        self.calls.append("get")
+        return FakeRequest(
+            lambda: {
+                key: value
+                for key, value in self._file(fileId)["metadata"].items()
+                if key in fields.split(",")
+            }
+        )
+
+    def get_media(self, fileId):
+        self.calls.append("get_media")
+        self.media_request = FakeMediaRequest(lambda: self._file(fileId)["content"])
+        return self.media_request
+
+    def _file(self, file_id):
+        if file_id not in self.files_by_id:
+            raise HttpError(httplib2.Response({"status": 404}), b"not found")
+        return self.files_by_id[file_id]
+
+
+@pytest.fixture
+def service():
+    service = FakeDriveService()
+    service.put("id1", "pred.json", pred_json, "2023-05-14T00:00:00Z")
+    return service
+
+
+def make_reader(service, cache_dir=None, **kwargs):
+    return GoogleDriveJsonReader(
+        None, None, "pred.json", cache_dir=cache_dir, service=service, **kwargs
+    )
+
+
+def test_read(service):
+    reader = make_reader(service)
+    assert reader.json == pred_json
+    assert len(reader.store) == 1
+    assert service.calls == ["list", "get", "get_media"]
+    assert reader.metadata["size"] == str(len(json.dumps(pred_json).encode()))
+
+
+def test_not_found(service):
+    with pytest.raises(FileNotFoundError):
+        GoogleDriveJsonReader(None, None, "missing.json", service=service)
+
+
+def test_refresh_without_change(service):
+    reader = make_reader(service)
+    store = reader.store
+    service.calls.clear()
+
+    assert not reader.refresh()
+    assert service.calls == ["get"]
+    assert reader.store is store
+
+
+def test_refresh_with_change(service):
+    reader = make_reader(service)
+    store = reader.store
+    updated = {"23": {"0514": {}}}
+    service.put("id1", "pred.json", updated, "2023-05-14T01:00:00Z")
+    service.calls.clear()
+
+    assert reader.refresh()
+    assert service.calls == ["get", "get_media"]
+    assert reader.json == updated
+    assert reader.store is not store
+
+
+def test_file_replaced(service):
+    """同じ名前のファイルが作り直された場合は名前で検索し直す"""
+    reader = make_reader(service)
+    del service.files_by_id["id1"]
+    service.put("id2", "pred.json", {}, "2023-05-14T01:00:00Z")
+
+    assert reader.refresh()
+    assert reader.json == {}
+    assert reader.metadata["id"] == "id2"
+
+
+def test_disk_cache(service, tmp_path):
+    make_reader(service, tmp_path)
+    service.calls.clear()
+
+    # 再起動後も変わっていなければダウンロードせず, 検索もしない
+    reader = make_reader(service, tmp_path)
+    assert reader.json == pred_json
+    assert service.calls == ["get"]
+
+    service.put("id1", "pred.json", {}, "2023-05-14T01:00:00Z")
+    service.calls.clear()
+    reader = make_reader(service, tmp_path)
+    assert reader.json == {}
+    assert service.calls == ["get", "get_media"]
+
+
+@pytest.mark.parametrize("use_cache_dir", [False, True])
+def test_download_in_chunks(service, tmp_path, use_cache_dir):
+    """チャンクごとにダウンロードし, キャッシュのファイルには索引も保存する"""
+    reader = make_reader(service, tmp_path if use_cache_dir else None, chunk_size=16)
+    size = len(json.dumps(pred_json).encode())
+
+    assert reader.json == pred_json
+    ranges = service.media_request.ranges
+    assert len(ranges) == -(-size // 16)
+    assert ranges[0] == (0, 15)
+    if use_cache_dir:
+        assert (tmp_path / "id1.json").stat().st_size == size
+        assert (tmp_path / "id1.json.idx.json").exists()
+        assert not (tmp_path / "id1.json.tmp").exists()
+
+
+@pytest.mark.parametrize("use_cache_dir", [False, True])
+def test_day_store(service, tmp_path, use_cache_dir):
+    reader = make_reader(service, tmp_path if use_cache_dir else None)
+    store = reader.day_store("23", "0514")
+    assert len(store) == 1
+    assert reader.day_store("23", "0514") is store
+    assert len(reader.day_store("23", "0515")) == 0
+
+    service.put("id1", "pred.json", {"23": {"0514": {}}}, "2023-05-14T01:00:00Z")
+    reader.refresh()
+    assert len(reader.day_store("23", "0514")) == 0
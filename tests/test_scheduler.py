@@ -0,0 +1,121 @@
+import datetime
+
+import pytest
+
+from src.scheduler import RaceScheduler
+
+
+class FakeClock:
+    """sleepで時刻が進む時計"""
+
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += datetime.timedelta(seconds=seconds)
+
+
+def make_race(race_num):
+    return {"JyoCD": 5, "Kaiji": 2, "Nichiji": 12, "RaceNum": race_num}
+
+
+@pytest.fixture
+def clock():
+    return FakeClock(datetime.datetime(2023, 5, 14, 9, 0))
+
+
+@pytest.fixture
+def scheduler(clock):
+    return RaceScheduler(clock=clock, sleep=clock.sleep)
+
+
+@pytest.fixture
+def pred_json():
+    return {
+        "23": {
+            "0514": {
+                "1010": make_race(1),
+                "10:40": make_race(2),
+                "1110": make_race(3),
+            }
+        }
+    }
+
+
+def test_wake_at_decision_time(scheduler, clock, pred_json):
+    assert scheduler.load(pred_json) == 3
+
+    assert scheduler.wait_next() == [make_race(1)]
+    assert clock.now == datetime.datetime(2023, 5, 14, 10, 3)
+
+    assert scheduler.wait_next() == [make_race(2)]
+    assert clock.now == datetime.datetime(2023, 5, 14, 10, 33)
+
+
+def test_post_time(scheduler, clock, pred_json):
+    scheduler.load(pred_json)
+    assert scheduler.post_time("2305021201") is None
+
+    scheduler.wait_next()
+    assert scheduler.post_time("2305021201") == datetime.datetime(2023, 5, 14, 10, 10)
+
+
+def test_no_drift(scheduler, clock, pred_json):
+    """処理に時間がかかっても次の判断時刻はずれない"""
+    scheduler.load(pred_json)
+    scheduler.wait_next()
+    clock.now += datetime.timedelta(seconds=95)
+    scheduler.wait_next()
+    assert clock.now == datetime.datetime(2023, 5, 14, 10, 33)
+
+
+def test_catch_up_missed_deadline(scheduler, clock, pred_json):
+    """判断時刻を過ぎても発走まで余裕があれば処理し, 間に合わなければ飛ばす"""
+    clock.now = datetime.datetime(2023, 5, 14, 10, 39)
+    scheduler.load(pred_json)
+    assert scheduler.pop_due() == []
+
+    clock.now = datetime.datetime(2023, 5, 14, 10, 35)
+    scheduler = RaceScheduler(clock=clock, sleep=clock.sleep)
+    scheduler.load(pred_json)
+    assert scheduler.pop_due() == [make_race(2)]
+
+
+def test_skip_past_races(scheduler, clock, pred_json):
+    clock.now = datetime.datetime(2023, 5, 14, 10, 50)
+    assert scheduler.load(pred_json) == 1
+
+
+def test_dedupe(scheduler, clock, pred_json):
+    scheduler.load(pred_json)
+    scheduler.wait_next()
+
+    # 読み直しても処理済み・登録済みのレースは追加しない
+    assert scheduler.load(pred_json) == 0
+    assert len(scheduler) == 2
+
+    pred_json["23"]["0514"]["1140"] = make_race(4)
+    assert scheduler.load(pred_json) == 1
+
+
+def test_max_wait(scheduler, clock, pred_json):
+    scheduler.load(pred_json)
+    assert scheduler.wait_next(datetime.timedelta(minutes=30)) == []
+    assert clock.now == datetime.datetime(2023, 5, 14, 9, 30)
+
+
+def test_empty(scheduler, clock):
+    scheduler.load({})
+    assert scheduler.wait_next() == []
+    assert scheduler.next_decision_at is None
+
+
+def test_same_decision_time(scheduler, clock):
+    scheduler.load({"23": {"0514": {"1010": make_race(1)}}})
+    scheduler.load({"23": {"0514": {"10:10": make_race(2)}}})
+    assert scheduler.wait_next() == [make_race(1), make_race(2)]
@@ -1,7 +1,18 @@
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
 import pytest
 
+from tests.helpers import make_ticket_odds_response
+from src.driver_pool import ChromeDriverPool
+from src.odds_client import HttpOddsFetcher
+from src.odds_recorder import OddsArchive, OddsRecorder
 from src.scraper import OddsScraper
 
+DATA_DIR = Path(__file__).parent / "data"
+
 
 @pytest.fixture
 def scraper():
@@ -16,9 +27,9 @@ def test_init(scraper: OddsScraper):
     assert type(scraper) is OddsScraper
 
 
-def test_has_driver(scraper: OddsScraper):
-    """ドライバーを持つかテスト"""
-    assert scraper._driver
+def test_has_driver_pool(scraper: OddsScraper):
+    """ドライバープールを持つかテスト"""
+    assert scraper.driver_pool
 
 
 def test_get_odds(scraper: OddsScraper):
@@ -49,3 +60,147 @@ def test_get_odds_2(scraper):
 
     assert odds["2"] == 1.3
     assert odds["1"] == 3.7
+
+
+class FakeDriver:
+    """記録済みのページを返すドライバー"""
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        race_id = parse_qs(urlparse(url).query)["race_id"][0]
+        self.page_source = (DATA_DIR / f"odds_b1_{race_id}.html").read_text("euc_jp")
+
+    @property
+    def current_url(self):
+        return self.urls[-1] if self.urls else "about:blank"
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def fake_driver():
+    return FakeDriver()
+
+
+@pytest.fixture
+def http_scraper(odds_server, fake_driver):
+    base_url = f"{odds_server.url}/odds/index.html?type=b1&"
+    http_fetcher = HttpOddsFetcher(
+        page_url=base_url,
+        api_url=f"{odds_server.url}/api/api_get_jra_odds.html?",
+        timeout=2.0,
+    )
+    driver_pool = ChromeDriverPool(size=1, driver_factory=lambda: fake_driver)
+    odds_scraper = OddsScraper(base_url, driver_pool, http_fetcher)
+    yield odds_scraper
+    driver_pool.close()
+    http_fetcher.close()
+
+
+def test_get_odds_by_http(http_scraper: OddsScraper, fake_driver: FakeDriver):
+    """ブラウザを使わずにHTTPで取得できるか"""
+    odds = http_scraper.get_odds_by_race(2023, 5, 2, 12, 11)
+    assert odds["1"] == 54.9
+    assert odds["12"] == 8.3
+    assert len(odds) == 18
+    assert fake_driver.urls == []
+
+
+def test_http_same_as_browser(http_scraper: OddsScraper):
+    """HTTPとブラウザで同じ形のオッズが得られるか"""
+    odds_http = http_scraper.get_odds_by_race(2023, 5, 2, 12, 11)
+    odds_browser = http_scraper._get_odds_by_browser("202305021211")
+    pd.testing.assert_series_equal(odds_http, odds_browser)
+
+
+def test_get_odds_by_page(http_scraper: OddsScraper, odds_server, fake_driver):
+    """オッズAPIが使えなければページから取得するか"""
+    odds_server.fail_api = True
+    odds = http_scraper.get_odds_by_race(2023, 5, 2, 12, 11)
+    assert odds["12"] == 8.3
+    assert fake_driver.urls == []
+
+
+def test_api_skips_unavailable_odds(http_scraper: OddsScraper):
+    """取消馬・発売前のオッズは含めない"""
+    odds = http_scraper.get_odds_by_race(2023, 5, 5, 8, 12)
+    assert odds["2"] == 1.3
+    assert odds["1"] == 3.7
+    assert "4" not in odds
+    assert "7" not in odds
+
+
+def test_record_odds(odds_server, fake_driver, tmp_path):
+    """取得したオッズを記録するか"""
+    http_fetcher = HttpOddsFetcher(
+        page_url=f"{odds_server.url}/odds/index.html?type=b1&",
+        api_url=f"{odds_server.url}/api/api_get_jra_odds.html?",
+        timeout=2.0,
+    )
+    driver_pool = ChromeDriverPool(size=1, driver_factory=lambda: fake_driver)
+    with OddsRecorder(tmp_path) as recorder:
+        odds_scraper = OddsScraper(
+            odds_server.url, driver_pool, http_fetcher, recorder=recorder
+        )
+        odds = odds_scraper.get_odds_by_race(2023, 5, 2, 12, 11)
+    driver_pool.close()
+    http_fetcher.close()
+
+    history = OddsArchive(tmp_path).history("202305021211")
+    assert len(history) == 1
+    assert history.iloc[0].to_dict() == pytest.approx(odds.to_dict())
+
+
+def test_fallback_to_browser(odds_server, fake_driver):
+    """HTTPで取得できなければブラウザを使うか"""
+    http_fetcher = HttpOddsFetcher(
+        page_url=f"{odds_server.url}/not_found?",
+        api_url=f"{odds_server.url}/not_found?",
+        timeout=2.0,
+    )
+    driver_pool = ChromeDriverPool(size=1, driver_factory=lambda: fake_driver)
+    odds_scraper = OddsScraper(
+        f"{odds_server.url}/odds/index.html?type=b1&", driver_pool, http_fetcher
+    )
+
+    odds = odds_scraper.get_odds_by_race(2023, 5, 2, 12, 11)
+    assert odds["12"] == 8.3
+    assert len(fake_driver.urls) == 1
+    driver_pool.close()
+
+
+def test_get_ticket_odds_by_race(http_scraper: OddsScraper, odds_server):
+    """馬券種ごとのオッズを同じセッションから取得して頭数を揃えた配列にするか"""
+    for bet_type, odds_type in [("umaren", 4), ("wide", 5), ("umatan", 6)]:
+        odds_server.api_responses[("202305021211", str(odds_type))] = (
+            make_ticket_odds_response(bet_type, 18)
+        )
+    # 18番の馬券が無い三連単
+    odds_server.api_responses[("202305021211", "8")] = make_ticket_odds_response(
+        "sanrentan", 17
+    )
+
+    odds = http_scraper.get_ticket_odds_by_race(2023, 5, 2, 12, 11)
+    assert list(odds) == ["umaren", "wide", "umatan", "sanrentan"]
+    assert odds["umaren"].shape == (18, 18)
+    assert odds["sanrentan"].shape == (18, 18, 18)
+    assert np.isnan(odds["sanrentan"][17]).all()
+    assert not np.isnan(odds["sanrentan"][0, 1, 2])
+    # 並行して取得しても接続は使い回す
+    assert len(odds_server.connections) <= 4
+
+    odds = http_scraper.get_ticket_odds_by_race(2023, 5, 2, 12, 11, ["umaren"])
+    assert list(odds) == ["umaren"]
+
+
+def test_get_ticket_odds_by_race_needs_http(fake_driver):
+    driver_pool = ChromeDriverPool(size=1, driver_factory=lambda: fake_driver)
+    scraper = OddsScraper(
+        "https://race.netkeiba.com/odds/index.html?type=b1&", driver_pool
+    )
+    with pytest.raises(ValueError):
+        scraper.get_ticket_odds_by_race(2023, 5, 2, 12, 11)
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tests.helpers import make_race
+from src.bettor import OptimizeTansyoBettor
+from src.solution_cache import SolutionCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(clock):
+    return SolutionCache(ttl=600, tolerance=0.05, max_entries=2, clock=clock)
+
+
+def store(cache, race_id, pred, odds):
+    bet = pd.Series([100, 0, 900], index=["1", "2", "not_bet"])
+    cache.store(race_id, ["1", "2"], pred, odds, 1000, np.array([0.1, 0, 0.9]), bet, 5)
+    return bet
+
+
+def test_hit(cache):
+    bet = store(cache, "a", [0.6, 0.4], [1.5, 2.5])
+    cached_bet, x0 = cache.lookup("a", ["1", "2"], [0.6, 0.4], [1.5, 2.5], 1000)
+    pd.testing.assert_series_equal(cached_bet, bet)
+    assert x0 is None
+    assert cache.stats["hits"] == 1
+
+
+def test_warm_start(cache):
+    store(cache, "a", [0.6, 0.4], [1.5, 2.5])
+    cached_bet, x0 = cache.lookup("a", ["1", "2"], [0.6, 0.4], [1.5, 2.6], 1000)
+    assert cached_bet is None
+    np.testing.assert_array_equal(x0, [0.1, 0, 0.9])
+    assert cache.stats["warm_starts"] == 1
+
+
+@pytest.mark.parametrize(
+    "index, odds, budget",
+    [
+        (["1", "2"], [1.5, 3.0], 1000),  # オッズが大きく変化
+        (["1", "3"], [1.5, 2.5], 1000),  # 対象の馬が変化
+        (["1", "2"], [1.5, 2.5], 2000),  # 予算が変化
+    ],
+)
+def test_miss(cache, index, odds, budget):
+    store(cache, "a", [0.6, 0.4], [1.5, 2.5])
+    assert cache.lookup("a", index, [0.6, 0.4], odds, budget) == (None, None)
+    assert cache.stats["misses"] == 1
+
+
+def test_ttl(cache, clock):
+    store(cache, "a", [0.6, 0.4], [1.5, 2.5])
+    clock.now = 601
+    assert cache.lookup("a", ["1", "2"], [0.6, 0.4], [1.5, 2.5], 1000) == (None, None)
+    assert len(cache) == 0
+    assert cache.stats["evictions"] == 1
+
+
+def test_max_entries(cache):
+    for race_id in ["a", "b", "c"]:
+        store(cache, race_id, [0.6, 0.4], [1.5, 2.5])
+    assert len(cache) == 2
+    assert cache.lookup("a", ["1", "2"], [0.6, 0.4], [1.5, 2.5], 1000) == (None, None)
+
+
+def test_bettor_uses_cache(cache):
+    bettor = OptimizeTansyoBettor(solution_cache=cache)
+    pred, odds = make_race(12, 0)
+
+    first = bettor.select_bet(pred, odds, race_id="a")
+    second = bettor.select_bet(pred, odds, race_id="a")
+    pd.testing.assert_series_equal(first, second)
+
+    # オッズがわずかに動いた場合は前回の最適解から始め, 少ない反復で同じ結果になる
+    moved = odds * 1.01
+    warm = bettor.select_bet(pred, moved, race_id="a")
+    cold = OptimizeTansyoBettor().select_bet(pred, moved)
+    assert np.abs(warm - cold).max() <= 100
+
+    stats = cache.stats
+    assert stats["hits"] == 1
+    assert stats["warm_starts"] == 1
+    assert stats["cold_solves"] == 1
+    assert stats["warm_iterations"] < stats["cold_iterations"]
+
+
+def test_bettor_without_race_id(cache):
+    bettor = OptimizeTansyoBettor(solution_cache=cache)
+    pred, odds = make_race(8, 1)
+    bettor.select_bet(pred, odds)
+    assert len(cache) == 0
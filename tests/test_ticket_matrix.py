@@ -0,0 +1,124 @@
+from itertools import combinations, permutations
+
+import numpy as np
+import pytest
+
+from tests.helpers import make_ticket_odds_response
+from src.odds_parser import parse_ticket_odds_api
+from src.ticket_matrix import (
+    bet_types,
+    hit_matrix,
+    outcome_combinations,
+    outcome_probabilities,
+    ticket_labels,
+    ticket_odds,
+)
+
+
+def brute_force_hits(bet_type, num_horses):
+    """馬券と着順の結果を1件ずつ比べて的中行列を作る"""
+    places = {"tansyo": 1, "umaren": 2, "wide": 3, "umatan": 2, "sanrentan": 3}
+    outcomes = list(permutations(range(num_horses), places[bet_type]))
+    if bet_type == "tansyo":
+        tickets = [(i,) for i in range(num_horses)]
+    elif bet_type in ("umaren", "wide"):
+        tickets = list(combinations(range(num_horses), 2))
+    else:
+        tickets = list(permutations(range(num_horses), len(outcomes[0])))
+
+    matrix = np.zeros((len(outcomes), len(tickets)))
+    for i, outcome in enumerate(outcomes):
+        for j, ticket in enumerate(tickets):
+            if bet_type in ("umaren", "wide"):
+                matrix[i, j] = set(ticket) <= set(outcome)
+            else:
+                matrix[i, j] = ticket == outcome
+    return matrix
+
+
+@pytest.mark.parametrize("bet_type", bet_types())
+def test_hit_matrix(bet_type):
+    result = hit_matrix(bet_type, 6)
+    assert np.array_equal(result.toarray(), brute_force_hits(bet_type, 6))
+
+
+@pytest.mark.parametrize(
+    "bet_type, num_tickets, num_outcomes, hits_per_outcome",
+    [
+        ("tansyo", 18, 18, 1),
+        ("umaren", 153, 306, 1),
+        ("wide", 153, 4896, 3),
+        ("umatan", 306, 306, 1),
+        ("sanrentan", 4896, 4896, 1),
+    ],
+)
+def test_hit_matrix_size(bet_type, num_tickets, num_outcomes, hits_per_outcome):
+    result = hit_matrix(bet_type, 18)
+    assert result.shape == (num_outcomes, num_tickets)
+    assert result.nnz == num_outcomes * hits_per_outcome
+
+
+def test_hit_matrix_cache():
+    """頭数ごとにキャッシュされるか"""
+    assert hit_matrix("sanrentan", 16) is hit_matrix("sanrentan", 16)
+
+
+def test_ticket_labels():
+    umaban_list = ["1", "2", "3"]
+    assert ticket_labels("tansyo", umaban_list) == ["1", "2", "3"]
+    assert ticket_labels("umaren", umaban_list) == ["1-2", "1-3", "2-3"]
+    assert ticket_labels("umatan", umaban_list)[:3] == ["1>2", "1>3", "2>1"]
+    assert ticket_labels("sanrentan", umaban_list)[0] == "1>2>3"
+
+
+def test_unknown_bet_type():
+    with pytest.raises(ValueError):
+        ticket_labels("wakuren", ["1", "2"])
+
+
+@pytest.mark.parametrize("bet_type", bet_types())
+def test_outcome_probabilities(bet_type):
+    win_prob = np.array([0.5, 0.3, 0.1, 0.1])
+    prob = outcome_probabilities(bet_type, win_prob)
+    assert prob.sum() == pytest.approx(1)
+
+    # 1着の確率は単勝予測確率と一致する
+    winners = outcome_combinations(bet_type, 4)[:, 0]
+    assert np.bincount(winners, weights=prob) == pytest.approx(win_prob)
+
+
+def test_harville():
+    prob = outcome_probabilities("umatan", np.array([0.5, 0.3, 0.2]))
+    # 1着が0, 2着が1: 0.5 * 0.3 / (1 - 0.5)
+    assert prob[0] == pytest.approx(0.3)
+
+
+@pytest.mark.parametrize("bet_type", ["umaren", "wide", "umatan", "sanrentan"])
+def test_ticket_odds(bet_type):
+    """密なオッズの配列から馬券のラベルごとのオッズに戻せるか"""
+    response = make_ticket_odds_response(bet_type, 8, scratched=[4])
+    matrix = parse_ticket_odds_api(response, bet_type)
+    umaban_list = ["1", "2", "3", "5", "6", "8"]
+
+    odds = ticket_odds(bet_type, matrix, umaban_list)
+    table = next(iter(response["data"]["odds"].values()))
+    separator = "-" if bet_type in ("umaren", "wide") else ">"
+    expected = {
+        separator.join(str(int(key[i : i + 2])) for i in range(0, len(key), 2)): float(
+            values[0]
+        )
+        for key, values in table.items()
+        if all(str(int(key[i : i + 2])) in umaban_list for i in range(0, len(key), 2))
+    }
+    assert odds.to_dict() == expected
+    # ticket_labels の並び
+    labels = ticket_labels(bet_type, umaban_list)
+    assert list(odds.index) == [label for label in labels if label in expected]
+
+
+def test_ticket_odds_missing_horses():
+    """配列に無い馬番の馬券とNaNの馬券は含めない"""
+    matrix = np.full((3, 3), np.nan)
+    matrix[0, 1] = matrix[1, 0] = 5.0
+    odds = ticket_odds("umaren", matrix, ["1", "2", "3", "10"])
+    assert odds.to_dict() == {"1-2": 5.0}
@@ -0,0 +1,154 @@
+import json
+import logging
+import urllib.request
+
+import pandas as pd
+import pytest
+
+from src import tracing
+from src.bettor import OptimizeTansyoBettor
+from src.tracing import MetricsRegistry, Tracer
+
+
+class FakeClock:
+    """呼ばれるたびに step 秒進む時計"""
+
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+@pytest.fixture
+def tracer():
+    tracer = Tracer(clock=FakeClock(0.2))
+    previous = tracing.set_tracer(tracer)
+    yield tracer
+    tracing.set_tracer(previous)
+
+
+def test_render_counter_and_gauge():
+    registry = MetricsRegistry()
+    registry.inc("events_total", help="出来事", event="a")
+    registry.inc("events_total", 2, event="a")
+    registry.inc("events_total", event='b"')
+    registry.set("remaining_seconds", 312.5)
+
+    assert registry.get("events_total", event="a") == 3
+    assert registry.render() == (
+        "# HELP events_total 出来事\n"
+        "# TYPE events_total counter\n"
+        'events_total{event="a"} 3\n'
+        'events_total{event="b\\""} 1\n'
+        "# TYPE remaining_seconds gauge\n"
+        "remaining_seconds 312.5\n"
+    )
+
+
+def test_render_histogram():
+    registry = MetricsRegistry()
+    for value in [0.05, 0.3, 0.3, 2.0]:
+        registry.observe("stage_seconds", value, (0.1, 0.5, 1), stage="optimize")
+
+    lines = registry.render().splitlines()
+    assert lines[1:] == [
+        'stage_seconds_bucket{stage="optimize",le="0.1"} 1',
+        'stage_seconds_bucket{stage="optimize",le="0.5"} 3',
+        'stage_seconds_bucket{stage="optimize",le="1"} 3',
+        'stage_seconds_bucket{stage="optimize",le="+Inf"} 4',
+        'stage_seconds_sum{stage="optimize"} 2.65',
+        'stage_seconds_count{stage="optimize"} 4',
+    ]
+
+
+def test_kind_mismatch():
+    registry = MetricsRegistry()
+    registry.inc("metric")
+    with pytest.raises(ValueError):
+        registry.set("metric", 1)
+
+
+def test_span(tracer, caplog):
+    caplog.set_level(logging.INFO, logger="src.tracing")
+    with tracing.span("optimize", race_id="2305021211") as fields:
+        fields["horses"] = 16
+
+    registry = tracer.registry
+    assert registry.get("bet_notify_stage_seconds", stage="optimize") == 1
+    assert 'le="0.25"} 1' in registry.render()
+
+    # 1行のJSONとしてログに出す
+    log = json.loads(caplog.records[-1].getMessage())
+    assert log == {
+        "event": "span",
+        "stage": "optimize",
+        "seconds": pytest.approx(0.2),
+        "status": "ok",
+        "race_id": "2305021211",
+        "horses": 16,
+    }
+
+
+def test_span_error(tracer, caplog):
+    caplog.set_level(logging.INFO, logger="src.tracing")
+    with pytest.raises(ValueError):
+        with tracing.span("odds_parse"):
+            raise ValueError("オッズ表が見つかりません")
+
+    registry = tracer.registry
+    assert registry.get("bet_notify_stage_errors_total", stage="odds_parse") == 1
+    assert registry.get("bet_notify_stage_seconds", stage="odds_parse") == 1
+    assert json.loads(caplog.records[-1].getMessage())["status"] == "error"
+
+
+def test_span_without_log(tracer, caplog, monkeypatch):
+    """INFOのログを出さない場合はJSONを作らずにヒストグラムだけ記録する"""
+    caplog.set_level(logging.WARNING, logger="src.tracing")
+    monkeypatch.setattr(tracing.json, "dumps", pytest.fail)
+    with tracing.span("optimize", race_id="2305021211"):
+        pass
+
+    assert tracer.registry.get("bet_notify_stage_seconds", stage="optimize") == 1
+
+
+def test_count_and_before_post(tracer):
+    tracing.count("odds_browser_fallback")
+    tracer.before_post(312.0)
+
+    registry = tracer.registry
+    assert registry.get("bet_notify_events_total", event="odds_browser_fallback") == 1
+    assert registry.get("bet_notify_seconds_before_post") == 312.0
+    assert registry.get("bet_notify_seconds_before_post_at_notify") == 1
+
+
+def test_bettor_span(tracer):
+    bettor = OptimizeTansyoBettor()
+    bettor.select_bet(
+        pd.Series([0.1, 0.5], index=["1", "2"]), pd.Series([2.0, 3.0], index=["1", "2"])
+    )
+    assert tracer.registry.get("bet_notify_stage_seconds", stage="optimize") == 1
+
+
+def test_write(tmp_path):
+    registry = MetricsRegistry()
+    registry.set("remaining_seconds", 1)
+    path = tmp_path / "metrics" / "bet_notify.prom"
+    registry.write(str(path))
+    assert path.read_text() == registry.render()
+    assert [p.name for p in path.parent.iterdir()] == ["bet_notify.prom"]
+
+
+def test_serve():
+    registry = MetricsRegistry()
+    registry.set("remaining_seconds", 1)
+    server = registry.serve(0)
+    try:
+        url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+        with urllib.request.urlopen(url) as response:
+            assert response.read().decode("utf-8") == registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()